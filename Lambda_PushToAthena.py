@@ -1,150 +1,234 @@
 import json
-import boto3
-import uuid
-import time
-import urllib.parse
-import re
+import os
 
-athena_client = boto3.client('athena')
-quicksight_client = boto3.client('quicksight')  # Initialize QuickSight client
+import aws_clients
+import metrics
+import profiling
+from athena_partitions import PartitionRegistrar, S3Manifest
+from athena_queries import QueryOrchestrator
+from s3_events import Debouncer, IngestionLimiter, group_by_partition, upload_marker
+
+# Clients are created on first use (see aws_clients.py): the QuickSight client is only
+# needed once a query succeeded, and the S3 client only for partition registration
+athena_client = aws_clients.lazy('athena')
+s3_client = aws_clients.lazy('s3')
+quicksight_client = aws_clients.lazy('quicksight')
+
+# "register" adds each new partition with ALTER TABLE; "projection" skips registration for
+# tables with partition projection enabled (see athena_partitions.py)
+PARTITION_MODE = os.environ.get('PARTITION_MODE', 'register')
+PARTITION_MANIFEST_KEY = os.environ.get('PARTITION_MANIFEST_KEY', '_manifests/forest_weather_data_parquet-partitions.json')
+
+# A partition queried less than this many seconds ago (by this instance) is not queried again;
+# only queries that started count, so a failed start is retried by the next upload
+QUERY_DEBOUNCE_SECONDS = float(os.environ.get('QUERY_DEBOUNCE_SECONDS', '60'))
+# Minimum time between QuickSight ingestions; at most one runs at a time
+QUICKSIGHT_MIN_INTERVAL = float(os.environ.get('QUICKSIGHT_MIN_INTERVAL', '60'))
+
+# "wait" polls each query to completion; "async" returns the running execution ids, to be
+# passed back in a later invocation ({"executions": [...]}), e.g. from a Step Functions wait loop
+QUERY_MODE = os.environ.get('QUERY_MODE', 'wait')
+# Reuse results of an identical query up to this age (Athena result reuse and a local cache);
+# partition queries only reuse results of the same uploads (see query_partition)
+RESULT_REUSE_MINUTES = int(os.environ.get('RESULT_REUSE_MINUTES', '5'))
+
+DATABASE = 'default'
+# Table the dashboard query reads; a rollup table (see rollups.py), e.g. forest_weather_region_daily,
+# scans far less than the raw output
+QUERY_TABLE = os.environ.get('QUERY_TABLE', 'forest_weather_data_parquet')
+# Rollup tables by the directory their files are written to (rollups.ROLLUPS; that module
+# needs Spark). Their files are not registered, since the tables use partition projection,
+# and only trigger a query when QUERY_TABLE is that rollup
+ROLLUP_TABLES = {name: f'forest_weather_{name}'
+                 for name in os.environ.get('ROLLUP_NAMES', 'region_hourly,region_daily,daily_summary').split(',')}
+# Partition values are passed as ExecutionParameters (make sure to adjust the query based on your table and columns)
+PARTITION_QUERY = f"""
+    SELECT *
+    FROM "{DATABASE}"."{QUERY_TABLE}"
+    WHERE year = ? AND month = ? AND day = ?
+    """
+
+AWS_ACCOUNT_ID = '329599654349'
+QUICKSIGHT_DATASET_ID = '0d6c3e3d-fec8-46ad-a7ce-329359849637'  # Dataset ID in QuickSight
+
+# One registrar per bucket, kept across warm invocations so known partitions cost nothing
+registrars = {}
+orchestrators = {}
+query_debouncer = Debouncer(QUERY_DEBOUNCE_SECONDS)
+ingestion_limiter = IngestionLimiter(quicksight_client, AWS_ACCOUNT_ID, QUICKSIGHT_MIN_INTERVAL)
+
+# Metrics are printed as one CloudWatch EMF line per invocation
+METRIC_DIMENSIONS = {'Function': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'Lambda_PushToAthena')}
+INVOCATION_SECONDS = metrics.histogram('weather_lambda_invocation_seconds', 'Lambda handler duration')
+FILES_RECEIVED = metrics.counter('weather_s3_files_total', 'Uploaded files in S3 events')
+PARTITIONS_QUERIED = metrics.counter('weather_partitions_queried_total', 'Partitions queried successfully')
+PARTITIONS_FAILED = metrics.counter('weather_partitions_failed_total', 'Partitions whose query failed')
 
 # Define the DataSourceArn variable
 data_source_arn = 'arn:aws:quicksight:us-east-2:329599654349:datasource/96a72470-8dab-4633-9553-c80f44ac60de'  # Correct ARN for your Athena data source
 
+# PROFILE=phases|sample|cprofile profiles every invocation (see profiling.py)
+@profiling.profiled('push_to_athena')
 def lambda_handler(event, context):
-    # Extract the S3 bucket and file key from the event
-    bucket_name = event['Records'][0]['s3']['bucket']['name']
-    object_key = event['Records'][0]['s3']['object']['key']
-    
-    print(f"Lambda triggered by file upload. Bucket: {bucket_name}, Object Key: {object_key}")
-    
-    # URL decode the object key
-    decoded_object_key = urllib.parse.unquote(object_key)
-    print(f"Decoded object key: {decoded_object_key}")
-    
-    # Use regex to extract year, month, and day from the object key
     try:
-        # Regex pattern to extract year, month, and day
-        pattern = r'year=(\d{4})/month=(\d{1,2})/day=(\d{1,2})' # month, day 1 or 2 digits
-        match = re.search(pattern, decoded_object_key)
-        
-        if match:
-            year, month, day = match.groups()
-            print(f"Extracted partition values - Year: {year}, Month: {month}, Day: {day}")
-        else:
-            raise ValueError(f"Unable to extract partition values from object key: {decoded_object_key}")
-        
-    except Exception as e:
-        print(f"Error extracting partition values from object key {decoded_object_key}: {e}")
+        with INVOCATION_SECONDS.time():
+            return handle_event(event)
+    finally:
+        with profiling.phase('metrics'):
+            metrics.emit_emf(dimensions=METRIC_DIMENSIONS)
+
+def handle_event(event):
+    # Resuming an asynchronous run (e.g. from a Step Functions wait loop)
+    if 'executions' in event:
+        return resume_queries(event)
+
+    # Group the uploaded files by partition: a Spark batch writes many part files per day
+    with profiling.phase('parse'):
+        partitions, unmatched = group_by_partition(event)
+    file_count = sum(len(p['keys']) for p in partitions.values()) + len(unmatched)
+    FILES_RECEIVED.inc(file_count)
+    print(f"Lambda triggered by {file_count} file upload(s) "
+          f"in {len(partitions)} partition(s)")
+    for key in unmatched:
+        print(f"Error extracting partition values from object key {key}")
+    if not partitions:
         return {
             'statusCode': 400,
-            'body': json.dumps(f'Error processing the file path: {str(e)}')
+            'body': json.dumps(f'Error processing the file path: no year=/month=/day= partition in {unmatched}')
         }
 
-    # Step 1: Repair the table partitions before running the query
-    try:
-        repair_query = f"MSCK REPAIR TABLE default.forest_weather_data_parquet;"
-        print(f"Running MSCK REPAIR TABLE query: {repair_query}")
-        
-        # Start the Athena query to repair the table
-        repair_response = athena_client.start_query_execution(
-            QueryString=repair_query,
-            QueryExecutionContext={'Database': 'default'},
-            ResultConfiguration={'OutputLocation': f"s3://{bucket_name}/query-results/"}
-        )
-        repair_query_execution_id = repair_response['QueryExecutionId']
-        print(f"Repair query started. QueryExecutionId: {repair_query_execution_id}")
-
-        # Wait for the repair query to complete (you can also add a timeout here)
-        athena_client.get_query_execution(QueryExecutionId=repair_query_execution_id)
+    queried, failed, executions = [], [], []
+    for (bucket_name, directory, (year, month, day)), files in partitions.items():
+        print(f"Partition values - Year: {year}, Month: {month}, Day: {day} "
+              f"({len(files['keys'])} file(s) in {directory or 'the bucket root'})")
+        rollup_table = ROLLUP_TABLES.get(directory)
+        if rollup_table and rollup_table != QUERY_TABLE:
+            print(f"Files of the rollup table {rollup_table} do not change {QUERY_TABLE}, skipping")
+            continue
+        debounce_key = (bucket_name, year, month, day)
+        try:
+            # Step 1: Register the partition if it is new (rollup tables use partition projection)
+            if PARTITION_MODE == 'register' and not rollup_table:
+                with profiling.phase('aws.register'):
+                    get_registrar(bucket_name).register((year, month, day), f"s3://{bucket_name}/{files['prefix']}")
+            # Step 2: Query the partition unless it was queried moments ago
+            if not query_debouncer.ready(debounce_key):
+                print(f"Partition {year}/{month}/{day} was queried less than {query_debouncer.window:g}s ago, skipping")
+                continue
+            with profiling.phase('aws.query'):
+                execution_id, status = query_partition(bucket_name, year, month, day, upload_marker(files))
+        except Exception as e:
+            print(f"Error processing partition {year}/{month}/{day}: {e}")
+            failed.append(f"{year}/{month}/{day}")
+            continue
+        if status == "SUCCEEDED":
+            query_debouncer.record(debounce_key)
+            queried.append(f"{year}/{month}/{day}")
+        elif status in ("QUEUED", "RUNNING"):
+            query_debouncer.record(debounce_key)
+            executions.append({'bucket': bucket_name, 'partition': f"{year}/{month}/{day}",
+                               'QueryExecutionId': execution_id})
+        else:
+            print(f"Query failed with status: {status}")
+            failed.append(f"{year}/{month}/{day}")
 
-    except Exception as e:
-        print(f"Error repairing Athena table partitions: {e}")
+    if executions:
+        # Asynchronous mode: hand the running queries back instead of paying for the wait
         return {
-            'statusCode': 500,
-            'body': json.dumps(f'Error repairing table partitions: {str(e)}')
+            'statusCode': 202,
+            'status': 'RUNNING',
+            'executions': executions,
+            'queried': queried,
+            'failed': failed
         }
 
-    # Step 2: Define the Athena query (make sure to adjust the query based on your table and columns)
-    query = f"""
-    SELECT *
-    FROM "default"."forest_weather_data_parquet"
-    WHERE year = '{year}' AND month = '{month}' AND day = '{day}'
+    PARTITIONS_QUERIED.inc(len(queried))
+    PARTITIONS_FAILED.inc(len(failed))
+    # Step 3: One QuickSight refresh for the whole event
+    if queried:
+        update_quicksight_dataset()
+
+    return {
+        'statusCode': 500 if failed else 200,
+        'body': json.dumps({'queried': queried, 'failed': failed})
+    }
+
+def resume_queries(event):
     """
-    
-    print(f"Executing Athena query: {query}")
-    
-    # Set up Athena query execution parameters
-    database = "default"  
-    output_location = f"s3://{bucket_name}/query-results/"
-    
-    # Step 3: Start Athena query execution
-    try:
-        response = athena_client.start_query_execution(
-            QueryString=query,
-            QueryExecutionContext={'Database': database},
-            ResultConfiguration={'OutputLocation': output_location}
-        )
-        
-        query_execution_id = response['QueryExecutionId']
-        print(f"Query started. QueryExecutionId: {query_execution_id}")
-    except Exception as e:
-        print(f"Error starting Athena query: {e}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps(f'Error starting Athena query: {str(e)}')
-        }
-    
-    # Check the query execution status
-    status = "RUNNING"
-    while status in ["RUNNING", "QUEUED"]:
-        print(f"Checking query status... Current status: {status}")
-        time.sleep(5)
-        try:
-            status_response = athena_client.get_query_execution(QueryExecutionId=query_execution_id)
-            status = status_response['QueryExecution']['Status']['State']
-        except Exception as e:
-            print(f"Error checking query status: {e}")
-            return {
-                'statusCode': 500,
-                'body': json.dumps(f'Error checking query status: {str(e)}')
-            }
-        
-    if status == "SUCCEEDED":
-        print(f"Query succeeded. Results stored at: {output_location}")
-        
-        # Call the function to update QuickSight dataset after query success
-        try:
-            update_quicksight_dataset()
-        except Exception as e:
-            print(f"Error updating QuickSight dataset: {e}")
-            return {
-                'statusCode': 500,
-                'body': json.dumps(f'Error updating QuickSight dataset: {str(e)}')
-            }
-
-    else:
-        print(f"Query failed with status: {status}")
-    
+    Check the queries of an asynchronous run once. Returns the event with status RUNNING
+    while any query is unfinished (to be passed back after a wait), otherwise refreshes
+    QuickSight if a query succeeded and returns the final status.
+    """
+    running = []
+    queried, failed = list(event.get('queried', [])), list(event.get('failed', []))
+    for execution in event['executions']:
+        with profiling.phase('aws.query'):
+            state = get_orchestrator(execution['bucket']).check(execution['QueryExecutionId'])
+        if state in ("QUEUED", "RUNNING"):
+            running.append(execution)
+        elif state == "SUCCEEDED":
+            queried.append(execution['partition'])
+        else:
+            print(f"Query {execution['QueryExecutionId']} failed with status: {state}")
+            failed.append(execution['partition'])
+    if running:
+        return {'statusCode': 202, 'status': 'RUNNING', 'executions': running, 'queried': queried, 'failed': failed}
+
+    PARTITIONS_QUERIED.inc(len(queried))
+    PARTITIONS_FAILED.inc(len(failed))
+    if queried:
+        update_quicksight_dataset()
     return {
-        'statusCode': 200,
-        'body': json.dumps('Athena query executed successfully.')
+        'statusCode': 500 if failed else 200,
+        'status': 'FAILED' if failed else 'SUCCEEDED',
+        'body': json.dumps({'queried': queried, 'failed': failed})
     }
 
-def update_quicksight_dataset():
-    print("Updating QuickSight dataset...")
-    aws_account_id = '329599654349'  
-    dataset_id = '0d6c3e3d-fec8-46ad-a7ce-329359849637'  # Dataset ID in QuickSight
+def query_partition(bucket_name, year, month, day, version=None):
+    """
+    Query one partition. Waits for the result unless QUERY_MODE is async.
 
-    table_key = 'forest-weather-data-parquet' 
+    version marks the uploads that triggered the query (s3_events.upload_marker): results
+    are only reused for the same uploads, so a partition written again is read afresh.
 
-    # Refresh the dataset using the update API
-    try:
-        response = quicksight_client.create_ingestion(
-            AwsAccountId=aws_account_id,
-            DataSetId=dataset_id,
-            IngestionId=str(uuid.uuid4())  # Unique ID for the ingestion process
+    Returns:
+    tuple: (execution id, state).
+    """
+    print(f"Executing Athena query for partition {year}/{month}/{day}: {PARTITION_QUERY}")
+    orchestrator = get_orchestrator(bucket_name)
+    parameters = [f"'{year}'", f"'{month}'", f"'{day}'"]
+    if QUERY_MODE == 'async':
+        execution_id, cached = orchestrator.submit(PARTITION_QUERY, parameters, version)
+        return execution_id, 'SUCCEEDED' if cached else 'RUNNING'
+    execution_id, status = orchestrator.run(PARTITION_QUERY, parameters, version)
+    if status == "SUCCEEDED":
+        print(f"Query succeeded. Results stored at: {orchestrator.output_location}")
+    return execution_id, status
+
+def get_orchestrator(bucket_name):
+    if bucket_name not in orchestrators:
+        orchestrators[bucket_name] = QueryOrchestrator(
+            athena_client,
+            database=DATABASE,
+            output_location=f"s3://{bucket_name}/query-results/",
+            reuse_minutes=RESULT_REUSE_MINUTES
         )
-        print("QuickSight dataset updated successfully:", response)
+    return orchestrators[bucket_name]
+
+def get_registrar(bucket_name):
+    if bucket_name not in registrars:
+        registrars[bucket_name] = PartitionRegistrar(
+            athena_client,
+            output_location=f"s3://{bucket_name}/query-results/",
+            manifest=S3Manifest(s3_client, bucket_name, PARTITION_MANIFEST_KEY)
+        )
+    return registrars[bucket_name]
+
+def update_quicksight_dataset():
+    print("Updating QuickSight dataset...")
+    # Refresh the dataset, unless an ingestion is still running or one started too recently
+    try:
+        with profiling.phase('aws.quicksight'):
+            ingestion_limiter.refresh(QUICKSIGHT_DATASET_ID)
     except Exception as e:
         print(f"Error updating QuickSight dataset: {e}")
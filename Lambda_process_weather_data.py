@@ -1,62 +1,148 @@
 import base64
-import json
-import math
+import binascii
+import logging
+import os
+import time
 
+import numpy as np
 
-def calculate_ffwi(temperature, humidity, wind_speed):
+import json_codec
+import metrics
+import profiling
+import wire_format
+from ffwi import calculate_ffwi_batch
+from ffwi_alerts import DEFAULTS as DEFAULT_ALERT_SETTINGS, AlertEngine, event_time, sink_from_spec
+
+# Log level is configurable per function (LOG_LEVEL=DEBUG logs every record)
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+
+WEATHER_FIELDS = ('temperature', 'humidity', 'windSpeed')
+
+# Real-time FFWI alerts: ALERT_SINK=file:<path> or sqs:<queue url> enables them. Station state
+# lives in this instance and carries over between warm invocations; a station silent for
+# ALERT_STATION_TTL seconds is forgotten, and at most ALERT_MAX_STATIONS are kept.
+alert_sink = sink_from_spec(os.environ.get('ALERT_SINK'))
+alert_engine = AlertEngine(
+    alert_sink,
+    station_ttl=float(os.environ.get('ALERT_STATION_TTL', DEFAULT_ALERT_SETTINGS['station_ttl'])),
+    max_stations=int(os.environ.get('ALERT_MAX_STATIONS', DEFAULT_ALERT_SETTINGS['max_stations']))
+) if alert_sink else None
+
+# Metrics are printed as one CloudWatch EMF line per invocation
+METRIC_DIMENSIONS = {'Function': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'Lambda_process_weather_data')}
+RECORDS_IN = metrics.counter('weather_records_in_total', 'Records received', stage='firehose_lambda')
+RECORDS_OUT = metrics.counter('weather_records_out_total', 'Records passed on', stage='firehose_lambda')
+REJECTS = metrics.counter('weather_rejects_total', 'Records rejected', stage='firehose_lambda', reason='invalid')
+ALERTS = metrics.counter('weather_alerts_total', 'FFWI alerts sent')
+BATCH_SECONDS = metrics.histogram('weather_batch_seconds', 'Batch processing time', stage='firehose_lambda')
+DECODE_SECONDS = metrics.histogram('weather_decode_seconds', 'Record decoding time', stage='firehose_lambda')
+FFWI_SECONDS = metrics.histogram('weather_ffwi_seconds', 'FFWI computation time', stage='firehose_lambda')
+
+
+def decode_records(records):
     """
-    Calculate the Fosberg Fire Weather Index (FFWI).
-    
-    Parameters:
-    temperature (float): Temperature in Fahrenheit (°F).
-    humidity (float): Relative Humidity in percentage (%).
-    wind_speed (float): Wind speed in miles per hour (mph).
-    
+    Decode the base64 payload of every Firehose record: JSON or the binary wire format
+    (raw or as a base64 line, see wire_format.py), detected per record.
+
     Returns:
-    float: Calculated FFWI value.
+    list: payload dicts, with None for records that cannot be decoded into an object.
+    """
+    payloads = []
+    for record in records:
+        try:
+            payload = wire_format.loads(base64.b64decode(record['data'], validate=True))
+        except (KeyError, TypeError, ValueError, binascii.Error) as e:
+            logger.warning("Malformed record %s: %s", record.get('recordId'), e)
+            payload = None
+        payloads.append(payload if isinstance(payload, dict) else None)
+    return payloads
+
+
+def weather_columns(payloads):
+    """
+    Build columnar float arrays of temperature/humidity/windSpeed (NaN where missing or not numeric).
     """
-    # Calculate F (factor based on relative humidity and temperature)
-    if humidity < 100:
-        F = 1 - (2 * (100 - humidity) / ((100 - humidity) + temperature))
-        F = max(F, 0) 
-    else:
-        F = 0  # If humidity is 100%, set F to 0, as there is no fire risk.
-
-    # Calculate FFWI based on the formula
-    ffwi = ((1 + wind_speed) / 0.3002) * math.sqrt(F)
-    
-    # Ensure FFWI is within the standard range [0, 100]
-    ffwi = max(0, min(ffwi, 100))
-    
-    return ffwi
+    columns = np.full((len(WEATHER_FIELDS), len(payloads)), np.nan)
+    for i, payload in enumerate(payloads):
+        if payload is None:
+            continue
+        for j, field in enumerate(WEATHER_FIELDS):
+            value = payload.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                columns[j, i] = value
+    return columns
 
 
+def check_alerts(records, payloads, ffwi, valid):
+    """
+    Feed the batch's valid readings to the alert engine, stations keyed by their coordinates.
+    """
+    now = time.time()
+    stations, event_times, values = [], [], []
+    for record, payload, value, ok in zip(records, payloads, ffwi.tolist(), valid.tolist()):
+        if ok:
+            stations.append(f"{payload.get('latitude')},{payload.get('longitude')}")
+            event_times.append(event_time(payload.get('timestamp'), now))
+            values.append(value)
+    alerts = alert_engine.process(stations, event_times, values)
+    if alerts:
+        ALERTS.inc(len(alerts))
+        # Kinesis-sourced Firehose records carry their arrival time in milliseconds
+        arrivals = [record.get('kinesisRecordMetadata', {}).get('approximateArrivalTimestamp') for record in records]
+        arrivals = [arrival for arrival in arrivals if arrival]
+        latency = f", {time.time() - min(arrivals) / 1000:.3f}s after the oldest record arrived" if arrivals else ""
+        logger.info("Sent %d FFWI alert(s)%s", len(alerts), latency)
+
+
+# PROFILE=phases|sample|cprofile profiles every invocation (see profiling.py)
+@profiling.profiled('firehose_lambda')
 def lambda_handler(event, context):
+    try:
+        with BATCH_SECONDS.time():
+            return process_records(event['records'])
+    finally:
+        with profiling.phase('metrics'):
+            metrics.emit_emf(dimensions=METRIC_DIMENSIONS)
+
+
+def process_records(records):
+    RECORDS_IN.inc(len(records))
+
+    # Decode the data, then calculate FFWI for the whole batch in one call
+    with DECODE_SECONDS.time(), profiling.phase('decode'):
+        payloads = decode_records(records)
+    with FFWI_SECONDS.time(), profiling.phase('compute'):
+        temperature, humidity, windSpeed = weather_columns(payloads)
+        ffwi = calculate_ffwi_batch(temperature, humidity, windSpeed)
+    valid = ~np.isnan(ffwi)
+
+    debug = logger.isEnabledFor(logging.DEBUG)
     output = []
-    
-    for record in event['records']:
-        # Decode the data
-
-        payload = json.loads(base64.b64decode(record['data']).decode('utf-8'))
-        
-        # Extract weather data
-        temperature = payload.get('temperature')
-        humidity = payload.get('humidity')
-        windSpeed = payload.get('windSpeed')
-
-        print(f"temperature: {temperature}, humidity: {humidity}, windSpeed: {windSpeed}")
-
-        # Calculate FFWI
-        ffwi = calculate_ffwi(temperature, humidity, windSpeed)
-        payload['ffwi'] = ffwi  # Add FFWI to the record
-        
-        # Encode the record back for Firehose
-        output_record = {
-            'recordId': record['recordId'],
-            'result': 'Ok',
-            'data': base64.b64encode(json.dumps(payload).encode('utf-8')).decode('utf-8')
-        }
-        output.append(output_record)
-    
-    return {'records': output}
+    with profiling.phase('encode'):
+        for record, payload, value, ok in zip(records, payloads, ffwi.tolist(), valid.tolist()):
+            if not ok:
+                # Firehose expects the original data back for records it should route to the error output
+                output.append({'recordId': record.get('recordId'), 'result': 'ProcessingFailed', 'data': record.get('data')})
+                continue
+            payload['ffwi'] = value  # Add FFWI to the record
+            if debug:
+                # Temperature may be missing: it does not matter at 100% humidity
+                logger.debug("temperature: %s, humidity: %s, windSpeed: %s, ffwi: %s",
+                             payload.get('temperature'), payload.get('humidity'), payload.get('windSpeed'), value)
+            # Encode the record back for Firehose
+            output.append({
+                'recordId': record['recordId'],
+                'result': 'Ok',
+                'data': base64.b64encode(json_codec.dumps(payload)).decode('ascii')
+            })
 
+    if alert_engine:
+        with profiling.phase('alerts'):
+            check_alerts(records, payloads, ffwi, valid)
+
+    failed = len(records) - int(valid.sum())
+    RECORDS_OUT.inc(len(records) - failed)
+    REJECTS.inc(failed)
+    logger.info("Processed %d records (%d failed, json backend: %s)", len(records), failed, json_codec.BACKEND)
+    return {'records': output}
@@ -0,0 +1,157 @@
+"""
+File sink for the Kinesis Agent log generator.
+
+Lines are collected in memory and written in large chunks. The active file is rotated by size
+and age (renamed to <path>.<timestamp>.<seq>, then a fresh <path> is created), which the agent
+follows without re-reading data. fsync is configurable and output can be gzip-compressed for
+generating large local datasets.
+"""
+import gzip
+import os
+import time
+
+FSYNC_POLICIES = ("never", "rotate", "flush")
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_AGE = 300.0
+DEFAULT_BUFFER_BYTES = 1024 * 1024
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+
+class RotatingLogWriter:
+    """
+    Buffered, rotating line writer.
+
+    Parameters:
+    path (str): Active log file (".gz" is appended when compress is set).
+    max_bytes (int): Rotate once the active file holds this many (uncompressed) bytes.
+    max_age (float): Rotate once the active file is this many seconds old.
+    buffer_bytes (int): Write to the file once this much data is buffered.
+    flush_interval (float): Also write buffered data at least this often (seconds).
+    fsync (str): "never", "rotate" (before each rotation/close) or "flush" (after every write).
+    compress (bool): Write gzip files.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE, buffer_bytes=DEFAULT_BUFFER_BYTES,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, fsync="rotate", compress=False, compresslevel=1,
+                 clock=time.time):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync} (expected one of {', '.join(FSYNC_POLICIES)})")
+        self.path = path + ".gz" if compress else path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.buffer_bytes = buffer_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.compress = compress
+        self.compresslevel = compresslevel
+        self._clock = clock
+        self._buffer = []
+        self._buffered = 0
+        self._raw = None
+        self._stream = None
+        self._file_bytes = 0
+        self._opened_at = None
+        self._last_flush = clock()
+        self._sequence = 0
+        self.bytes_written = 0
+        self.rotated_files = []
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write_lines(self, lines):
+        """
+        Buffer newline-terminated copies of the given strings.
+        """
+        if not lines:
+            return
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffer_bytes or self._clock() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _open(self):
+        # Append so a restarted generator continues the active file
+        self._raw = open(self.path, 'ab', buffering=0)
+        self._stream = gzip.GzipFile(fileobj=self._raw, mode='ab', compresslevel=self.compresslevel) if self.compress else self._raw
+        # The size rotation counts what the file already holds (compressed bytes for gzip,
+        # which can only rotate it later than max_bytes of lines, never earlier)
+        self._file_bytes = os.fstat(self._raw.fileno()).st_size
+        self._opened_at = self._clock()
+
+    def flush(self):
+        """
+        Write buffered data to the active file and rotate it if it is due.
+        """
+        self._last_flush = self._clock()
+        if self._buffered:
+            if self._stream is None:
+                self._open()
+            self._stream.write(b''.join(self._buffer))
+            self._file_bytes += self._buffered
+            self.bytes_written += self._buffered
+            self._buffer, self._buffered = [], 0
+            if self.fsync == "flush":
+                if self.compress:
+                    self._stream.flush()
+                os.fsync(self._raw.fileno())
+        if self._stream is not None and (self._file_bytes >= self.max_bytes
+                                         or self._clock() - self._opened_at >= self.max_age):
+            self.rotate()
+
+    def _close_file(self):
+        if self._stream is None:
+            return
+        if self.compress:
+            self._stream.close()
+        if self.fsync != "never":
+            os.fsync(self._raw.fileno())
+        self._raw.close()
+        self._raw = self._stream = None
+
+    def rotate(self):
+        """
+        Close the active file and rename it aside; the next write starts a new file.
+        """
+        self._close_file()
+        if not os.path.exists(self.path):
+            return None
+        base, suffix = (self.path[:-3], ".gz") if self.compress else (self.path, "")
+        self._sequence += 1
+        rotated = f"{base}.{time.strftime('%Y%m%d-%H%M%S')}.{self._sequence:04d}{suffix}"
+        os.rename(self.path, rotated)
+        self.rotated_files.append(rotated)
+        return rotated
+
+    def close(self):
+        self.flush()
+        self._close_file()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def add_writer_arguments(parser):
+    """
+    Add the file sink options to the agent generator's argument parser.
+    """
+    group = parser.add_argument_group("log file sink")
+    group.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES, help="Rotate the log at this size")
+    group.add_argument("--rotate-seconds", type=float, default=DEFAULT_MAX_AGE, help="Rotate the log at this age")
+    group.add_argument("--buffer-bytes", type=int, default=DEFAULT_BUFFER_BYTES, help="Write in chunks of this size")
+    group.add_argument("--flush-interval", type=float, default=DEFAULT_FLUSH_INTERVAL,
+                       help="Write buffered lines at least this often (seconds)")
+    group.add_argument("--fsync", choices=FSYNC_POLICIES, default="rotate", help="When to fsync the log")
+    group.add_argument("--gzip", action="store_true", help="Write gzip-compressed logs")
+    return group
+
+
+def writer_from_args(args, path):
+    return RotatingLogWriter(path, max_bytes=args.max_bytes, max_age=args.rotate_seconds,
+                             buffer_bytes=args.buffer_bytes, flush_interval=args.flush_interval,
+                             fsync=args.fsync, compress=args.gzip)
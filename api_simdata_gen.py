@@ -1,9 +1,14 @@
+import argparse
 import json
 import random
 import time
 from datetime import datetime
 import boto3
 import math
+import metrics
+import wire_format
+from kinesis_producer import KinesisProducer, station_partition_key
+from load_generator import add_load_arguments, encode_readings, load_config, run_load
 
 # Kinesis Stream Details
 STREAM_NAME = "weather_data_stream"  # Replace with your stream name
@@ -11,6 +16,8 @@ AWS_REGION = "us-east-2"             # Replace with your AWS region
 AWS_ACCESS_KEY_ID = ""
 AWS_SECRET_ACCESS_KEY = ""
 
+RECORDS_OUT = metrics.counter("weather_records_out_total", "Records generated", stage="api_producer")
+
 # Initialize Kinesis client
 kinesis_client = boto3.client('kinesis', region_name=AWS_REGION, aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
 
@@ -29,27 +36,6 @@ amplitude_humid = 10 # Humidity fluctuation ±10
 base_temp = 60  # Base temperature
 base_humidity = 30  # Base humidity
 
-def calculate_ffwi(temperature, humidity, wind_speed):
-    """
-    Calculate the Fosberg Fire Weather Index (FFWI).
-    """
-    try:
-        F = 0
-        # Calculate F (factor based on relative humidity and temperature)
-        if humidity < 100:
-            F = 1 - (2 * (100 - humidity) / ((100 - humidity) + temperature))
-            F = max(F, 0)
-        else:
-            F = 0  # If humidity is 100%, set F to 0, as there is no fire risk.
-
-        # Calculate FFWI based on the formula
-        ffwi = ((1 + wind_speed) / 0.3002) * math.sqrt(F)
-        ffwi = max(0, min(ffwi, 100))  # Ensure FFWI is in range [0, 100]
-        return ffwi
-    except Exception as e:
-        print(f"Error calculating FFWI: {e}")
-        return None
-
 def generate_mock_data(index):
     """
     Generate mock weather data.
@@ -83,30 +69,34 @@ def generate_mock_data(index):
     }
     return mock_data
 
-def send_data_to_kinesis():
+def send_data_to_kinesis(client=None, aggregate=False, max_in_flight=8, record_format="json"):
     """
     Continuously send mock data to Kinesis Data Stream.
+    client defaults to the boto3 Kinesis client; pass local_aws.FakeKinesisClient to run locally.
+    record_format "binary" sends the compact wire format (see wire_format.py) instead of JSON.
     """
+    encode = wire_format.encode if record_format == "binary" else json.dumps
+    producer = KinesisProducer(client or kinesis_client, STREAM_NAME, aggregate=aggregate, max_in_flight=max_in_flight)
     index = 0 
     while True:
         try:
             # Generate 100 records
-            records = []
             for i in range(100):
                 coordinate = LAT_LONG_POINTS[i % len(LAT_LONG_POINTS)]
                 mock_data = generate_mock_data(index)
                 mock_data['latitude'] = coordinate[0]
                 mock_data['longitude'] = coordinate[1]
-                records.append({
-                    'Data': json.dumps(mock_data),
-                    'PartitionKey': str(random.randint(1, 100))  # Random Partition Key
-                })
+                # Partition key per station keeps each station's readings in order on one shard
+                producer.put(encode(mock_data), station_partition_key(coordinate[0], coordinate[1]))
+
+            RECORDS_OUT.inc(100)
 
-            # Send the batch of records to Kinesis
-            response = kinesis_client.put_records(StreamName=STREAM_NAME, Records=records)
+            # Send the batch of records to Kinesis (failed entries are retried)
+            stats = producer.flush()
             
-            # Log the response
-            print(f"Kinesis response: {response}")
+            # Log the outcome
+            print(f"Kinesis producer totals: {stats['records']} records sent in {stats['calls']} calls, "
+                  f"{stats['retried_entries']} retried, {stats['failed_records']} failed")
             
             # Wait before sending the next record
             time.sleep(sleep_time)
@@ -116,6 +106,44 @@ def send_data_to_kinesis():
             print(f"Error sending data to Kinesis: {e}")
             time.sleep(sleep_time)
 
+def run_load_to_kinesis(config, client=None, aggregate=False, max_in_flight=8, record_format="json"):
+    """
+    Load-generation mode: send vectorized batches of readings at the configured rate.
+    """
+    producer = KinesisProducer(client or kinesis_client, STREAM_NAME, aggregate=aggregate, max_in_flight=max_in_flight)
+    encode = wire_format.encode_batch if record_format == "binary" else encode_readings
+    def send(lines, keys):
+        producer.put_many(zip(lines, keys))
+        RECORDS_OUT.inc(len(lines))
+
+    summary = run_load(config, send, encode=encode)
+    stats = producer.close()
+    print(f"Kinesis producer totals: {stats['records']} records sent in {stats['calls']} calls, "
+          f"{stats['retried_entries']} retried, {stats['failed_records']} failed")
+    return summary, stats
+
 if __name__ == "__main__":
-    print("Generating and sending mock data to Kinesis Data Stream...")
-    send_data_to_kinesis()
+    parser = argparse.ArgumentParser(description="Send mock weather data to a Kinesis Data Stream")
+    parser.add_argument("--aggregate", action="store_true", help="Pack records into KPL aggregated records")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="Concurrent put_records calls")
+    parser.add_argument("--local", action="store_true", help="Send to an in-memory Kinesis stand-in")
+    parser.add_argument("--wire-format", choices=wire_format.FORMATS, default="json",
+                        help="Record encoding: JSON or the compact binary format (see wire_format.py)")
+    metrics.add_metrics_arguments(parser)
+    add_load_arguments(parser)
+    args = parser.parse_args()
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port)
+
+    client = None
+    if args.local:
+        from local_aws import FakeKinesisClient
+        client = FakeKinesisClient(STREAM_NAME)
+    if args.load:
+        print("Generating load for Kinesis Data Stream...")
+        run_load_to_kinesis(load_config(args, wind_min=20.0, wind_max=30.0), client,
+                            aggregate=args.aggregate, max_in_flight=args.max_in_flight, record_format=args.wire_format)
+    else:
+        print("Generating and sending mock data to Kinesis Data Stream...")
+        send_data_to_kinesis(client, aggregate=args.aggregate, max_in_flight=args.max_in_flight,
+                             record_format=args.wire_format)
@@ -0,0 +1,196 @@
+"""
+Athena partition registration for the Parquet weather table.
+
+Instead of running MSCK REPAIR TABLE (a scan of the whole table prefix) on every upload,
+the year=/month=/day= partition of each new object is added with a targeted
+ALTER TABLE ADD IF NOT EXISTS PARTITION, and only the first time it is seen: registered
+partitions are cached in memory (reused by warm Lambda invocations) and in a persisted
+manifest. Alternatively, the table can use partition projection and skip registration.
+"""
+import argparse
+import json
+import os
+import re
+
+from athena_queries import wait_for_query
+
+PARTITION_PATTERN = re.compile(r'year=(\d{4})/month=(\d{1,2})/day=(\d{1,2})')  # month, day 1 or 2 digits
+PARTITION_KEYS = ('year', 'month', 'day')
+
+DEFAULT_DATABASE = 'default'
+DEFAULT_TABLE = 'forest_weather_data_parquet'
+
+
+def parse_partition(object_key):
+    """
+    Extract the partition of an object key.
+
+    Returns:
+    tuple: (year, month, day) strings and the S3 prefix of the partition ("<table prefix>/year=../month=../day=../").
+
+    Raises:
+    ValueError: If the key has no year=/month=/day= path.
+    """
+    match = PARTITION_PATTERN.search(object_key)
+    if not match:
+        raise ValueError(f"Unable to extract partition values from object key: {object_key}")
+    return match.groups(), object_key[:match.end()] + '/'
+
+
+def table_directory(prefix):
+    """
+    Name of the directory holding the partitions of a partition prefix ("" at the bucket root).
+    """
+    return prefix[:PARTITION_PATTERN.search(prefix).start()].rstrip('/').rpartition('/')[2]
+
+
+def add_partition_query(table, partition, location):
+    """
+    ALTER TABLE statement adding one partition (a no-op if it already exists).
+    """
+    values = ', '.join(f"{key} = '{value}'" for key, value in zip(PARTITION_KEYS, partition))
+    return f"ALTER TABLE {table} ADD IF NOT EXISTS PARTITION ({values}) LOCATION '{location}'"
+
+
+class FileManifest:
+    """
+    Registered partitions persisted as a JSON list in a local file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path) as f:
+            return {tuple(partition) for partition in json.load(f)}
+
+    def save(self, partitions):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(sorted(partitions), f)
+        os.replace(tmp_path, self.path)
+
+
+class S3Manifest:
+    """
+    Registered partitions persisted as a JSON list in an S3 object.
+
+    Concurrent Lambdas may overwrite each other's manifest; a partition dropped that way is
+    only registered again, which ADD IF NOT EXISTS makes harmless.
+    """
+
+    def __init__(self, s3_client, bucket, key):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+
+    def load(self):
+        try:
+            body = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)['Body'].read()
+        except self.s3_client.exceptions.NoSuchKey:
+            return set()
+        return {tuple(partition) for partition in json.loads(body)}
+
+    def save(self, partitions):
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=json.dumps(sorted(partitions)).encode('utf-8'),
+                                  ContentType='application/json')
+
+
+class PartitionRegistrar:
+    """
+    Adds partitions to an Athena table once each.
+
+    Parameters:
+    athena_client: boto3 Athena client (or local_aws.FakeAthenaClient).
+    output_location (str): S3 location for the ALTER TABLE query results.
+    manifest: FileManifest/S3Manifest with the partitions already registered, or None for memory only.
+    """
+
+    def __init__(self, athena_client, output_location, database=DEFAULT_DATABASE, table=DEFAULT_TABLE,
+                 manifest=None, timeout=60.0):
+        self.athena_client = athena_client
+        self.output_location = output_location
+        self.database = database
+        self.table = table
+        self.manifest = manifest
+        self.timeout = timeout
+        self._registered = None
+        self.queries = 0
+
+    @property
+    def registered(self):
+        if self._registered is None:
+            self._registered = self.manifest.load() if self.manifest else set()
+        return self._registered
+
+    def register(self, partition, location):
+        """
+        Add the partition unless it is already known.
+
+        Returns:
+        bool: True if an ALTER TABLE query was run.
+
+        Raises:
+        RuntimeError: If the query fails.
+        """
+        partition = tuple(partition)
+        if partition in self.registered:
+            print(f"Partition {partition} already registered")
+            return False
+        query = add_partition_query(self.table, partition, location)
+        print(f"Registering partition: {query}")
+        response = self.athena_client.start_query_execution(
+            QueryString=query,
+            QueryExecutionContext={'Database': self.database},
+            ResultConfiguration={'OutputLocation': self.output_location}
+        )
+        self.queries += 1
+        state = wait_for_query(self.athena_client, response['QueryExecutionId'], timeout=self.timeout)
+        if state != 'SUCCEEDED':
+            raise RuntimeError(f"Registering partition {partition} {state}")
+        self.registered.add(partition)
+        if self.manifest:
+            self.manifest.save(self.registered)
+        return True
+
+
+def projection_properties(location, start_year, end_year):
+    """
+    Table properties for Athena partition projection over the year=/month=/day= layout.
+
+    With projection enabled Athena computes the partitions from these ranges at query time,
+    so nothing has to be registered when new data arrives. Months and days are not zero-padded,
+    matching the paths written by the Spark job.
+    """
+    location = location.rstrip('/')
+    return {
+        'projection.enabled': 'true',
+        'projection.year.type': 'integer',
+        'projection.year.range': f'{start_year},{end_year}',
+        'projection.month.type': 'integer',
+        'projection.month.range': '1,12',
+        'projection.day.type': 'integer',
+        'projection.day.range': '1,31',
+        'storage.location.template': f'{location}/year=${{year}}/month=${{month}}/day=${{day}}',
+    }
+
+
+def projection_query(table, location, start_year, end_year):
+    """
+    ALTER TABLE statement enabling partition projection on the table.
+    """
+    properties = ',\n  '.join(f"'{key}' = '{value}'"
+                              for key, value in projection_properties(location, start_year, end_year).items())
+    return f"ALTER TABLE {table} SET TBLPROPERTIES (\n  {properties}\n)"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the DDL enabling Athena partition projection")
+    parser.add_argument("location", help="S3 location of the table, e.g. s3://bucket/weather-parquet/")
+    parser.add_argument("--table", default=DEFAULT_TABLE)
+    parser.add_argument("--start-year", type=int, default=2024)
+    parser.add_argument("--end-year", type=int, default=2035)
+    args = parser.parse_args()
+    print(projection_query(args.table, args.location, args.start_year, args.end_year))
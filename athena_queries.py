@@ -0,0 +1,192 @@
+"""
+Athena query orchestration for Lambda_PushToAthena.
+
+Queries are submitted with ExecutionParameters instead of formatting values into the SQL,
+and polled with exponential backoff instead of a fixed sleep. They can also be submitted
+without waiting: the execution id is returned and the caller (e.g. a Step Functions wait
+loop) resumes later with check(). Repeat queries reuse earlier results, both through
+Athena's ResultReuseConfiguration and a local cache keyed by the normalized query text.
+
+Athena keys reused results on the query alone, so a query over data that was just written
+can get results from before the write. A query given a data version (e.g. a marker of the
+partition's latest upload) is therefore never answered by Athena result reuse, and the
+local cache only reuses it for the same version.
+"""
+import re
+import time
+
+import metrics
+
+TERMINAL_STATES = ('SUCCEEDED', 'FAILED', 'CANCELLED')
+
+DEFAULT_INITIAL_POLL = 0.25
+DEFAULT_MAX_POLL = 5.0
+DEFAULT_TIMEOUT = 600.0
+DEFAULT_REUSE_MINUTES = 5
+
+QUERY_WAIT_SECONDS = metrics.histogram("weather_athena_query_wait_seconds", "Time spent polling Athena queries")
+QUERIES_STARTED = metrics.counter("weather_athena_queries_started_total", "Athena queries started")
+QUERY_CACHE_HITS = metrics.counter("weather_athena_query_cache_hits_total", "Queries answered from the local cache")
+
+
+def normalize_query(query):
+    """
+    Query text with whitespace collapsed and any trailing semicolon removed, so formatting
+    differences do not defeat the cache.
+    """
+    return re.sub(r'\s+', ' ', query).strip().rstrip(';').strip()
+
+
+def wait_for_query(athena_client, query_execution_id, initial_poll=DEFAULT_INITIAL_POLL, max_poll=DEFAULT_MAX_POLL,
+                   timeout=DEFAULT_TIMEOUT, sleep=time.sleep):
+    """
+    Poll a query until it reaches a terminal state, doubling the poll interval from
+    `initial_poll` up to `max_poll` seconds. Short queries finish after a sub-second wait
+    while long ones cost few API calls.
+
+    Returns:
+    str: SUCCEEDED, FAILED or CANCELLED.
+
+    Raises:
+    TimeoutError: If the query is still queued or running after `timeout` seconds.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    interval = initial_poll
+    while True:
+        status = athena_client.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']['Status']
+        if status['State'] in TERMINAL_STATES:
+            QUERY_WAIT_SECONDS.observe(time.monotonic() - start)
+            metrics.counter("weather_athena_queries_finished_total", "Athena queries by final state",
+                            state=status['State']).inc()
+            if status['State'] != 'SUCCEEDED':
+                print(f"Query {query_execution_id} {status['State']}: {status.get('StateChangeReason', '')}")
+            return status['State']
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Query {query_execution_id} still {status['State']} after {timeout}s")
+        sleep(min(interval, remaining))
+        interval = min(interval * 2, max_poll)
+
+
+class QueryOrchestrator:
+    """
+    Runs Athena queries with parameters, backoff polling and result reuse.
+
+    Parameters:
+    athena_client: boto3 Athena client (or local_aws.FakeAthenaClient).
+    database (str): Database of the queries.
+    output_location (str): S3 location for query results.
+    reuse_minutes (int): Reuse results of an identical query at most this old (0 disables reuse).
+    """
+
+    def __init__(self, athena_client, database, output_location, workgroup=None, reuse_minutes=DEFAULT_REUSE_MINUTES,
+                 initial_poll=DEFAULT_INITIAL_POLL, max_poll=DEFAULT_MAX_POLL, timeout=DEFAULT_TIMEOUT,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.athena_client = athena_client
+        self.database = database
+        self.output_location = output_location
+        self.workgroup = workgroup
+        self.reuse_minutes = reuse_minutes
+        self.initial_poll = initial_poll
+        self.max_poll = max_poll
+        self.timeout = timeout
+        self._clock = clock
+        self._sleep = sleep
+        # (normalized query, parameters, data version) -> (execution id, time it succeeded)
+        self._cache = {}
+        # execution id -> cache key, for queries submitted but not yet known to have succeeded
+        self._pending = {}
+        self.executed = 0
+        self.cache_hits = 0
+
+    def _key(self, query, parameters, version):
+        return normalize_query(query), tuple(parameters or ()), version
+
+    def _cached(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        execution_id, succeeded_at = entry
+        if self._clock() - succeeded_at > self.reuse_minutes * 60:
+            del self._cache[key]
+            return None
+        return execution_id
+
+    def submit(self, query, parameters=None, version=None):
+        """
+        Start a query, or return the execution id of an identical query that succeeded
+        recently.
+
+        Parameters:
+        query (str): SQL with ? placeholders.
+        parameters (list): SQL literals for the placeholders, e.g. ["'2024'"].
+        version (str): Marker of the data the query reads. Results are only reused for
+        the same version, and never through Athena result reuse.
+
+        Returns:
+        tuple: (execution id, True if it was served from the local cache).
+        """
+        key = self._key(query, parameters, version)
+        if self.reuse_minutes:
+            execution_id = self._cached(key)
+            if execution_id:
+                self.cache_hits += 1
+                QUERY_CACHE_HITS.inc()
+                print(f"Reusing results of query {execution_id}")
+                return execution_id, True
+
+        request = {
+            'QueryString': query,
+            'QueryExecutionContext': {'Database': self.database},
+            'ResultConfiguration': {'OutputLocation': self.output_location},
+        }
+        if parameters:
+            request['ExecutionParameters'] = [str(parameter) for parameter in parameters]
+        if self.workgroup:
+            request['WorkGroup'] = self.workgroup
+        if self.reuse_minutes and version is None:
+            request['ResultReuseConfiguration'] = {
+                'ResultReuseByAgeConfiguration': {'Enabled': True, 'MaxAgeInMinutes': self.reuse_minutes}
+            }
+        execution_id = self.athena_client.start_query_execution(**request)['QueryExecutionId']
+        self.executed += 1
+        QUERIES_STARTED.inc()
+        self._pending[execution_id] = key
+        print(f"Query started. QueryExecutionId: {execution_id}")
+        return execution_id, False
+
+    def _finished(self, execution_id, state):
+        key = self._pending.pop(execution_id, None)
+        if key is not None and state == 'SUCCEEDED' and self.reuse_minutes:
+            self._cache[key] = (execution_id, self._clock())
+
+    def check(self, execution_id):
+        """
+        Current state of a query, with a single API call (for resuming asynchronous runs).
+        """
+        status = self.athena_client.get_query_execution(QueryExecutionId=execution_id)['QueryExecution']['Status']
+        if status['State'] in TERMINAL_STATES:
+            self._finished(execution_id, status['State'])
+        return status['State']
+
+    def wait(self, execution_id):
+        """
+        Block until the query finishes, polling with exponential backoff.
+        """
+        state = wait_for_query(self.athena_client, execution_id, self.initial_poll, self.max_poll, self.timeout,
+                               self._sleep)
+        self._finished(execution_id, state)
+        return state
+
+    def run(self, query, parameters=None, version=None):
+        """
+        Submit a query and wait for it.
+
+        Returns:
+        tuple: (execution id, final state).
+        """
+        execution_id, cached = self.submit(query, parameters, version)
+        if cached:
+            return execution_id, 'SUCCEEDED'
+        return execution_id, self.wait(execution_id)
@@ -0,0 +1,149 @@
+"""
+Adaptive batch sizing and interval control.
+
+A fixed batch interval is wrong both ways: under a burst, batches of a fixed size each pay
+the fixed cost of a Parquet commit and fall behind, so latency grows for as long as the
+burst lasts; under light load, every interval commits a handful of records.
+
+BatchController is fed the outcome of every batch (records, processing time, lag: how long
+the oldest record of the batch had waited) and sets the next batch's limits:
+
+- max_records: what can be processed in utilization x target_latency at the measured
+  processing rate. The rate is measured per batch, so it includes the per-batch overhead:
+  larger batches process faster, and the size converges to the largest batch that still
+  fits the latency budget;
+- interval: while the lag is over the budget (target latency minus processing time), the
+  next batch starts at once (min_interval) to drain the backlog; otherwise it waits long
+  enough to collect min_records at the arrival rate, within [min_interval, max_interval].
+  It stays within utilization x (budget minus the processing time): the records that
+  arrived while the previous batch was processed wait for that batch, the interval and
+  their own batch, and the rest of the budget is slack for jitter.
+
+The controller only measures and decides; kinesis_consumer.KinesisConsumer applies it
+directly, and spark_backpressure.py applies it to the Spark engines. Where applying a new
+setting is costly (a Spark query restart), within_deadband() tells which changes are too
+small to be worth it. The current lag,
+interval and batch limit are exported as gauges (see metrics.py).
+"""
+import time
+
+import metrics
+
+DEFAULTS = {
+    "target_latency": 10.0,
+    "min_interval": 0.5,
+    "max_interval": 30.0,
+    "min_records": 1000,
+    "max_records": 1_000_000,
+    "utilization": 0.8,
+    "smoothing": 0.5,
+    "deadband": 1.0,
+}
+
+
+class BatchController:
+    """
+    Parameters:
+    target_latency (float): Seconds from a record's arrival to the end of its batch to aim for.
+    min_interval, max_interval (float): Bounds of the batch interval in seconds.
+    min_records (int): Records worth a batch under light load (smaller batches wait longer).
+    max_records (int): Upper bound of the batch size.
+    utilization (float): Share of the latency budget a batch may spend processing.
+    smoothing (float): Weight of the latest batch in the rate estimates (EWMA).
+    deadband (float): Relative change of a setting below which within_deadband() is true
+    (1.0: anything less than a doubling or halving).
+    """
+
+    def __init__(self, target_latency=DEFAULTS["target_latency"], min_interval=DEFAULTS["min_interval"],
+                 max_interval=DEFAULTS["max_interval"], min_records=DEFAULTS["min_records"],
+                 max_records=DEFAULTS["max_records"], utilization=DEFAULTS["utilization"],
+                 smoothing=DEFAULTS["smoothing"], deadband=DEFAULTS["deadband"], initial_interval=None,
+                 stage="consumer", clock=time.monotonic):
+        if not 0 < min_interval <= max_interval:
+            raise ValueError("Need 0 < min_interval <= max_interval")
+        self.target_latency = target_latency
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.min_records = min_records
+        self.record_limit = max_records
+        self.utilization = utilization
+        self.smoothing = smoothing
+        self.deadband = deadband
+        self._clock = clock
+        self._last_update = None
+        # Current settings
+        self.interval = min(max(initial_interval or min_interval, min_interval), max_interval)
+        self.max_records = max(min_records, min(max_records, min_records * 10))
+        # Estimates
+        self.processing_rate = None
+        self.arrival_rate = None
+        self.processing_seconds = 0.0
+        self.lag_seconds = 0.0
+        self.behind = False
+        self._lag = metrics.gauge("weather_lag_seconds", "Wait of the oldest record of the latest batch", "Seconds",
+                                  stage=stage)
+        self._interval = metrics.gauge("weather_batch_interval_seconds", "Current batch interval", "Seconds",
+                                       stage=stage)
+        self._max_records = metrics.gauge("weather_batch_max_records", "Current batch size limit", "Count",
+                                          stage=stage)
+        self._export()
+
+    def _smooth(self, previous, value):
+        return value if previous is None else self.smoothing * value + (1 - self.smoothing) * previous
+
+    def _export(self):
+        self._lag.set(self.lag_seconds)
+        self._interval.set(self.interval)
+        self._max_records.set(self.max_records)
+
+    def budget(self):
+        """
+        Seconds a batch may wait for records: the target latency minus the processing time.
+        """
+        return max(self.min_interval, self.target_latency - self.processing_seconds)
+
+    def update(self, records, processing_seconds, lag_seconds):
+        """
+        Record the outcome of a batch and choose the next interval and size limit.
+
+        Returns:
+        tuple: (interval in seconds, max records) for the next batch.
+        """
+        now = self._clock()
+        if self._last_update is not None and now > self._last_update:
+            self.arrival_rate = self._smooth(self.arrival_rate, records / (now - self._last_update))
+        self._last_update = now
+        self.lag_seconds = lag_seconds
+        self.processing_seconds = self._smooth(self.processing_seconds, processing_seconds)
+        if records and processing_seconds > 0:
+            self.processing_rate = self._smooth(self.processing_rate, records / processing_seconds)
+
+        if self.processing_rate:
+            fit = int(self.processing_rate * self.target_latency * self.utilization)
+            self.max_records = max(self.min_records, min(self.record_limit, fit))
+        budget = self.budget()
+        self.behind = lag_seconds > budget
+        # Waiting longer would put the records that arrived during this batch over the budget
+        # (and make the next batch look behind, alternating full waits with none)
+        wait = self.utilization * (budget - self.processing_seconds)
+        if self.behind:
+            # Behind: no waiting, full-size batches until the backlog is gone
+            self.interval = self.min_interval
+        elif self.arrival_rate:
+            wanted = self.min_records / self.arrival_rate
+            self.interval = max(self.min_interval, min(wanted, self.max_interval, wait))
+        else:
+            self.interval = max(self.min_interval, min(self.interval * 2, self.max_interval, wait))
+        self._export()
+        return self.interval, self.max_records
+
+    def within_deadband(self, current, wanted):
+        """
+        True if moving a setting from current to wanted is too small a change to apply.
+        """
+        low, high = sorted((current, wanted))
+        return high <= low * (1 + self.deadband)
+
+    def settings(self):
+        return {"interval": self.interval, "max_records": self.max_records, "lag_seconds": self.lag_seconds,
+                "processing_rate": self.processing_rate, "arrival_rate": self.arrival_rate}
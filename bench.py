@@ -0,0 +1,860 @@
+"""
+Local benchmarks for the weather data streaming pipeline.
+
+Usage: python bench.py <benchmark> [options] [--output results.json]
+"""
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def percentile(sorted_values, q):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def reset_peak_rss():
+    """
+    Reset the process peak RSS (Linux only) so each stage reports its own peak.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """
+    Peak RSS of this process since the last reset_peak_rss(), in MB.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss never resets; it is kB on Linux and bytes on macOS.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def stage_summary(latencies, records):
+    """
+    Throughput, per-batch latency percentiles and peak RSS of one pipeline stage.
+    """
+    latencies = sorted(latencies)
+    seconds = sum(latencies)
+    return {
+        "records": records,
+        "batches": len(latencies),
+        "seconds": seconds,
+        "records_per_sec": records / seconds if seconds else None,
+        "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def bench_spark_ffwi(args):
+    """
+    Rows/sec of each Spark FFWI implementation on a synthetic DataFrame.
+    """
+    from pyspark.sql import SparkSession
+    from pyspark.sql.functions import rand
+    from pyspark.sql.functions import sum as sum_
+    from spark_ffwi import FFWI_MODES, ffwi_column
+
+    spark = (
+        SparkSession.builder.master(args.master)
+        .appName("BenchSparkFFWI")
+        .config("spark.sql.execution.arrow.pyspark.enabled", "true")
+        .getOrCreate()
+    )
+    spark.sparkContext.setLogLevel("WARN")
+
+    # Same ranges the simulators produce, with some out-of-range humidity thrown in.
+    df = spark.range(args.rows, numPartitions=args.partitions).select(
+        (rand(1) * 30 + 50).alias("temperature"),
+        (rand(2) * 110).alias("humidity"),
+        (rand(3) * 30).alias("windSpeed"),
+    ).cache()
+    df.count()
+
+    results = {"benchmark": "spark-ffwi", "rows": args.rows, "partitions": args.partitions, "modes": {}}
+    for mode in args.modes or FFWI_MODES:
+        # Warm-up run so worker start-up and codegen are not timed.
+        df.select(sum_(ffwi_column(mode)).alias("total")).collect()
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            total = df.select(sum_(ffwi_column(mode)).alias("total")).collect()[0]["total"]
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        results["modes"][mode] = {
+            "seconds": best,
+            "rows_per_sec": args.rows / best,
+            "checksum": total,
+        }
+        print(f"{mode:>6}: {args.rows / best:,.0f} rows/sec ({best:.3f}s)")
+
+    df.unpersist()
+    spark.stop()
+    return results
+
+
+def bench_pipeline(args):
+    """
+    Push N generated readings through local stand-ins of every pipeline stage:
+    generator -> Kinesis put_records -> Firehose Lambda -> Parquet sink, and optionally
+    the Spark batch (local mode) on the same records.
+    """
+    import Lambda_process_weather_data as firehose_lambda
+    import json_codec
+    import kinesisagent_simdata_gen as simdata
+    from local_aws import FakeKinesisClient
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="bench-pipeline-")
+    batch_count = -(-args.records // args.batch_size)
+    stages = {}
+
+    # Stage 1: generate readings with the simulator logic
+    reset_peak_rss()
+    batches, latencies = [], []
+    for index in range(batch_count):
+        size = min(args.batch_size, args.records - index * args.batch_size)
+        start = time.perf_counter()
+        batches.append(simdata.generate_batch(index, size))
+        latencies.append(time.perf_counter() - start)
+    stages["generate"] = stage_summary(latencies, args.records)
+
+    # Stage 2: Kinesis put_records (serialization + in-memory stream)
+    reset_peak_rss()
+    kinesis = FakeKinesisClient(shard_count=args.shards)
+    latencies = []
+    for batch in batches:
+        start = time.perf_counter()
+        records = [{'Data': json.dumps(mock_data), 'PartitionKey': str(random.randint(1, 100))} for mock_data in batch]
+        kinesis.put_records(StreamName=kinesis.stream_name, Records=records)
+        latencies.append(time.perf_counter() - start)
+    stages["kinesis_put_records"] = stage_summary(latencies, args.records)
+    stream_records = kinesis.records()
+    del batches
+
+    # Stage 3: Firehose transformation Lambda on events of the real shape
+    reset_peak_rss()
+    events = [
+        {'records': [{'recordId': record['SequenceNumber'], 'data': base64.b64encode(record['Data']).decode('ascii')}
+                     for record in stream_records[i:i + args.lambda_batch_size]]}
+        for i in range(0, len(stream_records), args.lambda_batch_size)
+    ]
+    responses, latencies = [], []
+    # The per-invocation CloudWatch EMF metric lines are still produced, but not shown
+    with contextlib.redirect_stdout(io.StringIO()):
+        for event in events:
+            start = time.perf_counter()
+            responses.append(firehose_lambda.lambda_handler(event, None))
+            latencies.append(time.perf_counter() - start)
+    stages["firehose_lambda"] = stage_summary(latencies, len(stream_records))
+    del events
+
+    # Stage 4: Parquet sink for the transformed records (what Firehose format conversion writes)
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        stages["parquet_sink"] = {"skipped": "pyarrow is not installed"}
+    else:
+        reset_peak_rss()
+        sink_dir = os.path.join(work_dir, "firehose")
+        os.makedirs(sink_dir, exist_ok=True)
+        latencies = []
+        for i, response in enumerate(responses):
+            start = time.perf_counter()
+            rows = [json_codec.loads(base64.b64decode(r['data'])) for r in response['records'] if r['result'] == 'Ok']
+            pq.write_table(pa.Table.from_pylist(rows), os.path.join(sink_dir, f"part-{i:05d}.parquet"))
+            latencies.append(time.perf_counter() - start)
+        stages["parquet_sink"] = stage_summary(latencies, len(stream_records))
+    del responses
+
+    # Stage 5: Spark batch (local mode) on the raw stream records, writing partitioned Parquet
+    if args.spark:
+        from pyspark.sql import SparkSession
+        from pyspark.sql.types import StringType
+        from spark_batch import execute_batch
+        from spark_transforms import parse_records, transform_records
+
+        spark = SparkSession.builder.master(args.master).appName("BenchPipeline").getOrCreate()
+        spark.sparkContext.setLogLevel("WARN")
+        raw = [record['Data'].decode('utf-8') for record in stream_records]
+        spark_dir = os.path.join(work_dir, "spark")
+
+        def run_batch(lines, batch_id):
+            df = transform_records(parse_records(spark.createDataFrame(lines, StringType())), args.ffwi_mode)
+            return execute_batch(df, spark_dir, batch_id=batch_id)
+
+        run_batch(raw[:args.spark_batch_size], "warmup")
+        reset_peak_rss()
+        latencies = []
+        for i in range(0, len(raw), args.spark_batch_size):
+            start = time.perf_counter()
+            run_batch(raw[i:i + args.spark_batch_size], f"bench{i // args.spark_batch_size}")
+            latencies.append(time.perf_counter() - start)
+        stages["spark_batch"] = stage_summary(latencies, len(raw))
+        stages["spark_batch"]["note"] = "peak RSS covers the Python driver only"
+        spark.stop()
+
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for name, stage in stages.items():
+        if "records_per_sec" in stage:
+            print(f"{name:>20}: {stage['records_per_sec']:>12,.0f} records/sec  p50 {stage['p50_ms']:8.2f} ms"
+                  f"  p99 {stage['p99_ms']:8.2f} ms  peak RSS {stage['peak_rss_mb']:7.1f} MB")
+        else:
+            print(f"{name:>20}: {stage}")
+
+    return {
+        "benchmark": "pipeline",
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "json_backend": json_codec.BACKEND,
+        "records": args.records,
+        "batch_size": args.batch_size,
+        "lambda_batch_size": args.lambda_batch_size,
+        "shards": args.shards,
+        "stages": stages,
+    }
+
+
+def bench_producer(args):
+    """
+    Load-test the Kinesis producer against the in-memory stream with shard limits enforced.
+    """
+    import kinesisagent_simdata_gen as simdata
+    from kinesis_producer import KinesisProducer, station_partition_key
+    from local_aws import FakeKinesisClient
+
+    client = FakeKinesisClient(shard_count=args.shards, enforce_limits=True,
+                               failure_rate=args.failure_rate, latency=args.latency)
+    payloads = []
+    for index in range(-(-args.records // 500)):
+        for mock_data in simdata.generate_batch(index, min(500, args.records - index * 500)):
+            payloads.append((json.dumps(mock_data), station_partition_key(mock_data['latitude'], mock_data['longitude'])))
+
+    producer = KinesisProducer(client, client.stream_name, aggregate=args.aggregate, max_in_flight=args.max_in_flight,
+                               preserve_order=not args.no_preserve_order)
+    start = time.perf_counter()
+    producer.put_many(payloads)
+    stats = producer.close()
+    seconds = time.perf_counter() - start
+
+    result = {
+        "benchmark": "producer",
+        "revision": git_revision(),
+        "records": args.records,
+        "shards": args.shards,
+        "aggregate": args.aggregate,
+        "preserve_order": not args.no_preserve_order,
+        "max_in_flight": args.max_in_flight,
+        "seconds": seconds,
+        "records_per_sec": args.records / seconds,
+        "stored_entries": len(client.records()),
+        **stats,
+    }
+    print(f"{args.records / seconds:,.0f} records/sec over {args.shards} shards "
+          f"({stats['calls']} calls, {stats['retried_entries']} retried, {stats['failed_records']} failed)")
+    return result
+
+
+def bench_agent_writer(args):
+    """
+    Write throughput of the Kinesis Agent log sink (rotation, fsync policy and gzip included).
+    """
+    from agent_log_writer import RotatingLogWriter
+    from load_generator import Stations, encode_readings, generate_readings
+
+    stations = Stations(1000, seed=1)
+    # Pre-encoded pool so only the writer is timed
+    pool = [encode_readings(generate_readings(stations, index, index * 500, 500)) for index in range(20)]
+    target = int(args.megabytes * 1024 * 1024)
+    work_dir = tempfile.mkdtemp(prefix="bench-agent-writer-")
+    try:
+        writer = RotatingLogWriter(os.path.join(work_dir, "weather.log"), max_bytes=args.max_bytes,
+                                   buffer_bytes=args.buffer_bytes, fsync=args.fsync, compress=args.gzip)
+        records = 0
+        start = time.perf_counter()
+        with writer:
+            while writer.bytes_written < target:
+                lines = pool[records // 500 % len(pool)]
+                writer.write_lines(lines)
+                records += len(lines)
+        seconds = time.perf_counter() - start
+        on_disk = sum(os.path.getsize(os.path.join(work_dir, name)) for name in os.listdir(work_dir))
+        files = len(os.listdir(work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    megabytes = writer.bytes_written / 1024 / 1024
+    result = {
+        "benchmark": "agent-writer",
+        "revision": git_revision(),
+        "records": records,
+        "buffer_bytes": args.buffer_bytes,
+        "max_bytes": args.max_bytes,
+        "fsync": args.fsync,
+        "gzip": args.gzip,
+        "seconds": seconds,
+        "megabytes": megabytes,
+        "mb_per_sec": megabytes / seconds,
+        "records_per_sec": records / seconds,
+        "files": files,
+        "bytes_on_disk": on_disk,
+    }
+    print(f"{megabytes / seconds:,.1f} MB/s, {records / seconds:,.0f} records/sec "
+          f"({files} files, {on_disk / 1024 / 1024:,.1f} MB on disk)")
+    return result
+
+
+def bench_alerts(args):
+    """
+    Latency of the real-time FFWI alerts in the Firehose Lambda: from a record's arrival
+    timestamp to the alert leaving the engine, plus the invocation time with alerting on.
+
+    With --churn, that fraction of the stations is replaced by new coordinates every tick,
+    and the run fails unless the engine's station state stays within --max-stations and
+    holds no station silent for longer than --station-ttl.
+    """
+    import Lambda_process_weather_data as firehose_lambda
+    from ffwi_alerts import AlertEngine, ListAlertSink
+
+    sink = ListAlertSink()
+    engine = firehose_lambda.alert_engine = AlertEngine(sink, station_ttl=args.station_ttl,
+                                                        max_stations=args.max_stations)
+    rng = random.Random(1)
+
+    def new_station():
+        return round(rng.uniform(45.53, 46), 6), round(rng.uniform(-79, -77.5), 6)
+
+    stations = [new_station() for _ in range(args.stations)]
+    hot = set(rng.sample(range(args.stations), max(1, int(args.stations * args.hot_fraction))))
+    start_time = time.time() - args.ticks * 300
+    last_seen = {}
+
+    latencies, invocations, tracked = [], [], []
+    for tick in range(args.ticks):
+        # Stations that go quiet for good, and new ones (e.g. moving sensors keyed by position)
+        for i in rng.sample(range(args.stations), int(args.stations * args.churn)) if tick else ():
+            if i not in hot:
+                stations[i] = new_station()
+        # One reading per station every 5 minutes; hot stations heat up and dry out
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(start_time + tick * 300))
+        readings = []
+        for i, (lat, lon) in enumerate(stations):
+            last_seen[f"{lat},{lon}"] = start_time + tick * 300
+            heat = tick / args.ticks if i in hot else 0.0
+            readings.append({'timestamp': timestamp, 'latitude': lat, 'longitude': lon,
+                             'temperature': 60 + 50 * heat, 'humidity': 60 - 20 * heat,
+                             'windSpeed': 10 + 15 * heat + rng.uniform(0, 2)})
+        for i in range(0, len(readings), args.lambda_batch_size):
+            arrival_ms = int(time.time() * 1000)
+            event = {'records': [
+                {'recordId': str(j), 'data': base64.b64encode(json.dumps(reading).encode('utf-8')).decode('ascii'),
+                 'kinesisRecordMetadata': {'approximateArrivalTimestamp': arrival_ms}}
+                for j, reading in enumerate(readings[i:i + args.lambda_batch_size])
+            ]}
+            sent = len(sink.alerts)
+            begin = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                firehose_lambda.lambda_handler(event, None)
+            invocations.append(time.perf_counter() - begin)
+            tracked.append(len(engine.stations))
+            latencies.extend(alert['emitted_at'] - arrival_ms / 1000 for alert in sink.alerts[sent:])
+
+    invocations.sort()
+    latencies.sort()
+    result = {
+        "benchmark": "alerts",
+        "revision": git_revision(),
+        "stations": args.stations,
+        "ticks": args.ticks,
+        "lambda_batch_size": args.lambda_batch_size,
+        "alerts": len(sink.alerts),
+        "suppressed": engine.suppressed,
+        "alerting_stations": len({alert['station'] for alert in sink.alerts}),
+        "hot_stations": len(hot),
+        "distinct_stations": len(last_seen),
+        "tracked_stations": len(engine.stations),
+        "peak_tracked_stations": max(tracked),
+        "evicted_stations": engine.evicted,
+        "invocation_p50_ms": percentile(invocations, 50) * 1000,
+        "invocation_p99_ms": percentile(invocations, 99) * 1000,
+        "alert_latency_p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "alert_latency_max_ms": latencies[-1] * 1000 if latencies else None,
+    }
+    print(f"{result['alerts']} alerts from {result['alerting_stations']} of {len(hot)} heating stations "
+          f"({engine.suppressed} suppressed); invocation p50 {result['invocation_p50_ms']:.1f} ms, "
+          f"p99 {result['invocation_p99_ms']:.1f} ms; alert latency max "
+          f"{(result['alert_latency_max_ms'] or 0):.1f} ms")
+    print(f"Station state: {len(engine.stations)} tracked (peak {max(tracked)}) of {len(last_seen)} seen, "
+          f"{engine.evicted} evicted")
+    expired = [station for station in engine.stations if last_seen[station] < engine.latest_event_time - args.station_ttl]
+    if max(tracked) > args.max_stations or expired:
+        raise SystemExit(f"Station state not bounded: peak {max(tracked)} stations (cap {args.max_stations}), "
+                         f"{len(expired)} kept longer than the {args.station_ttl:g}s TTL")
+    return result
+
+
+def bench_wire(args):
+    """
+    Size and encode/decode speed of the binary wire format against JSON.
+    """
+    import json_codec
+    import wire_format
+    from load_generator import Stations, encode_readings, generate_readings
+
+    stations = Stations(args.stations, seed=1)
+    batches = [generate_readings(stations, index, index * args.batch_size, args.batch_size)
+               for index in range(max(1, args.records // args.batch_size))]
+    readings = [
+        {"timestamp": batch["timestamp"], **{field: batch[field][i].item() for field in wire_format.FIELDS}}
+        for batch in batches for i in range(len(batch["latitude"]))
+    ]
+    key_bytes = sum(len(key) for key in stations.partition_keys) / stations.count
+
+    def timed(func):
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            output = func()
+            seconds = time.perf_counter() - start
+            best = seconds if best is None or seconds < best else best
+        return output, best
+
+    formats = {
+        "json": (json.dumps, lambda: [encode_readings(batch) for batch in batches], json_codec.loads, None),
+        "binary": (wire_format.encode, lambda: [wire_format.encode_batch(batch) for batch in batches],
+                   wire_format.loads, wire_format.decode_batch),
+    }
+    result = {"benchmark": "wire", "revision": git_revision(), "records": len(readings),
+              "json_backend": json_codec.BACKEND, "formats": {}}
+    for name, (encode, encode_batches, decode, decode_columns) in formats.items():
+        records, encode_seconds = timed(lambda: [encode(reading) for reading in readings])
+        batch_records, batch_encode_seconds = timed(encode_batches)
+        _, decode_seconds = timed(lambda: [decode(record) for record in records])
+        if decode_columns:
+            _, batch_decode_seconds = timed(lambda: [decode_columns(batch) for batch in batch_records])
+        else:
+            batch_decode_seconds = decode_seconds
+        record_bytes = sum(len(record) for record in records) / len(records)
+        stats = {
+            "bytes_per_record": record_bytes,
+            # Kinesis counts the data blob plus the partition key against the 1 MB/s shard limit
+            "records_per_shard_mb": 1024 * 1024 / (record_bytes + key_bytes),
+            "encode_us": encode_seconds / len(readings) * 1e6,
+            "batch_encode_us": batch_encode_seconds / len(readings) * 1e6,
+            "decode_us": decode_seconds / len(readings) * 1e6,
+            "batch_decode_us": batch_decode_seconds / len(readings) * 1e6,
+        }
+        result["formats"][name] = stats
+        print(f"{name:>6}: {record_bytes:6.1f} bytes/record, {stats['records_per_shard_mb']:7,.0f} records per shard-MB, "
+              f"encode {stats['encode_us']:.2f} us ({stats['batch_encode_us']:.2f} batched), "
+              f"decode {stats['decode_us']:.2f} us ({stats['batch_decode_us']:.2f} batched)")
+    return result
+
+
+def bench_consumer(args):
+    """
+    Read throughput of the multi-shard consumer against the in-memory stream, per shard count.
+    Every get_records call takes --read-latency and returns at most --records-per-call records,
+    so a single reader is bound by round trips, as against the real service.
+    """
+    from kinesis_consumer import KinesisConsumer
+    from local_aws import FakeKinesisClient
+
+    class MemoryStore:
+        def __init__(self):
+            self.checkpoints = {}
+
+        def get(self, shard_id):
+            return self.checkpoints.get(shard_id)
+
+        def put(self, checkpoints):
+            self.checkpoints.update(checkpoints)
+
+    payload = json.dumps({"timestamp": "2024-07-01T12:00:00", "latitude": 45.7, "longitude": -78.3,
+                          "temperature": 64.2, "humidity": 31.5, "windSpeed": 12.0}).encode("utf-8")
+    result = {"benchmark": "consumer", "revision": git_revision(), "records": args.records,
+              "read_latency": args.read_latency, "records_per_call": args.records_per_call,
+              "enhanced_fan_out": args.enhanced_fan_out, "runs": []}
+    for shards in args.shards:
+        client = FakeKinesisClient(shard_count=shards, read_latency=args.read_latency)
+        for start in range(0, args.records, 500):
+            client.put_records(StreamName=client.stream_name, Records=[
+                {"Data": payload, "PartitionKey": f"station-{i}"} for i in range(start, min(start + 500, args.records))])
+        consumer = KinesisConsumer(client, client.stream_name, MemoryStore(), max_records=args.records_per_call,
+                                   consumer_name="bench" if args.enhanced_fan_out else None)
+        received = []
+
+        def process(records):
+            received.append(len(records))
+            if sum(received) >= args.records:
+                consumer.stop()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            stats = consumer.run(process, max_batch_seconds=0.05, idle_timeout=10)
+            seconds = time.perf_counter() - start
+        run = {"shards": shards, "seconds": seconds, "records_read": stats["records"],
+               "records_per_sec": stats["records"] / seconds, "batches": stats["batches"],
+               "get_records_calls": client.get_records_calls}
+        result["runs"].append(run)
+        print(f"{shards:3d} shard(s): {run['records_per_sec']:10,.0f} records/sec "
+              f"({stats['records']} records in {seconds:.2f}s, {stats['batches']} batches)")
+    baseline = result["runs"][0]["records_per_sec"]
+    for run in result["runs"]:
+        run["speedup"] = run["records_per_sec"] / baseline
+    return result
+
+
+def bench_backpressure(args):
+    """
+    Replay a 10x burst through the consumer with a fixed batch size and interval, then with
+    the adaptive controller, and compare end-to-end latency and lag.
+
+    Processing a batch costs --batch-overhead seconds (the Parquet commit) plus
+    --record-cost seconds per record, so small fixed batches cannot keep up with the burst.
+    """
+    import threading
+
+    from backpressure import BatchController
+    from kinesis_consumer import KinesisConsumer, arrival_seconds
+    from local_aws import FakeKinesisClient
+
+    class MemoryStore:
+        def get(self, shard_id):
+            return None
+
+        def put(self, checkpoints):
+            pass
+
+    payload = b'{"timestamp": "2024-07-01T12:00:00", "temperature": 64.2, "humidity": 31.5, "windSpeed": 12.0}'
+    duration = args.warmup + args.burst_length + args.cooldown
+
+    def rate_at(elapsed):
+        return args.rate * (args.burst_factor if args.warmup <= elapsed < args.warmup + args.burst_length else 1)
+
+    def replay(mode):
+        client = FakeKinesisClient(shard_count=args.shards)
+        consumer = KinesisConsumer(client, client.stream_name, MemoryStore(), poll_interval=0.05)
+        controller = (BatchController(target_latency=args.target_latency, min_interval=0.1,
+                                      max_interval=args.interval * 2, min_records=int(args.rate * args.interval / 2))
+                      if mode == "adaptive" else None)
+        latencies, lags, intervals = [], [], []
+        produced = {"count": 0, "done": False}
+
+        def produce():
+            start = last = time.monotonic()
+            owed, index = 0.0, 0
+            while time.monotonic() - start < duration:
+                now = time.monotonic()
+                owed += rate_at(now - start) * (now - last)
+                last = now
+                count = int(owed)
+                owed -= count
+                for first in range(0, count, 500):
+                    client.put_records(StreamName=client.stream_name, Records=[
+                        {"Data": payload, "PartitionKey": f"station-{(index + i) % 1000}"}
+                        for i in range(first, min(first + 500, count))])
+                index += count
+                produced["count"] += count
+                time.sleep(0.05)
+            produced["done"] = True
+
+        def process(records):
+            time.sleep(args.batch_overhead + args.record_cost * len(records))
+            now = time.time()
+            arrivals = [arrival_seconds(record) for record in records]
+            lags.append(now - min(arrivals))
+            latencies.extend(now - arrival for arrival in arrivals)
+            intervals.append(controller.interval if controller else args.interval)
+            if produced["done"] and len(latencies) >= produced["count"]:
+                consumer.stop()
+            elif time.monotonic() - start > duration + args.drain_limit:
+                consumer.stop()
+
+        producer = threading.Thread(target=produce, daemon=True)
+        start = time.monotonic()
+        producer.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = consumer.run(process, max_batch_records=int(args.rate * args.interval),
+                                 max_batch_seconds=args.interval, idle_timeout=args.drain_limit, controller=controller)
+        producer.join()
+        latencies.sort()
+        run = {"mode": mode, "records": len(latencies), "produced": produced["count"], "batches": stats["batches"],
+               "seconds": time.monotonic() - start,
+               "p50_latency": percentile(latencies, 50), "p99_latency": percentile(latencies, 99),
+               "max_latency": latencies[-1] if latencies else None, "max_lag": max(lags) if lags else None,
+               "drained": len(latencies) >= produced["count"]}
+        if controller:
+            run["final"] = controller.settings()
+        print(f"{mode:>8}: p50 {run['p50_latency']:.2f}s, p99 {run['p99_latency']:.2f}s, max {run['max_latency']:.2f}s "
+              f"latency; {run['batches']} batches, {run['records']}/{run['produced']} records in {run['seconds']:.1f}s")
+        return run
+
+    result = {"benchmark": "backpressure", "revision": git_revision(), "rate": args.rate,
+              "burst_factor": args.burst_factor, "burst_length": args.burst_length,
+              "batch_overhead": args.batch_overhead, "record_cost": args.record_cost,
+              "target_latency": args.target_latency, "runs": [replay(mode) for mode in args.modes]}
+    return result
+
+
+# Runs in a fresh interpreter per cold start. Only the modules needed to build the event
+# (which the Lambda runtime has loaded before the handler anyway) are imported before the
+# clock starts. Clients are created for real, so their cost counts, but the calls go to
+# the in-memory fakes; the time spent building the fakes is left out.
+STARTUP_CHILD = r"""
+import base64, importlib, json, sys, time
+
+module_name, services, mode, records, warm = sys.argv[1], sys.argv[2].split(",") if sys.argv[2] else [], \
+    sys.argv[3], int(sys.argv[4]), int(sys.argv[5])
+
+def event(index):
+    if module_name == "Lambda_PushToAthena":
+        key = f"forest_weather_data_parquet/year=2024/month=10/day={index + 1:02d}/part-00000.snappy.parquet"
+        return {"Records": [{"s3": {"bucket": {"name": "forest-weather-data"}, "object": {"key": key}}}]}
+    reading = {"timestamp": "2024-10-01T12:00:00", "latitude": 45.7, "longitude": -78.1,
+               "temperature": 71.5, "humidity": 28.0, "windSpeed": 14.2}
+    data = base64.b64encode(json.dumps(reading).encode("utf-8")).decode("ascii")
+    return {"records": [{"recordId": str(i), "data": data} for i in range(records)]}
+
+events = [event(i) for i in range(warm + 1)]
+excluded = [0.0]
+
+def patch_clients():
+    import aws_clients
+    real_create = aws_clients._create
+
+    def create(service, *args, **kwargs):
+        real_create(service, *args, **kwargs)
+        begin = time.perf_counter()
+        import local_aws
+        fake = {"athena": local_aws.FakeAthenaClient, "s3": local_aws.FakeS3Client,
+                "quicksight": lambda: local_aws.FakeQuickSightClient(running_polls=0),
+                "sqs": local_aws.FakeSQSClient}[service]()
+        excluded[0] += time.perf_counter() - begin
+        return fake
+
+    aws_clients._create = create
+    return aws_clients
+
+start = time.perf_counter()
+handler = importlib.import_module(module_name)
+if mode == "eager":
+    # What creating the clients at import time used to cost
+    clients = patch_clients()
+    for service in services:
+        clients.client(service)
+init = time.perf_counter() - start - excluded[0]
+if mode != "eager":
+    patch_clients()
+
+excluded[0] = 0.0
+begin = time.perf_counter()
+handler.lambda_handler(events[0], None)
+first = time.perf_counter() - begin - excluded[0]
+warm_times = []
+for e in events[1:]:
+    begin = time.perf_counter()
+    handler.lambda_handler(e, None)
+    warm_times.append(time.perf_counter() - begin)
+print("STARTUP " + json.dumps({"init": init, "first": first, "warm": warm_times}))
+"""
+
+STARTUP_HANDLERS = {
+    "firehose": ("Lambda_process_weather_data", ()),
+    "athena": ("Lambda_PushToAthena", ("athena", "s3", "quicksight")),
+}
+
+
+def bench_startup(args):
+    """
+    Cold start of each Lambda handler: import and init time, first-invocation latency and
+    warm invocation latency, each cold start in a fresh interpreter.
+
+    "lazy" is the handlers as they are; "eager" also creates their AWS clients during init,
+    as they used to be, for comparison.
+    """
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get("AWS_DEFAULT_REGION", "us-east-2"))
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    # Compiled modules are cached in a real deployment package too
+    subprocess.run([sys.executable, "-m", "compileall", "-q", cwd], check=True)
+    results = []
+    for name in args.handlers:
+        module_name, services = STARTUP_HANDLERS[name]
+        for mode in args.modes:
+            runs = []
+            for _ in range(args.runs):
+                completed = subprocess.run(
+                    [sys.executable, "-c", STARTUP_CHILD, module_name, ",".join(services), mode,
+                     str(args.records), str(args.warm)],
+                    capture_output=True, text=True, cwd=cwd, env=env)
+                lines = [line for line in completed.stdout.splitlines() if line.startswith("STARTUP ")]
+                if completed.returncode != 0 or not lines:
+                    raise RuntimeError(f"{name} startup run failed:\n{completed.stderr}")
+                runs.append(json.loads(lines[-1][len("STARTUP "):]))
+            inits = sorted(run["init"] for run in runs)
+            firsts = sorted(run["first"] for run in runs)
+            colds = sorted(run["init"] + run["first"] for run in runs)
+            warms = sorted(value for run in runs for value in run["warm"])
+            result = {
+                "handler": name,
+                "mode": mode,
+                "runs": args.runs,
+                "init_p50_ms": percentile(inits, 50) * 1000,
+                "first_invoke_p50_ms": percentile(firsts, 50) * 1000,
+                "cold_total_p50_ms": percentile(colds, 50) * 1000,
+                "cold_total_max_ms": colds[-1] * 1000,
+                "warm_invoke_p50_ms": percentile(warms, 50) * 1000 if warms else None,
+            }
+            warm_text = f"{result['warm_invoke_p50_ms']:.1f}" if warms else "-"
+            print(f"{name:>8} {mode:>5}: init {result['init_p50_ms']:.1f} ms, first invoke "
+                  f"{result['first_invoke_p50_ms']:.1f} ms, cold total {result['cold_total_p50_ms']:.1f} ms "
+                  f"(max {result['cold_total_max_ms']:.1f}), warm invoke {warm_text} ms")
+            results.append(result)
+    return {"benchmark": "startup", "revision": git_revision(), "records": args.records, "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="bench", description="Local pipeline benchmarks")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--output", help="Write the results as JSON to this file")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    spark_ffwi = subparsers.add_parser("spark-ffwi", parents=[common], help="Compare Spark FFWI implementations")
+    spark_ffwi.add_argument("--rows", type=int, default=5_000_000)
+    spark_ffwi.add_argument("--partitions", type=int, default=8)
+    spark_ffwi.add_argument("--repeat", type=int, default=3)
+    spark_ffwi.add_argument("--master", default="local[*]")
+    spark_ffwi.add_argument("--modes", nargs="+", help="Subset of udf/pandas/native (default: all)")
+    spark_ffwi.set_defaults(func=bench_spark_ffwi)
+
+    pipeline = subparsers.add_parser("pipeline", parents=[common],
+                                     help="Generator -> Kinesis -> Firehose Lambda -> Parquet (-> Spark) with local stand-ins")
+    pipeline.add_argument("--records", type=int, default=100_000)
+    pipeline.add_argument("--batch-size", type=int, default=500, help="Records per put_records call")
+    pipeline.add_argument("--lambda-batch-size", type=int, default=500, help="Records per Firehose Lambda event")
+    pipeline.add_argument("--shards", type=int, default=1)
+    pipeline.add_argument("--spark", action="store_true", help="Also run the Spark batch stage in local mode")
+    pipeline.add_argument("--spark-batch-size", type=int, default=50_000, help="Records per Spark micro-batch")
+    pipeline.add_argument("--master", default="local[*]")
+    pipeline.add_argument("--ffwi-mode", default="native")
+    pipeline.add_argument("--work-dir", help="Keep the Parquet output here instead of a temporary directory")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    producer = subparsers.add_parser("producer", parents=[common], help="Kinesis producer against an in-memory stream")
+    producer.add_argument("--records", type=int, default=50_000)
+    producer.add_argument("--shards", type=int, default=4)
+    producer.add_argument("--aggregate", action="store_true")
+    producer.add_argument("--max-in-flight", type=int, default=8)
+    producer.add_argument("--no-preserve-order", action="store_true",
+                          help="Allow retries to reorder records of a station (fewer calls without --aggregate)")
+    producer.add_argument("--failure-rate", type=float, default=0.01, help="Fraction of entries failed at random")
+    producer.add_argument("--latency", type=float, default=0.02, help="Simulated put_records latency in seconds")
+    producer.set_defaults(func=bench_producer)
+
+    agent_writer = subparsers.add_parser("agent-writer", parents=[common], help="Kinesis Agent log file sink throughput")
+    agent_writer.add_argument("--megabytes", type=float, default=512)
+    agent_writer.add_argument("--buffer-bytes", type=int, default=1024 * 1024)
+    agent_writer.add_argument("--max-bytes", type=int, default=64 * 1024 * 1024)
+    agent_writer.add_argument("--fsync", default="rotate", help="never, rotate or flush")
+    agent_writer.add_argument("--gzip", action="store_true")
+    agent_writer.set_defaults(func=bench_agent_writer)
+
+    alerts = subparsers.add_parser("alerts", parents=[common], help="FFWI alert latency in the Firehose Lambda")
+    alerts.add_argument("--stations", type=int, default=2000)
+    alerts.add_argument("--ticks", type=int, default=36, help="5-minute reading intervals to simulate")
+    alerts.add_argument("--hot-fraction", type=float, default=0.05, help="Fraction of stations that heat up")
+    alerts.add_argument("--lambda-batch-size", type=int, default=500, help="Records per Firehose Lambda event")
+    alerts.add_argument("--churn", type=float, default=0.05,
+                        help="Fraction of the stations replaced by new ones every tick")
+    alerts.add_argument("--station-ttl", type=float, default=3600.0,
+                        help="Seconds of event time after which a silent station is forgotten")
+    alerts.add_argument("--max-stations", type=int, default=5000, help="Most stations the alert engine keeps")
+    alerts.set_defaults(func=bench_alerts)
+
+    wire = subparsers.add_parser("wire", parents=[common], help="Binary wire format vs JSON: size and encode/decode speed")
+    wire.add_argument("--records", type=int, default=100_000)
+    wire.add_argument("--batch-size", type=int, default=500, help="Readings per batch for the batched encoders/decoders")
+    wire.add_argument("--stations", type=int, default=1000)
+    wire.add_argument("--repeat", type=int, default=3, help="Best of this many runs is reported")
+    wire.set_defaults(func=bench_wire)
+
+    consumer = subparsers.add_parser("consumer", parents=[common],
+                                     help="Multi-shard consumer read throughput against an in-memory stream")
+    consumer.add_argument("--records", type=int, default=200_000)
+    consumer.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    consumer.add_argument("--read-latency", type=float, default=0.02, help="Simulated get_records latency in seconds")
+    consumer.add_argument("--records-per-call", type=int, default=1000, help="get_records Limit")
+    consumer.add_argument("--enhanced-fan-out", action="store_true", help="Read with subscribe_to_shard")
+    consumer.set_defaults(func=bench_consumer)
+
+    backpressure = subparsers.add_parser("backpressure", parents=[common],
+                                         help="Consumer latency under a burst: fixed vs adaptive batches")
+    backpressure.add_argument("--rate", type=float, default=2000, help="Base records/sec")
+    backpressure.add_argument("--burst-factor", type=float, default=10)
+    backpressure.add_argument("--warmup", type=float, default=5, help="Seconds at the base rate before the burst")
+    backpressure.add_argument("--burst-length", type=float, default=5)
+    backpressure.add_argument("--cooldown", type=float, default=10, help="Seconds at the base rate after the burst")
+    backpressure.add_argument("--interval", type=float, default=2, help="Fixed batch interval (records cap: rate x interval)")
+    backpressure.add_argument("--target-latency", type=float, default=5, help="Adaptive controller latency target")
+    backpressure.add_argument("--batch-overhead", type=float, default=0.5, help="Simulated per-batch commit seconds")
+    backpressure.add_argument("--record-cost", type=float, default=20e-6, help="Simulated seconds per record")
+    backpressure.add_argument("--drain-limit", type=float, default=60, help="Give up draining after this many seconds")
+    backpressure.add_argument("--shards", type=int, default=4)
+    backpressure.add_argument("--modes", nargs="+", choices=("fixed", "adaptive"), default=["fixed", "adaptive"])
+    backpressure.set_defaults(func=bench_backpressure)
+
+    startup = subparsers.add_parser("startup", parents=[common],
+                                    help="Lambda cold start: import/init time and first-invocation latency")
+    startup.add_argument("--handlers", nargs="+", choices=sorted(STARTUP_HANDLERS), default=sorted(STARTUP_HANDLERS))
+    startup.add_argument("--modes", nargs="+", choices=("lazy", "eager"), default=["lazy", "eager"])
+    startup.add_argument("--runs", type=int, default=10, help="Cold starts (fresh interpreters) per handler and mode")
+    startup.add_argument("--records", type=int, default=500, help="Records per Firehose event")
+    startup.add_argument("--warm", type=int, default=5, help="Warm invocations after the first one")
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args(argv)
+    results = args.func(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
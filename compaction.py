@@ -0,0 +1,280 @@
+"""
+Small-file compaction for the partitioned Parquet output.
+
+Streaming writes add files to the current day partition every trigger. Once a day is
+closed, compact_partition rewrites it into files of roughly a target size, range-partitioned
+and sorted by grid cell so each file covers a narrow area and its min/max statistics let
+spatial filters skip whole files.
+
+The rewrite goes to a staging directory (<table>/_compaction/, ignored by Spark and Athena)
+and is swapped in with directory renames: the old partition is renamed aside, the staged
+one renamed into place, then the old files are deleted. Files that arrive in the partition
+after it was read are carried over before the old directory is removed. Renames are atomic
+on HDFS and the local filesystem; on S3 they are copies, so compact only closed days there.
+
+The partition is missing between the two renames. The swap holds the partition's lock
+(partition_lock, a file under <table>/_locks/), which the streaming commits
+(parquet_commit.BatchCommitter) also take while they publish files into a partition, so the
+two never interleave. Writers that do not take the lock (e.g. Firehose writing to S3
+directly) are detected instead: if the partition directory reappears between the renames,
+the swap is undone (the old files are moved back next to the new ones) and the compaction
+of that partition is abandoned, since a rename onto an existing directory would nest the
+staged files inside it.
+
+Paths go through the Hadoop FileSystem API, so local paths and S3 URIs both work.
+
+Usage: spark-submit --py-files modules.zip compaction.py <table path> [--partition 2024/7/3]
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import socket
+import time
+import uuid
+from datetime import date, timedelta
+
+from spark_transforms import PARTITION_COLUMNS
+
+DEFAULT_TARGET_FILE_MB = 128
+STAGING_DIR = "_compaction"
+LOCKS_DIR = "_locks"
+# How long to wait for a partition lock, and the age after which a lock is considered
+# left behind by a crashed writer and taken over
+LOCK_TIMEOUT_SECONDS = 600
+LOCK_STALE_SECONDS = 3600
+
+
+class HadoopFS:
+    """
+    Thin wrapper over the Hadoop FileSystem of a path.
+    """
+
+    def __init__(self, spark, root):
+        self._jvm = spark.sparkContext._jvm
+        self.root = self.path(root)
+        self.fs = self.root.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+
+    def path(self, *parts):
+        return self._jvm.org.apache.hadoop.fs.Path("/".join(str(part).rstrip("/") for part in parts))
+
+    def data_files(self, directory):
+        """
+        Parquet data files in a directory (names starting with _ or . are skipped, like Spark does).
+
+        Returns:
+        dict: file name -> size in bytes.
+        """
+        path = self.path(directory)
+        if not self.fs.exists(path):
+            return {}
+        return {status.getPath().getName(): status.getLen() for status in self.fs.listStatus(path)
+                if status.isFile() and not status.getPath().getName().startswith(("_", "."))}
+
+    def partitions(self):
+        """
+        All year=/month=/day= partitions under the root, as (year, month, day) strings.
+        """
+        pattern = self.path(self.root.toString(), "year=*/month=*/day=*")
+        found = []
+        for status in self.fs.globStatus(pattern) or []:
+            if status.isDirectory():
+                day = status.getPath()
+                month = day.getParent()
+                found.append((month.getParent().getName().split("=")[1], month.getName().split("=")[1],
+                              day.getName().split("=")[1]))
+        return sorted(found, key=lambda values: tuple(int(value) for value in values))
+
+    def rename(self, source, target):
+        if not self.fs.rename(self.path(source), self.path(target)):
+            raise IOError(f"Rename of {source} to {target} failed")
+
+    def delete(self, directory):
+        self.fs.delete(self.path(directory), True)
+
+    def exists(self, path):
+        return self.fs.exists(self.path(path))
+
+    def create_new(self, path, text):
+        """
+        Create a file only if it does not exist (atomic on HDFS and the local filesystem).
+
+        Returns:
+        bool: False if the file already existed.
+        """
+        if not self.fs.createNewFile(self.path(path)):
+            return False
+        self.write_text(path, text)
+        return True
+
+    def mkdirs(self, directory):
+        self.fs.mkdirs(self.path(directory))
+
+    def names(self, directory):
+        path = self.path(directory)
+        if not self.fs.exists(path):
+            return []
+        return sorted(status.getPath().getName() for status in self.fs.listStatus(path))
+
+    def write_text(self, path, text):
+        stream = self.fs.create(self.path(path), True)
+        try:
+            stream.write(bytearray(text.encode("utf-8")))
+        finally:
+            stream.close()
+
+    def read_text(self, path):
+        stream = self.fs.open(self.path(path))
+        try:
+            return self._jvm.org.apache.commons.io.IOUtils.toString(stream, "UTF-8")
+        finally:
+            stream.close()
+
+
+def partition_dir(table_path, partition):
+    return "/".join([table_path.rstrip("/")] + [f"{key}={value}" for key, value in zip(PARTITION_COLUMNS, partition)])
+
+
+@contextlib.contextmanager
+def partition_lock(fs, table_path, relative, timeout=LOCK_TIMEOUT_SECONDS, stale=LOCK_STALE_SECONDS,
+                   poll=0.5):
+    """
+    Hold the lock of one partition (relative path "year=../month=../day=..") of a table.
+
+    Raises:
+    TimeoutError: If the lock is still held by someone else after `timeout` seconds.
+    """
+    lock = f"{table_path.rstrip('/')}/{LOCKS_DIR}/{relative.replace('/', '-')}.lock"
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    deadline = time.monotonic() + timeout
+    fs.mkdirs(lock.rsplit("/", 1)[0])
+    while not fs.create_new(lock, json.dumps({"owner": owner, "acquired_at": time.time()})):
+        try:
+            held = json.loads(fs.read_text(lock))
+        except Exception:
+            held = None  # Released (or being written) meanwhile
+        if held and time.time() - held.get("acquired_at", 0) > stale:
+            print(f"Taking over the stale lock of {relative} held by {held.get('owner')}")
+            fs.delete(lock)
+            continue
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Partition {relative} is still locked by {held and held.get('owner')}")
+        time.sleep(poll)
+    try:
+        yield
+    finally:
+        fs.delete(lock)
+
+
+def target_file_count(total_bytes, target_file_bytes):
+    return max(1, math.ceil(total_bytes / target_file_bytes))
+
+
+def compact_partition(spark, table_path, partition, target_file_mb=DEFAULT_TARGET_FILE_MB, sort_columns=("cell",),
+                      force=False):
+    """
+    Rewrite one day partition into files of about target_file_mb.
+
+    Returns:
+    dict: files/bytes before and after, or None if the partition was already compact or was
+    written by a writer outside the lock during the swap.
+    """
+    start = time.perf_counter()
+    fs = HadoopFS(spark, table_path)
+    directory = partition_dir(table_path, partition)
+    files = fs.data_files(directory)
+    total_bytes = sum(files.values())
+    file_count = target_file_count(total_bytes, target_file_mb * 1024 * 1024)
+    if not files or (len(files) <= file_count and not force):
+        return None
+
+    # Read exactly the listed files, so later arrivals are not compacted twice or lost
+    df = spark.read.parquet(*[f"{directory}/{name}" for name in files])
+    sort_columns = [name for name in sort_columns if name in df.columns]
+    if sort_columns:
+        df = df.repartitionByRange(file_count, *sort_columns).sortWithinPartitions(*sort_columns)
+    else:
+        df = df.repartition(file_count)
+
+    token = uuid.uuid4().hex[:8]
+    staging_root = f"{table_path.rstrip('/')}/{STAGING_DIR}"
+    staged = f"{staging_root}/{'-'.join(partition)}-{token}"
+    old = f"{staging_root}/{'-'.join(partition)}-{token}-old"
+    df.write.mode("error").parquet(staged)
+    written = fs.data_files(staged)
+
+    # Swap: old partition aside, staged partition into place, then carry over late arrivals
+    relative = directory[len(table_path.rstrip("/")) + 1:]
+    with partition_lock(fs, table_path, relative):
+        fs.rename(directory, old)
+        if fs.exists(directory):
+            # Recreated by a writer that does not take the lock: renaming onto it would nest
+            # the staged files inside it, so put the old files back and leave the partition
+            for name in fs.names(old):
+                fs.rename(f"{old}/{name}", f"{directory}/{name}")
+            fs.delete(old)
+            fs.delete(staged)
+            print(f"Compaction of {'/'.join(partition)} abandoned: the partition was written during the swap")
+            return None
+        fs.rename(staged, directory)
+        for name in set(fs.data_files(old)) - set(files):
+            fs.rename(f"{old}/{name}", f"{directory}/{name}")
+        fs.delete(old)
+
+    stats = {
+        "partition": "/".join(partition),
+        "files_before": len(files),
+        "bytes_before": total_bytes,
+        "files_after": len(written),
+        "bytes_after": sum(written.values()),
+        "seconds": time.perf_counter() - start,
+    }
+    print(f"Compacted {stats['partition']}: {stats['files_before']} files -> {stats['files_after']} "
+          f"({stats['bytes_before'] / 1024 / 1024:.1f} MB -> {stats['bytes_after'] / 1024 / 1024:.1f} MB) "
+          f"in {stats['seconds']:.1f}s")
+    return stats
+
+
+def closed_partitions(spark, table_path, min_age_days=1, today=None):
+    """
+    Partitions at least min_age_days old, which the streaming job no longer writes to.
+    """
+    cutoff = (today or date.today()) - timedelta(days=min_age_days)
+    return [partition for partition in HadoopFS(spark, table_path).partitions()
+            if date(*(int(value) for value in partition)) <= cutoff]
+
+
+def compact_table(spark, table_path, partitions=None, target_file_mb=DEFAULT_TARGET_FILE_MB, min_age_days=1,
+                  force=False):
+    """
+    Compact the given partitions, or every closed partition of the table.
+    """
+    if partitions is None:
+        partitions = closed_partitions(spark, table_path, min_age_days)
+    results = []
+    for partition in partitions:
+        stats = compact_partition(spark, table_path, partition, target_file_mb, force=force)
+        if stats:
+            results.append(stats)
+    print(f"Compacted {len(results)} of {len(partitions)} partition(s) in {table_path}")
+    return results
+
+
+if __name__ == "__main__":
+    from pyspark.sql import SparkSession
+
+    parser = argparse.ArgumentParser(description="Compact small Parquet files in year/month/day partitions")
+    parser.add_argument("table_path", help="Table root, e.g. s3://bucket/weather-parquet")
+    parser.add_argument("--partition", action="append",
+                        help="Partition to compact as YYYY/M/D (repeatable; default: all closed days)")
+    parser.add_argument("--target-file-mb", type=int, default=DEFAULT_TARGET_FILE_MB)
+    parser.add_argument("--min-age-days", type=int, default=1,
+                        help="Only compact partitions at least this many days old (default 1: not today)")
+    parser.add_argument("--force", action="store_true", help="Rewrite partitions that are already compact")
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.appName("WeatherParquetCompaction").getOrCreate()
+    partitions = [tuple(value.split("/")) for value in args.partition] if args.partition else None
+    compact_table(spark, args.table_path, partitions, args.target_file_mb, args.min_age_days, args.force)
+    spark.stop()
@@ -0,0 +1,80 @@
+import math
+
+import numpy as np
+
+
+def calculate_ffwi_batch(temperature, humidity, wind_speed):
+    """
+    Calculate the Fosberg Fire Weather Index (FFWI) for whole arrays of readings.
+
+    Parameters:
+    temperature (array-like): Temperatures in Fahrenheit (°F).
+    humidity (array-like): Relative Humidity in percentage (%).
+    wind_speed (array-like): Wind speeds in miles per hour (mph).
+
+    Returns:
+    numpy.ndarray: FFWI values (float64), the same as the original scalar formula for
+    every finite or infinite reading, without floating-point warnings (overflow gives
+    100 or 0 as the scalar arithmetic did). NaN marks a reading that cannot be evaluated
+    and is returned as NaN: a zero denominator (where the scalar formula raised), and a
+    NaN humidity, wind speed, or temperature below 100% humidity. NaN is how callers
+    pass missing fields; the scalar formula returned 0 for a NaN float instead.
+    """
+    t = np.asarray(temperature, dtype=np.float64)
+    h = np.asarray(humidity, dtype=np.float64)
+    w = np.asarray(wind_speed, dtype=np.float64)
+    t, h, w = np.broadcast_arrays(t, h, w)
+
+    # Infinite and huge inputs give inf/NaN intermediates, as the scalar float arithmetic did
+    with np.errstate(all='ignore'):
+        dry = 100 - h
+        denominator = dry + t
+        # Same branch as the scalar version: only humidity < 100 contributes fire risk.
+        wet = ~(h < 100)
+        # Inputs the scalar version rejects (it raised and returned None), and missing values.
+        invalid = np.isnan(h) | np.isnan(w) | (~wet & (np.isnan(t) | (denominator == 0)))
+
+        F = 1 - (2 * dry / denominator)
+        # max(F, 0) keeps NaN, exactly like the builtin when F comes first.
+        F = np.where(F < 0, 0.0, F)
+        F = np.where(wet, 0.0, F)
+
+        ffwi = ((1 + w) / 0.3002) * np.sqrt(F)
+
+    # max(0, min(ffwi, 100)): NaN falls through to 0 like the builtins do.
+    ffwi = np.where(ffwi > 100, 100.0, ffwi)
+    ffwi = np.where(ffwi > 0, ffwi, 0.0)
+    ffwi[invalid] = np.nan
+    return ffwi
+
+
+def calculate_ffwi(temperature, humidity, wind_speed):
+    """
+    Calculate the Fosberg Fire Weather Index (FFWI) for a single reading.
+
+    Pure-Python version of calculate_ffwi_batch for callers that work on one record at a
+    time (a row-at-a-time Spark UDF, the simulators): building arrays would cost more than
+    the formula. It follows the kernel step for step and gives the same values; None (a
+    missing value) counts as NaN, and None is returned when the kernel gives NaN.
+    """
+    t = math.nan if temperature is None else float(temperature)
+    h = math.nan if humidity is None else float(humidity)
+    w = math.nan if wind_speed is None else float(wind_speed)
+    if h != h or w != w:
+        return None
+    if h < 100:
+        dry = 100 - h
+        denominator = dry + t
+        if t != t or denominator == 0:
+            return None
+        F = 1 - (2 * dry / denominator)
+        # Not max(F, 0): a NaN F (inf/inf) must stay NaN, as in the kernel
+        if F < 0:
+            F = 0.0
+    else:
+        F = 0.0
+    ffwi = ((1 + w) / 0.3002) * math.sqrt(F)
+    if ffwi > 100:
+        return 100.0
+    # NaN falls through to 0, like the kernel
+    return ffwi if ffwi > 0 else 0.0
@@ -0,0 +1,277 @@
+"""
+Real-time FFWI alerts.
+
+AlertEngine keeps a small state per station (the last N FFWI readings, an EWMA of FFWI and
+the current alert level) and checks every reading as it arrives:
+
+- level alerts when the EWMA rises into a higher level of ALERT_LEVELS; the station only
+  drops back once the EWMA falls `hysteresis` below the level's threshold, so a value
+  hovering around a threshold does not alert repeatedly;
+- rise alerts when FFWI over the kept readings grows faster than `rise_per_hour`;
+- any alert of the same kind and level is suppressed for `cooldown` seconds per station.
+
+Station state is evicted once a station has sent nothing for `station_ttl` seconds of event
+time (measured against the newest reading seen), and the least recently updated stations
+are dropped beyond `max_stations`, so a long-lived instance seeing an open-ended set of
+stations (or moving ones, keyed by coordinates) keeps bounded memory. An evicted station
+starts over as new, which only matters for a station silent far longer than the cooldown.
+
+Alerts go to a pluggable sink (a JSON lines file, an SQS-style queue or a list). The engine
+runs inside the Firehose Lambda, so an alert is emitted while the batch is being processed,
+minutes before the data reaches Parquet, Athena and QuickSight.
+"""
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+import profiling
+
+# (name, FFWI threshold), lowest first
+ALERT_LEVELS = (("elevated", 30.0), ("high", 50.0), ("extreme", 75.0))
+
+DEFAULTS = {
+    "history": 12,
+    "ewma_alpha": 0.5,
+    "hysteresis": 5.0,
+    "rise_per_hour": 20.0,
+    "min_rise_span": 600.0,
+    "cooldown": 1800.0,
+    "station_ttl": 6 * 3600.0,
+    "max_stations": 100000,
+}
+
+
+class StationState:
+    __slots__ = ("readings", "ewma", "level", "last_alert")
+
+    def __init__(self, history):
+        # (event time in epoch seconds, ffwi)
+        self.readings = deque(maxlen=history)
+        self.ewma = None
+        self.level = 0
+        # (kind, level) -> epoch seconds of the last alert
+        self.last_alert = {}
+
+
+class AlertEngine:
+    """
+    Per-station FFWI alerting.
+
+    Parameters:
+    sink: Object with a send(alerts) method (see FileAlertSink, QueueAlertSink, ListAlertSink).
+    levels (tuple): (name, threshold) pairs, lowest first.
+    history (int): FFWI readings kept per station for the rise check.
+    ewma_alpha (float): Weight of the newest reading in the EWMA (1.0 compares raw readings).
+    hysteresis (float): How far below a threshold the EWMA must fall to leave its level.
+    rise_per_hour (float): FFWI increase per hour that raises a rise alert.
+    min_rise_span (float): Minimum seconds between the oldest and newest kept reading for the rise check.
+    cooldown (float): Seconds during which a repeated alert of the same kind and level is suppressed.
+    station_ttl (float): Seconds of event time without a reading after which a station's state is dropped.
+    max_stations (int): Most stations kept; the least recently updated ones are dropped first.
+    """
+
+    def __init__(self, sink, levels=ALERT_LEVELS, history=DEFAULTS["history"], ewma_alpha=DEFAULTS["ewma_alpha"],
+                 hysteresis=DEFAULTS["hysteresis"], rise_per_hour=DEFAULTS["rise_per_hour"],
+                 min_rise_span=DEFAULTS["min_rise_span"], cooldown=DEFAULTS["cooldown"],
+                 station_ttl=DEFAULTS["station_ttl"], max_stations=DEFAULTS["max_stations"]):
+        self.sink = sink
+        self.levels = tuple(levels)
+        self.history = history
+        self.ewma_alpha = ewma_alpha
+        self.hysteresis = hysteresis
+        self.rise_per_hour = rise_per_hour
+        self.min_rise_span = min_rise_span
+        self.cooldown = cooldown
+        self.station_ttl = station_ttl
+        self.max_stations = max_stations
+        # Least recently updated first
+        self.stations = OrderedDict()
+        self.latest_event_time = None
+        self.alerts_sent = 0
+        self.suppressed = 0
+        self.evicted = 0
+
+    def _level_for(self, value, current):
+        """
+        Level index (0 = below every threshold) of an EWMA value, with hysteresis on the way down.
+        """
+        level = 0
+        for i, (_, threshold) in enumerate(self.levels, start=1):
+            # Levels at or below the current one are kept until the value falls `hysteresis` below them
+            if value >= (threshold - self.hysteresis if i <= current else threshold):
+                level = i
+        return level
+
+    def _alert(self, state, station, kind, level, event_time, value, detail):
+        key = (kind, level)
+        last = state.last_alert.get(key)
+        if last is not None and event_time - last < self.cooldown:
+            self.suppressed += 1
+            return None
+        state.last_alert[key] = event_time
+        return {
+            "station": station,
+            "kind": kind,
+            "level": self.levels[level - 1][0] if level else None,
+            "ffwi": value,
+            "ewma": round(state.ewma, 3),
+            "event_time": datetime.fromtimestamp(event_time, timezone.utc).isoformat(),
+            "emitted_at": time.time(),
+            **detail,
+        }
+
+    def update(self, station, event_time, value):
+        """
+        Add one reading (event_time in epoch seconds) and return the alerts it raises.
+        """
+        state = self.stations.get(station)
+        if state is None:
+            state = self.stations[station] = StationState(self.history)
+            if len(self.stations) > self.max_stations:
+                self.stations.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.stations.move_to_end(station)
+        if self.latest_event_time is None or event_time > self.latest_event_time:
+            self.latest_event_time = event_time
+        state.readings.append((event_time, value))
+        state.ewma = value if state.ewma is None else self.ewma_alpha * value + (1 - self.ewma_alpha) * state.ewma
+
+        alerts = []
+        level = self._level_for(state.ewma, state.level)
+        if level > state.level:
+            alert = self._alert(state, station, "level", level, event_time, value,
+                                {"threshold": self.levels[level - 1][1]})
+            if alert:
+                alerts.append(alert)
+        state.level = level
+
+        first_time, first_value = state.readings[0]
+        span = event_time - first_time
+        if span >= self.min_rise_span:
+            rate = (value - first_value) / span * 3600.0
+            if rate >= self.rise_per_hour:
+                alert = self._alert(state, station, "rise", 0, event_time, value,
+                                    {"rise_per_hour": round(rate, 3), "window_seconds": span})
+                if alert:
+                    alerts.append(alert)
+        return alerts
+
+    def process(self, stations, event_times, values):
+        """
+        Check a batch of readings (parallel sequences) and send the alerts to the sink.
+
+        Returns:
+        list: the alerts sent.
+        """
+        alerts = []
+        for station, event_time, value in zip(stations, event_times, values):
+            alerts.extend(self.update(station, event_time, value))
+        self.evict()
+        if alerts:
+            self.sink.send(alerts)
+            self.alerts_sent += len(alerts)
+        return alerts
+
+    def evict(self):
+        """
+        Drop the stations silent for station_ttl seconds (called after every batch; the
+        max_stations cap is applied as stations are added).
+
+        Stations are checked in update order and the sweep stops at the first one still
+        live, so a station updated with an out-of-order old reading may outlive the TTL
+        until the stations updated before it expire.
+
+        Returns:
+        int: the number of stations dropped.
+        """
+        dropped = 0
+        if self.latest_event_time is not None:
+            expiry = self.latest_event_time - self.station_ttl
+            while self.stations:
+                state = next(iter(self.stations.values()))
+                if state.readings[-1][0] >= expiry:
+                    break
+                self.stations.popitem(last=False)
+                dropped += 1
+        self.evicted += dropped
+        return dropped
+
+
+def event_time(timestamp, default=None):
+    """
+    Epoch seconds of an ISO timestamp (naive timestamps are UTC, as written by the simulators).
+    """
+    try:
+        parsed = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return default if default is not None else time.time()
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class ListAlertSink:
+    """
+    Keeps alerts in memory (for tests and benchmarks).
+    """
+
+    def __init__(self):
+        self.alerts = []
+
+    def send(self, alerts):
+        self.alerts.extend(alerts)
+
+
+class FileAlertSink:
+    """
+    Appends alerts to a JSON lines file, flushed after every batch.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def send(self, alerts):
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(alert) + "\n" for alert in alerts))
+
+
+class QueueAlertSink:
+    """
+    Sends alerts to an SQS queue (boto3 SQS client or local_aws.FakeSQSClient), 10 per call.
+    """
+
+    def __init__(self, sqs_client, queue_url):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+
+    def send(self, alerts):
+        for start in range(0, len(alerts), 10):
+            entries = [{"Id": str(i), "MessageBody": json.dumps(alert)}
+                       for i, alert in enumerate(alerts[start:start + 10])]
+            with profiling.phase("aws"):
+                response = self.sqs_client.send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            if response.get("Failed"):
+                print(f"Failed to queue {len(response['Failed'])} alert(s): {response['Failed'][0]}")
+
+
+def sink_from_spec(spec, sqs_client_factory=None):
+    """
+    Build a sink from "file:<path>" or "sqs:<queue url>"; None or "" disables alerting.
+    """
+    if not spec:
+        return None
+    kind, _, target = spec.partition(":")
+    if kind == "file":
+        return FileAlertSink(target)
+    if kind == "sqs":
+        if sqs_client_factory is None:
+            import aws_clients
+            sqs_client_factory = lambda: aws_clients.lazy("sqs")
+        return QueueAlertSink(sqs_client_factory(), target)
+    raise ValueError(f"Unknown alert sink: {spec} (expected file:<path> or sqs:<queue url>)")
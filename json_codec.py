@@ -0,0 +1,25 @@
+import json
+
+# Optional fast JSON backend: orjson when it is installed (e.g. bundled in a Lambda layer),
+# otherwise the standard library. dumps() always returns UTF-8 bytes.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+else:
+    BACKEND = "json"
+
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
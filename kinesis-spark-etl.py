@@ -1,34 +1,24 @@
-from pyspark import SparkContext
+from pyspark import SparkConf, SparkContext
 from pyspark.sql import SparkSession
-from pyspark.streaming import StreamingContext
-from pyspark.streaming.kinesis import KinesisUtils, InitialPositionInStream
-from pyspark.sql.types import StructType, StructField, StringType, DoubleType
-from pyspark.sql.functions import col, lit, udf, expr
+from pyspark.sql.types import StringType
+import argparse
 import json
 import math
-from datetime import datetime
-import sys
-
-def calculate_ffwi(temperature, humidity, wind_speed):
-    """
-    Calculate the Fosberg Fire Weather Index (FFWI).
-    """
-    try:
-        F = 0
-        # Calculate F (factor based on relative humidity and temperature)
-        if humidity < 100:
-            F = 1 - (2 * (100 - humidity) / ((100 - humidity) + temperature))
-            F = max(F, 0)
-        else:
-            F = 0  # If humidity is 100%, set F to 0, as there is no fire risk.
-
-        # Calculate FFWI based on the formula
-        ffwi = ((1 + wind_speed) / 0.3002) * math.sqrt(F)
-        ffwi = max(0, min(ffwi, 100))  # Ensure FFWI is in range [0, 100]
-        return ffwi
-    except Exception as e:
-        print(f"Error calculating FFWI: {e}")
-        return None
+import metrics
+import profiling
+from backpressure import BatchController
+from parquet_commit import recover, scope_for
+from spark_backpressure import ADAPTIVE_TRIGGER, backpressure_conf, dstream_lag_listener, run_adaptive
+from spark_batch import DEFAULT_STORAGE_LEVEL, execute_batch
+from spark_ffwi import FFWI_MODES, DEFAULT_FFWI_MODE
+from spark_sources import SOURCES, build_source
+from spark_transforms import parse_records, transform_records
+from spark_validation import DEAD_LETTER_FORMATS
+from spark_wire import DEFAULT_WIRE_FORMAT, WIRE_FORMATS
+from spark_windows import DEFAULT_MEDIAN_ACCURACY, DEFAULT_WATERMARK
+from spatial_grid import DEFAULT_RESOLUTION, MAX_RESOLUTION, MIN_RESOLUTION
+from rollups import ROLLUPS, start_rollup_streams
+from structured_etl import COMMIT_MODES, DEFAULT_TRIGGER, start_structured_stream, trigger_options
 
 def print_kinesis_data(rdd):
     """
@@ -42,64 +32,43 @@ def print_kinesis_data(rdd):
         for record in records:
             print(json.loads(record)) 
 
-def process_kinesis_stream(spark, rdd, output_path):
+@profiling.profiled("spark_batch")
+def process_kinesis_stream(spark, rdd, output_path, ffwi_mode=DEFAULT_FFWI_MODE, verbose=False,
+                           level=DEFAULT_STORAGE_LEVEL, batch_time=None, resolution=DEFAULT_RESOLUTION,
+                           dead_letter_path=None, dead_letter_format="jsonl", wire_format=DEFAULT_WIRE_FORMAT,
+                           commit_scope=None):
     """
     Process each RDD in the DStream, calculate FFWI, and save as Parquet to S3 partitioned by year/month/day.
+    ffwi_mode selects the FFWI implementation (see spark_ffwi.FFWI_MODES) and resolution the region grid (see spatial_grid.py).
+    The batch runs as a single Spark job (see spark_batch.execute_batch); verbose adds debug output.
+    Invalid readings are counted per reason code and written to dead_letter_path (see spark_validation.py).
+    wire_format "auto" also decodes binary wire-format records (see wire_format.py).
+    With commit_scope the batch is committed idempotently under its batch time in milliseconds
+    (see parquet_commit.py). A failed batch is counted and re-raised.
+    PROFILE=phases|sample|cprofile profiles every batch on the driver (see profiling.py).
     """
-    print("Processing Stream.....")
-    print("Number of RDD in DStream: "+ str(rdd.count()))
     try:
-        if not rdd.isEmpty():
-            # Extract: Parse records as JSON
-            parsed_records = rdd.map(lambda record: json.loads(record))
-
-            # Filter out extreme values (temperature < -80 or > 80, humidity < 0 or > 100, wind_speed < 0 or > 50)
-            filtered_records = parsed_records.filter(
-                lambda record: -80 <= record["temperature"] <= 80
-                and 0 <= record["humidity"] <= 100
-                and 0 <= record["windSpeed"] <= 50
-            )
-
-            # Transform: Convert RDD to DataFrame
-            schema = StructType([
-                StructField("timestamp", StringType(), True),
-                StructField("latitude", DoubleType(), True),
-                StructField("longitude", DoubleType(), True),
-                StructField("temperature", DoubleType(), True),
-                StructField("humidity", DoubleType(), True),
-                StructField("windSpeed", DoubleType(), True)
-            ])
-            df = spark.createDataFrame(filtered_records, schema=schema)
-
-            # Add calculated FFWI and partition columns
-            df = df.withColumn("ffwi", udf(lambda t, h, w: calculate_ffwi(t, h, w), DoubleType())(col("temperature"), col("humidity"), col("windSpeed"))) 
-
-            # Map: Add logic for grouping data by region (latitude and longitude)
-            df = df.withColumn("region", expr("concat(round(latitude, 1), '_', round(longitude, 1))"))
-
-            # Reduce: Perform aggregations
-            aggregated_df = (
-                df.groupBy("region")
-                .agg(
-                    expr("percentile_approx(windSpeed, 0.5)").alias("MedianWindSpeed"),
-                    expr("percentile_approx(temperature, 0.5)").alias("MedianTemperature"),
-                    expr("percentile_approx(humidity, 0.5)").alias("MedianHumidity"),
-                    expr("avg(ffwi)").alias("AverageFFWI")
-                )
-            )
-
-            # Add calculated FFWI and partition columns
-            aggregated_df = aggregated_df.withColumn("year", year(col("timestamp").cast("timestamp"))) \
-                .withColumn("month", month(col("timestamp").cast("timestamp"))) \
-                .withColumn("day", dayofmonth(col("timestamp").cast("timestamp")))
-
-            aggregated_df.printSchema()
-            print(aggregated_df.show())
-            print("Total number of records: " + str(aggregated_df.count()))
-            # Write DataFrame to S3 as Parquet with partitioning
-            aggregated_df.write.mode("append").partitionBy("year", "month", "day").parquet(output_path)
+        # An interval without receiver blocks has no partitions; checking it launches no job.
+        if rdd.getNumPartitions() == 0:
+            return None
+
+        # Extract: Parse records as JSON, validate, add FFWI and region cell (all column expressions)
+        with profiling.phase("parse"):
+            raw_df = spark.createDataFrame(rdd, StringType())
+            df = transform_records(parse_records(raw_df, wire_format=wire_format), ffwi_mode, resolution, keep_rejects=True)
+
+        # Milliseconds: batch intervals can be shorter than a second, and two batches sharing an
+        # id would make the committer skip the second one as already committed
+        batch_id = str(round(batch_time.timestamp() * 1000)) if batch_time else None
+        return execute_batch(df, output_path, batch_id=batch_id, verbose=verbose, level=level,
+                             dead_letter_path=dead_letter_path, dead_letter_format=dead_letter_format,
+                             commit_scope=commit_scope)
     except Exception as e:
+        metrics.counter("weather_batch_errors_total", "Batches that failed", stage="spark").inc()
         print(f"Error processing stream: {e}")
+        # Failing the batch stops the streaming context instead of dropping the batch; on
+        # restart the committer rolls back the partial commit and the batch is replayed
+        raise
 
 def debug_kinesis_stream(rdd):
     print(f"RDD Partition Count: {rdd.getNumPartitions()}")
@@ -107,49 +76,242 @@ def debug_kinesis_stream(rdd):
     if not rdd.isEmpty():
         print("First Record:", rdd.first())
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: spark-kinesis-etl [output-folder]")
-        sys.exit(-1)
+def receiver_count(args):
+    """
+    Number of open shards of the stream, at least 1.
+    """
+    import aws_clients
+    from kinesis_consumer import open_shard_count
+
+    try:
+        client = aws_clients.client("kinesis", region_name=args.region, endpoint_url=args.endpoint_url)
+        return max(1, open_shard_count(client, args.stream_name))
+    except Exception as e:
+        print(f"Could not list the shards of {args.stream_name} ({e}), using 1 receiver")
+        return 1
+
+def run_dstream(args):
+    """
+    Run the legacy DStream job (receiver-based KinesisUtils stream).
+    """
+    # Imported here: pyspark.streaming is deprecated and absent from newer Spark releases.
+    from pyspark.streaming import StreamingContext
 
     # S3 output path
-    output_path = sys.argv[1]
+    output_path = args.output_path
+    # One receiver per open shard unless --receivers is given
+    receivers = args.receivers or receiver_count(args)
     print("Initialize Spark context and streaming context")
-    # Initialize Spark context and streaming context
-    sc = SparkContext("local[2]", "KinesisWeatherDataProcessing")
+    # Initialize Spark context and streaming context (the master comes from spark-submit unless --master is given)
+    conf = SparkConf().setAppName("KinesisWeatherDataProcessing")
+    if args.master:
+        conf.setMaster(args.master)
+    if not args.no_backpressure:
+        backpressure_conf(conf, args.max_rate, args.initial_rate)
+    sc = SparkContext(conf=conf)
     sc.setLogLevel("DEBUG")
-    ssc = StreamingContext(sc, 10)  # Batch interval: 10 seconds
+    cores = sc.defaultParallelism
+    if cores <= receivers:
+        # Every receiver holds a core for good; batches need at least one more
+        print(f"Warning: {receivers} receiver(s) on {cores} core(s) leave no core to process batches")
+    # Batch times are the batch ids of the idempotent commit. They only repeat on a replay when
+    # the context is recovered from its checkpoint, which also keeps the Kinesis sequence
+    # ranges of the pending batches, so they are re-read with the same records.
+    commit_scope = None
+    if args.commit_mode == "idempotent":
+        if not args.streaming_checkpoint:
+            # A restarted context re-reads from the KCL checkpoint under new batch times, so
+            # the commit cannot recognize a replay; it still rolls back partial batches
+            print("Warning: without --streaming-checkpoint the DStream output is at-least-once: "
+                  "records re-read after a restart are written again")
+        commit_scope = scope_for(args.streaming_checkpoint or "dstream")
+        recover(SparkSession.builder.getOrCreate(), output_path, commit_scope)
+    if args.streaming_checkpoint:
+        ssc = StreamingContext.getOrCreate(args.streaming_checkpoint,
+                                           lambda: create_streaming_context(sc, args, receivers, commit_scope))
+    else:
+        ssc = create_streaming_context(sc, args, receivers, commit_scope)
+    # Lag and the interval the controller would choose, as gauges and in the log
+    controller = BatchController(target_latency=args.target_latency, initial_interval=args.batch_interval, stage="spark")
+    ssc.addStreamingListener(dstream_lag_listener(controller, args.batch_interval))
 
-    spark = SparkSession.builder.getOrCreate()
+    print("Start the context...")
+    # Start the streaming context
+    ssc.start()
+    ssc.awaitTermination()
+
+def create_streaming_context(sc, args, receivers, commit_scope=None):
+    """
+    Build the StreamingContext and the Kinesis DStream graph (called again only when there is no checkpoint to recover).
+    """
+    from pyspark.streaming import StreamingContext
+    from pyspark.streaming.kinesis import KinesisUtils, InitialPositionInStream, utf8_decoder
+    import wire_format
 
-    # Register UDF for FFWI calculation
-    from pyspark.sql.functions import udf, lit
-    from pyspark.sql.types import FloatType
-    udf_calculate_ffwi = udf(calculate_ffwi, FloatType())
-    print("Create Kinesis DStream")
-    # Create Kinesis DStream
-    kinesis_stream = KinesisUtils.createStream(
+    output_path = args.output_path
+    ssc = StreamingContext(sc, args.batch_interval)
+    if args.streaming_checkpoint:
+        ssc.checkpoint(args.streaming_checkpoint)
+
+    print(f"Create Kinesis DStream with {receivers} receiver(s)")
+    # Create one Kinesis receiver per shard. The receivers share the KCL application (and its
+    # DynamoDB lease and checkpoint table, named after kinesisAppName), which balances the
+    # shard leases between them, including the child shards of a reshard.
+    streams = [KinesisUtils.createStream(
         ssc,
-	    kinesisAppName="KinesisWeatherDataProcessing",
-        streamName="weather_data_stream",
-        endpointUrl="https://kinesis.us-east-2.amazonaws.com",
-        regionName="us-east-2",
+        kinesisAppName="KinesisWeatherDataProcessing",
+        streamName=args.stream_name,
+        endpointUrl=args.endpoint_url,
+        regionName=args.region,
         initialPositionInStream=InitialPositionInStream.TRIM_HORIZON,
         checkpointInterval=10,
         awsAccessKeyId = "HideKeyID",
-        awsSecretKey = "HideSecreteKey"
-    )
+        awsSecretKey = "HideSecreteKey",
+        # Binary wire-format records are passed on as base64 text instead of failing UTF-8 decoding
+        decoder=wire_format.kinesis_decoder if args.wire_format == "auto" else utf8_decoder
+    ) for _ in range(receivers)]
+    kinesis_stream = ssc.union(*streams) if len(streams) > 1 else streams[0]
 
     #kinesis_stream.foreachRDD(debug_kinesis_stream)
 
     print("Stream Created; Printing Stream.....")
     # Print raw Kinesis data
     print("Processing Stream.....")
-    # Process the Kinesis stream
-    kinesis_stream.foreachRDD(lambda rdd: process_kinesis_stream(spark, rdd, output_path))
+    # Process the Kinesis stream (the session is looked up per batch: the function is checkpointed)
+    kinesis_stream.foreachRDD(lambda batch_time, rdd: process_kinesis_stream(
+        SparkSession.builder.getOrCreate(), rdd, output_path, args.ffwi_mode, verbose=args.verbose,
+        level=args.storage_level, batch_time=batch_time, resolution=args.grid_resolution,
+        dead_letter_path=args.dead_letter_path, dead_letter_format=args.dead_letter_format,
+        wire_format=args.wire_format, commit_scope=commit_scope))
+    return ssc
 
-    print("Start the context...")
-    # Start the streaming context
-    ssc.start()
-    ssc.awaitTermination()
+def run_structured(args):
+    """
+    Run the Structured Streaming job on the selected source.
+    """
+    if not args.checkpoint_location:
+        raise ValueError("--checkpoint-location is required for the structured engine")
+    spark = SparkSession.builder.appName("KinesisWeatherDataProcessing").getOrCreate()
+
+    print(f"Create {args.source} stream")
+    source_df = build_source(spark, args)
+    # Only the Kinesis source can cap the records of a micro-batch (see spark_backpressure.py)
+    shards = receiver_count(args) if args.trigger == ADAPTIVE_TRIGGER and args.source == "kinesis" else None
+
+    def start(trigger, max_records=None):
+        source = source_df
+        if max_records:
+            # Spread the controller's batch limit over the shards, within --max-records-per-shard
+            per_shard = math.ceil(max_records / shards)
+            if args.max_records_per_shard:
+                per_shard = min(per_shard, args.max_records_per_shard)
+            source = build_source(spark, args, max_records_per_shard=per_shard)
+        return start_structured_stream(source, args.output_path, args.checkpoint_location,
+                                       trigger=trigger, ffwi_mode=args.ffwi_mode,
+                                       verbose=args.verbose, level=args.storage_level,
+                                       window_duration=args.window, slide_duration=args.slide,
+                                       watermark=args.watermark, median_accuracy=args.median_accuracy,
+                                       resolution=args.grid_resolution, dead_letter_path=args.dead_letter_path,
+                                       dead_letter_format=args.dead_letter_format, wire_format=args.wire_format,
+                                       commit_mode=args.commit_mode)
+
+    if args.trigger == ADAPTIVE_TRIGGER:
+        # The trigger interval follows the load (see spark_backpressure.run_adaptive)
+        controller = BatchController(target_latency=args.target_latency, initial_interval=args.batch_interval,
+                                     stage="spark")
+        run_adaptive(spark, start, controller, cap_records=shards is not None)
+        return
+    query = start(args.trigger)
+    print(f"Streaming query started (trigger: {args.trigger}, checkpoint: {args.checkpoint_location})")
+    if args.rollups is None:
+        query.awaitTermination()
+        return
+
+    # Rollups are separate queries on the same source, each with its own state and checkpoint
+    records = transform_records(parse_records(source_df, wire_format=args.wire_format), args.ffwi_mode, args.grid_resolution)
+    rollup_root = args.rollup_path or args.output_path.rstrip("/") + "-rollups"
+    start_rollup_streams(records, rollup_root, args.checkpoint_location, trigger_options(args.trigger),
+                         names=args.rollups, watermark=args.watermark, accuracy=args.median_accuracy,
+                         idempotent=args.commit_mode == "idempotent")
+    # Wait for every query (with available-now they finish one by one); a failed query raises
+    while spark.streams.active:
+        spark.streams.awaitAnyTermination()
+        spark.streams.resetTerminated()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="spark-kinesis-etl")
+    parser.add_argument("output_path", metavar="output-folder", help="S3 output path")
+    parser.add_argument("--ffwi-mode", choices=FFWI_MODES, default=DEFAULT_FFWI_MODE,
+                        help="FFWI implementation: Python UDF, Arrow pandas UDF or native column expression")
+    parser.add_argument("--engine", choices=("dstream", "structured"), default="dstream",
+                        help="Legacy DStream receiver job or Structured Streaming job")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print the schema and aggregated rows of every batch (adds Spark actions)")
+    parser.add_argument("--grid-resolution", type=int, choices=range(MIN_RESOLUTION, MAX_RESOLUTION + 1), default=DEFAULT_RESOLUTION,
+                        metavar="N", help=f"Region grid resolution: cells of 360/2^N degrees (default {DEFAULT_RESOLUTION})")
+    parser.add_argument("--storage-level", default=DEFAULT_STORAGE_LEVEL,
+                        help="StorageLevel used to persist each batch's parsed readings")
+    parser.add_argument("--dead-letter-path",
+                        help="Write rejected readings here with their reason code (default: only count them)")
+    parser.add_argument("--dead-letter-format", choices=DEAD_LETTER_FORMATS, default="jsonl")
+    parser.add_argument("--wire-format", choices=WIRE_FORMATS, default=DEFAULT_WIRE_FORMAT,
+                        help="json, or auto to also decode binary wire-format records (see wire_format.py)")
+    parser.add_argument("--commit-mode", choices=COMMIT_MODES, default="idempotent",
+                        help="idempotent: commit each batch once under its batch id (replays are skipped; with the "
+                             "DStream engine only with --streaming-checkpoint, at-least-once without it); append: plain appends")
+    parser.add_argument("--batch-interval", type=float, default=10.0,
+                        help="DStream batch interval in seconds (initial trigger interval with --trigger adaptive)")
+    parser.add_argument("--target-latency", type=float, default=30.0,
+                        help="Latency the batch controller aims for, in seconds (see backpressure.py)")
+    metrics.add_metrics_arguments(parser)
+    parser.add_argument("--stream-name", default="weather_data_stream")
+    parser.add_argument("--region", default="us-east-2")
+    parser.add_argument("--endpoint-url", default="https://kinesis.us-east-2.amazonaws.com")
+    dstream = parser.add_argument_group("DStream engine")
+    dstream.add_argument("--master", help="Spark master, e.g. local[8] (default: the one given to spark-submit)")
+    dstream.add_argument("--max-rate", type=float, help="Hard cap on records/sec per receiver")
+    dstream.add_argument("--initial-rate", type=float, help="Records/sec per receiver before backpressure has measurements")
+    dstream.add_argument("--no-backpressure", action="store_true", help="Accept records as fast as they arrive")
+    dstream.add_argument("--streaming-checkpoint",
+                         help="StreamingContext checkpoint directory; on restart, pending batches are replayed with their "
+                              "batch ids (needed for exactly-once output with --commit-mode idempotent)")
+    dstream.add_argument("--receivers", type=int,
+                         help="Kinesis receivers (default: one per open shard; restart after resharding to follow the new count)")
+    structured = parser.add_argument_group("structured streaming")
+    structured.add_argument("--source", choices=SOURCES, default="kinesis",
+                            help="kinesis in production, jsonl (directory of JSONL files) or socket for local runs")
+    structured.add_argument("--input-path", help="Directory of JSONL files for the jsonl source")
+    structured.add_argument("--max-files-per-trigger", type=int)
+    structured.add_argument("--max-records-per-shard", type=int,
+                            help="kinesis source: records read per shard per micro-batch (with --trigger adaptive, "
+                                 "an upper bound of the controller's limit)")
+    structured.add_argument("--host", default="localhost", help="Host for the socket source")
+    structured.add_argument("--port", type=int, default=9999, help="Port for the socket source")
+    structured.add_argument("--checkpoint-location", help="Checkpoint directory (local path or S3 URI)")
+    structured.add_argument("--trigger", default=DEFAULT_TRIGGER,
+                            help='Processing-time interval such as "10 seconds", "once", "available-now" or '
+                                 '"adaptive" (interval chosen from the load, see spark_backpressure.py)')
+    windows = parser.add_argument_group("event-time windows (structured engine)")
+    windows.add_argument("--window", help='Aggregate regions over event-time windows of this length, e.g. "1 hour"')
+    windows.add_argument("--slide", help='Slide interval for sliding windows, e.g. "10 minutes" (default: tumbling)')
+    windows.add_argument("--watermark", default=DEFAULT_WATERMARK, help="How late a reading may arrive")
+    windows.add_argument("--median-accuracy", type=int, default=DEFAULT_MEDIAN_ACCURACY,
+                         help="percentile_approx accuracy for the windowed medians")
+    rollups = parser.add_argument_group("rollup tables (structured engine)")
+    rollups.add_argument("--rollups", nargs="*", choices=list(ROLLUPS),
+                         help="Also maintain these rollup tables (all of them when given without names)")
+    rollups.add_argument("--rollup-path", help="Root of the rollup tables (default: <output-folder>-rollups)")
+    args = parser.parse_args()
+    if args.window and args.engine != "structured":
+        parser.error("--window requires --engine structured")
+    if args.rollups is not None and args.engine != "structured":
+        parser.error("--rollups requires --engine structured")
+    if args.rollups is not None and args.trigger == ADAPTIVE_TRIGGER:
+        parser.error("--rollups needs a fixed --trigger")
 
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port)
+    if args.engine == "structured":
+        run_structured(args)
+    else:
+        run_dstream(args)
@@ -0,0 +1,478 @@
+"""
+Multi-shard Kinesis consumer with pluggable checkpoints.
+
+KinesisConsumer reads every shard of a stream in parallel and hands the union of their
+records to one processor, in batches:
+
+- one reader thread per shard polls get_records (the shard's 2 MiB/s and 5 calls/s are
+  shared by every polling consumer), or, with enhanced fan-out, holds a subscribe_to_shard
+  subscription (a dedicated 2 MiB/s per shard, pushed without polling);
+- readers put records on one bounded queue, so a slow processor blocks the readers instead
+  of buffering without limit;
+- the shard list is read again every refresh_interval seconds and whenever a shard ends, so
+  the reader count follows resharding. A child shard is only started once its parents have
+  been read to the end, which keeps the order of each partition key;
+- batch size and interval are fixed, or set per batch by a backpressure.BatchController
+  from the measured processing rate and lag;
+- after the processor returns, the last sequence number of every shard in the batch is
+  saved to a checkpoint store (a JSON file or SQLite database locally, a DynamoDB table in
+  production), and a restarted consumer resumes after it (at-least-once delivery).
+
+The Spark DStream job gets the same per-shard parallelism from one KCL receiver per shard
+(see kinesis-spark-etl.py); this consumer is the Python path, testable against
+local_aws.FakeKinesisClient with any number of shards.
+"""
+import argparse
+import datetime
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+from kinesis_producer import deaggregate_record
+
+# Checkpoint of a shard that has been read to the end
+SHARD_END = "SHARD_END"
+INITIAL_POSITIONS = ("TRIM_HORIZON", "LATEST")
+
+DEFAULTS = {
+    "max_records": 10000,
+    "poll_interval": 0.2,
+    "refresh_interval": 30.0,
+    "queue_size": 64,
+    "max_batch_records": 10000,
+    "max_batch_seconds": 1.0,
+}
+
+RECORDS_READ = metrics.counter("weather_consumer_records_total", "Records read from Kinesis")
+GET_RECORDS_SECONDS = metrics.histogram("weather_consumer_get_records_seconds", "get_records call latency")
+READ_THROTTLES = metrics.counter("weather_consumer_throttled_reads_total",
+                                 "get_records calls rejected with ProvisionedThroughputExceededException")
+CHECKPOINTS = metrics.counter("weather_consumer_checkpoints_total", "Shard checkpoints written")
+BEHIND_LATEST = metrics.gauge("weather_consumer_millis_behind_latest", "Largest MillisBehindLatest of the shards",
+                              "Milliseconds")
+
+
+def arrival_seconds(record):
+    """
+    Epoch seconds of a record's ApproximateArrivalTimestamp (a datetime from boto3, a float from the fake).
+    """
+    arrival = record['ApproximateArrivalTimestamp']
+    return arrival.timestamp() if isinstance(arrival, datetime.datetime) else arrival
+
+
+class FileCheckpointStore:
+    """
+    Checkpoints in a JSON file ({stream: {shard id: sequence number}}), replaced atomically
+    on every write.
+    """
+
+    def __init__(self, path, stream_name):
+        self.path = path
+        self.stream_name = stream_name
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._checkpoints = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._checkpoints = json.load(f)
+
+    def get(self, shard_id):
+        return self._checkpoints.get(self.stream_name, {}).get(shard_id)
+
+    def put(self, checkpoints):
+        self._checkpoints.setdefault(self.stream_name, {}).update(checkpoints)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(self._checkpoints, f, indent=2, sort_keys=True)
+        os.replace(temporary, self.path)
+
+
+class SQLiteCheckpointStore:
+    """
+    Checkpoints in a SQLite table, one row per (stream, shard).
+    """
+
+    def __init__(self, path, stream_name):
+        self.stream_name = stream_name
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints (stream TEXT, shard_id TEXT, sequence_number TEXT,"
+                " updated_at REAL, PRIMARY KEY (stream, shard_id))")
+
+    def get(self, shard_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT sequence_number FROM checkpoints WHERE stream = ? AND shard_id = ?",
+                (self.stream_name, shard_id)).fetchone()
+        return row[0] if row else None
+
+    def put(self, checkpoints):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+                [(self.stream_name, shard_id, sequence_number, now) for shard_id, sequence_number in checkpoints.items()])
+
+
+class DynamoDBCheckpointStore:
+    """
+    Checkpoints in a DynamoDB table with the string key (stream, shard_id).
+    """
+
+    def __init__(self, dynamodb_client, table_name, stream_name):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.stream_name = stream_name
+
+    def _key(self, shard_id):
+        return {"stream": {"S": self.stream_name}, "shard_id": {"S": shard_id}}
+
+    def get(self, shard_id):
+        response = self.dynamodb_client.get_item(TableName=self.table_name, Key=self._key(shard_id), ConsistentRead=True)
+        item = response.get("Item")
+        return item["sequence_number"]["S"] if item else None
+
+    def put(self, checkpoints):
+        now = str(time.time())
+        for shard_id, sequence_number in checkpoints.items():
+            item = dict(self._key(shard_id), sequence_number={"S": sequence_number}, updated_at={"N": now})
+            self.dynamodb_client.put_item(TableName=self.table_name, Item=item)
+
+
+def store_from_spec(spec, stream_name, dynamodb_client_factory=None):
+    """
+    Build a checkpoint store from "file:<path>", "sqlite:<path>" or "dynamodb:<table>".
+    """
+    kind, _, target = spec.partition(":")
+    if kind == "file":
+        return FileCheckpointStore(target, stream_name)
+    if kind == "sqlite":
+        return SQLiteCheckpointStore(target, stream_name)
+    if kind == "dynamodb":
+        if dynamodb_client_factory is None:
+            import aws_clients
+            dynamodb_client_factory = lambda: aws_clients.client("dynamodb")
+        return DynamoDBCheckpointStore(dynamodb_client_factory(), target, stream_name)
+    raise ValueError(f"Unknown checkpoint store: {spec} (expected file:<path>, sqlite:<path> or dynamodb:<table>)")
+
+
+def list_all_shards(client, stream_name):
+    shards, token = [], None
+    while True:
+        response = (client.list_shards(NextToken=token) if token
+                    else client.list_shards(StreamName=stream_name))
+        shards.extend(response['Shards'])
+        token = response.get('NextToken')
+        if not token:
+            return shards
+
+
+def open_shard_count(client, stream_name):
+    """
+    Number of open shards (closed parents of a reshard have an EndingSequenceNumber).
+    """
+    return sum(1 for shard in list_all_shards(client, stream_name)
+               if 'EndingSequenceNumber' not in shard.get('SequenceNumberRange', {}))
+
+
+def _parents(shard):
+    return [shard[key] for key in ('ParentShardId', 'AdjacentParentShardId') if shard.get(key)]
+
+
+class KinesisConsumer:
+    """
+    Reads all shards of a stream in parallel (see the module docstring).
+
+    Parameters:
+    client: boto3 Kinesis client or local_aws.FakeKinesisClient.
+    stream_name (str): Kinesis Data Stream name.
+    store: Checkpoint store (get(shard_id) / put({shard_id: sequence number})).
+    initial_position (str): TRIM_HORIZON or LATEST for shards without a checkpoint.
+    consumer_name (str): Register an enhanced fan-out consumer with this name and read with
+    subscribe_to_shard instead of polling.
+    deaggregate (bool): Unpack KPL aggregated records (see kinesis_producer.aggregate_records).
+    """
+
+    def __init__(self, client, stream_name, store, initial_position="TRIM_HORIZON", consumer_name=None,
+                 deaggregate=True, max_records=DEFAULTS["max_records"], poll_interval=DEFAULTS["poll_interval"],
+                 refresh_interval=DEFAULTS["refresh_interval"], queue_size=DEFAULTS["queue_size"],
+                 clock=time.monotonic):
+        if initial_position not in INITIAL_POSITIONS:
+            raise ValueError(f"initial_position must be one of {INITIAL_POSITIONS}")
+        self.client = client
+        self.stream_name = stream_name
+        self.store = store
+        self.initial_position = initial_position
+        self.consumer_name = consumer_name
+        self.consumer_arn = None
+        self.deaggregate = deaggregate
+        self.max_records = max_records
+        self.poll_interval = poll_interval
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._readers = {}
+        self._finished = set()
+        self._pending = None
+        self._last_refresh = None
+        self.millis_behind = {}
+        self.stats = {'records': 0, 'batches': 0, 'shards_read': 0, 'records_by_shard': {}}
+
+    # Shards
+
+    def refresh_shards(self):
+        """
+        Start a reader for every shard that is not read yet and whose parents are finished.
+        """
+        self._last_refresh = self._clock()
+        shards = {shard['ShardId']: shard for shard in list_all_shards(self.client, self.stream_name)}
+        for shard_id in shards:
+            if shard_id not in self._finished and self.store.get(shard_id) == SHARD_END:
+                self._finished.add(shard_id)
+        for shard_id, shard in shards.items():
+            if shard_id in self._readers or shard_id in self._finished:
+                continue
+            # Parents past the retention period are no longer listed and do not hold their children back
+            if any(parent in shards and parent not in self._finished for parent in _parents(shard)):
+                continue
+            # Children of a reshard are read from their start, whatever the initial position
+            position = self.store.get(shard_id) or ("TRIM_HORIZON" if _parents(shard) else self.initial_position)
+            reader = threading.Thread(target=self._read_shard, args=(shard_id, position),
+                                      name=f"kinesis-reader-{shard_id}", daemon=True)
+            self._readers[shard_id] = reader
+            self.stats['shards_read'] += 1
+            reader.start()
+        return len(self._readers)
+
+    def _register_consumer(self):
+        summary = self.client.describe_stream_summary(StreamName=self.stream_name)['StreamDescriptionSummary']
+        try:
+            self.client.register_stream_consumer(StreamARN=summary['StreamARN'], ConsumerName=self.consumer_name)
+        except self.client.exceptions.ResourceInUseException:
+            pass
+        while True:
+            description = self.client.describe_stream_consumer(
+                StreamARN=summary['StreamARN'], ConsumerName=self.consumer_name)['ConsumerDescription']
+            if description['ConsumerStatus'] == 'ACTIVE':
+                return description['ConsumerARN']
+            time.sleep(1)
+
+    # Readers (one thread per shard)
+
+    def _emit(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _emit_records(self, shard_id, records):
+        out = []
+        for record in records:
+            record['ShardId'] = shard_id
+            if self.deaggregate:
+                subrecords = deaggregate_record(record['Data'])
+                if len(subrecords) > 1 or subrecords[0][0] is not None:
+                    out.extend(dict(record, Data=data, PartitionKey=key, SubSequenceNumber=index)
+                               for index, (key, data) in enumerate(subrecords))
+                    continue
+            out.append(record)
+        RECORDS_READ.inc(len(out))
+        return self._emit((shard_id, out, records[-1]['SequenceNumber']))
+
+    def _read_shard(self, shard_id, position):
+        try:
+            if self.consumer_arn:
+                self._subscribe_shard(shard_id, position)
+            else:
+                self._poll_shard(shard_id, position)
+        except Exception as e:
+            self._emit((shard_id, e, None))
+
+    def _shard_iterator(self, shard_id, position):
+        if position in INITIAL_POSITIONS:
+            options = {'ShardIteratorType': position}
+        else:
+            options = {'ShardIteratorType': 'AFTER_SEQUENCE_NUMBER', 'StartingSequenceNumber': position}
+        return self.client.get_shard_iterator(StreamName=self.stream_name, ShardId=shard_id, **options)['ShardIterator']
+
+    def _poll_shard(self, shard_id, position):
+        iterator = self._shard_iterator(shard_id, position)
+        backoff = self.poll_interval
+        while not self._stop.is_set():
+            try:
+                with GET_RECORDS_SECONDS.time():
+                    response = self.client.get_records(ShardIterator=iterator, Limit=self.max_records)
+            except self.client.exceptions.ProvisionedThroughputExceededException:
+                READ_THROTTLES.inc()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+                continue
+            except self.client.exceptions.ExpiredIteratorException:
+                iterator = self._shard_iterator(shard_id, position)
+                continue
+            backoff = self.poll_interval
+            records = response['Records']
+            self.millis_behind[shard_id] = response.get('MillisBehindLatest', 0)
+            if records:
+                position = records[-1]['SequenceNumber']
+                if not self._emit_records(shard_id, records):
+                    return
+            iterator = response.get('NextShardIterator')
+            if iterator is None:
+                self._emit((shard_id, [], SHARD_END))
+                return
+            if not records:
+                # Each shard allows 5 get_records calls per second across all consumers
+                time.sleep(self.poll_interval)
+
+    def _subscribe_shard(self, shard_id, position):
+        while not self._stop.is_set():
+            if position in INITIAL_POSITIONS:
+                starting_position = {'Type': position}
+            else:
+                starting_position = {'Type': 'AFTER_SEQUENCE_NUMBER', 'SequenceNumber': position}
+            response = self.client.subscribe_to_shard(ConsumerARN=self.consumer_arn, ShardId=shard_id,
+                                                      StartingPosition=starting_position)
+            # A subscription ends after 5 minutes; the loop subscribes again from the last position
+            for event in response['EventStream']:
+                if self._stop.is_set():
+                    return
+                event = event.get('SubscribeToShardEvent')
+                if event is None:
+                    continue
+                records = event['Records']
+                self.millis_behind[shard_id] = event.get('MillisBehindLatest', 0)
+                if records and not self._emit_records(shard_id, records):
+                    return
+                if event.get('ContinuationSequenceNumber') is None:
+                    self._emit((shard_id, [], SHARD_END))
+                    return
+                position = event['ContinuationSequenceNumber']
+
+    # Processing
+
+    def _next_batch(self, max_batch_records, max_batch_seconds):
+        """
+        Records of every shard received within max_batch_seconds (or up to max_batch_records),
+        and the checkpoint of each shard once the batch is processed.
+        """
+        batch, checkpoints = [], {}
+        deadline = self._clock() + max_batch_seconds
+        while len(batch) < max_batch_records:
+            if self._pending:
+                (shard_id, records, sequence_number), self._pending = self._pending, None
+            else:
+                timeout = deadline - self._clock()
+                if timeout <= 0:
+                    break
+                try:
+                    shard_id, records, sequence_number = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if isinstance(records, Exception):
+                raise RuntimeError(f"Reader of {shard_id} failed: {records}") from records
+            room = max_batch_records - len(batch)
+            if len(records) > room:
+                # The rest opens the next batch, which checkpoints the shard
+                self._pending = (shard_id, records[room:], sequence_number)
+                records = records[:room]
+            else:
+                checkpoints[shard_id] = sequence_number
+            batch.extend(records)
+            self.stats['records_by_shard'][shard_id] = self.stats['records_by_shard'].get(shard_id, 0) + len(records)
+        return batch, checkpoints
+
+    def run(self, processor, max_batch_records=DEFAULTS["max_batch_records"],
+            max_batch_seconds=DEFAULTS["max_batch_seconds"], idle_timeout=None, controller=None):
+        """
+        Call processor(records) with batches from all shards until stop() is called or, with
+        idle_timeout, until no record arrived for that many seconds. Each record is the
+        get_records record dict plus its ShardId.
+
+        With a controller (backpressure.BatchController), the batch size and interval come
+        from it instead of max_batch_records and max_batch_seconds.
+        """
+        if self.consumer_name and self.consumer_arn is None:
+            self.consumer_arn = self._register_consumer()
+        self.refresh_shards()
+        print(f"Reading {len(self._readers)} shard(s) of {self.stream_name}"
+              f"{' with enhanced fan-out' if self.consumer_arn else ''}")
+        last_record = self._clock()
+        try:
+            while not self._stop.is_set():
+                if controller:
+                    max_batch_seconds, max_batch_records = controller.interval, controller.max_records
+                batch, checkpoints = self._next_batch(max_batch_records, max_batch_seconds)
+                if self.millis_behind:
+                    BEHIND_LATEST.set(max(self.millis_behind.values()))
+                if batch:
+                    lag = max(0.0, time.time() - min(arrival_seconds(record) for record in batch))
+                    started = self._clock()
+                    processor(batch)
+                    self.stats['records'] += len(batch)
+                    self.stats['batches'] += 1
+                    last_record = self._clock()
+                    if controller:
+                        controller.update(len(batch), last_record - started, lag)
+                if checkpoints:
+                    self.store.put(checkpoints)
+                    CHECKPOINTS.inc(len(checkpoints))
+                ended = [shard_id for shard_id, position in checkpoints.items() if position == SHARD_END]
+                for shard_id in ended:
+                    self._finished.add(shard_id)
+                    self._readers.pop(shard_id).join()
+                if ended or self._clock() - self._last_refresh >= self.refresh_interval:
+                    self.refresh_shards()
+                if idle_timeout is not None and self._clock() - last_record >= idle_timeout:
+                    break
+        finally:
+            self.stop()
+        return self.stats
+
+    def stop(self):
+        self._stop.set()
+        for reader in self._readers.values():
+            reader.join()
+
+
+def print_batch(records):
+    shards = sorted({record['ShardId'] for record in records})
+    print(f"Batch of {len(records)} record(s) from {len(shards)} shard(s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read a Kinesis Data Stream with one reader per shard.")
+    parser.add_argument("--stream-name", default="weather_data_stream")
+    parser.add_argument("--checkpoint", default="file:checkpoints/kinesis_consumer.json",
+                        help="Checkpoint store: file:<path>, sqlite:<path> or dynamodb:<table>")
+    parser.add_argument("--initial-position", choices=INITIAL_POSITIONS, default="TRIM_HORIZON")
+    parser.add_argument("--consumer-name", help="Read with enhanced fan-out as this registered consumer")
+    parser.add_argument("--refresh-interval", type=float, default=DEFAULTS["refresh_interval"],
+                        help="Seconds between shard list refreshes (picks up resharding)")
+    parser.add_argument("--max-batch-seconds", type=float, default=DEFAULTS["max_batch_seconds"])
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    import aws_clients
+
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port)
+    consumer = KinesisConsumer(aws_clients.client("kinesis"), args.stream_name,
+                               store_from_spec(args.checkpoint, args.stream_name),
+                               initial_position=args.initial_position, consumer_name=args.consumer_name,
+                               refresh_interval=args.refresh_interval)
+    try:
+        consumer.run(print_batch, max_batch_seconds=args.max_batch_seconds)
+    except KeyboardInterrupt:
+        print(f"Stopped after {consumer.stats['records']} record(s)")
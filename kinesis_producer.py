@@ -0,0 +1,500 @@
+"""
+High-throughput Kinesis producer.
+
+Records are buffered per shard and sent with put_records in batches of up to 500 entries /
+5 MiB. Only the entries a call reports as failed are retried, with exponential backoff and
+full jitter. Batches for different shards are in flight concurrently; batches for the same
+shard are sent one after another, so records with the same partition key keep their order.
+Each shard has a token bucket matching its write limit. A call that fails as a whole is
+retried only for throttling and transient errors (see retryable); other errors, such as
+ValidationException or AccessDeniedException, are raised to the caller of put() or flush(). Optionally, records are packed into
+KPL-style aggregated records, which Kinesis consumers built on the KCL (and Firehose)
+de-aggregate transparently.
+"""
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+MAX_RECORDS_PER_CALL = 500
+MAX_BYTES_PER_CALL = 5 * 1024 * 1024
+MAX_RECORD_BYTES = 1024 * 1024
+SHARD_RECORDS_PER_SEC = 1000
+SHARD_BYTES_PER_SEC = 1024 * 1024
+
+# KPL aggregated record format: magic + protobuf AggregatedRecord + MD5 of the protobuf
+KPL_MAGIC = b'\xf3\x89\x9a\xc2'
+DEFAULT_AGGREGATED_RECORD_BYTES = 50 * 1024
+
+# Error codes of a failed put_records call that are worth retrying: throttling and
+# transient service errors (failed entries only report the first and InternalFailure)
+RETRYABLE_ERROR_CODES = frozenset({
+    'ProvisionedThroughputExceededException', 'ThrottlingException', 'Throttling', 'RequestLimitExceeded',
+    'KMSThrottlingException', 'LimitExceededException', 'InternalFailure', 'InternalFailureException',
+    'InternalServerError', 'ServiceUnavailable', 'ServiceUnavailableException', 'RequestTimeout',
+    'RequestTimeoutException',
+})
+
+PUT_RECORDS_SECONDS = metrics.histogram("weather_kinesis_put_records_seconds", "put_records call latency")
+PUT_ENTRIES = metrics.counter("weather_kinesis_put_entries_total", "Entries accepted by put_records")
+THROTTLED_ENTRIES = metrics.counter("weather_kinesis_throttled_entries_total",
+                                    "Entries rejected with ProvisionedThroughputExceededException")
+RETRIED_ENTRIES = metrics.counter("weather_kinesis_retried_entries_total", "Failed entries sent again")
+FAILED_RECORDS = metrics.counter("weather_kinesis_failed_records_total", "Records given up on after the last retry")
+
+
+def station_partition_key(latitude, longitude):
+    """
+    Partition key of a weather station: every reading of a station lands on the same shard.
+    """
+    return f"{latitude},{longitude}"
+
+
+def partition_hash_key(partition_key):
+    """
+    Kinesis maps a partition key to a 128-bit hash key with MD5.
+    """
+    return int(hashlib.md5(partition_key.encode('utf-8')).hexdigest(), 16)
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def _field(number, payload):
+    """
+    Length-delimited protobuf field.
+    """
+    return _varint((number << 3) | 2) + _varint(len(payload)) + payload
+
+
+def aggregate_records(records):
+    """
+    Pack (partition_key, data) pairs into one KPL aggregated record.
+    """
+    keys = {}
+    key_table = []
+    body = []
+    for partition_key, data in records:
+        if partition_key not in keys:
+            keys[partition_key] = len(key_table)
+            key_table.append(_field(1, partition_key.encode('utf-8')))
+        record = _varint((1 << 3) | 0) + _varint(keys[partition_key]) + _field(3, data)
+        body.append(_field(3, record))
+    message = b''.join(key_table) + b''.join(body)
+    return KPL_MAGIC + message + hashlib.md5(message).digest()
+
+
+def _read_varint(buffer, position):
+    shift = result = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+def _read_fields(buffer):
+    position = 0
+    while position < len(buffer):
+        tag, position = _read_varint(buffer, position)
+        number, wire_type = tag >> 3, tag & 0x7
+        if wire_type == 0:
+            value, position = _read_varint(buffer, position)
+        elif wire_type == 2:
+            length, position = _read_varint(buffer, position)
+            value = buffer[position:position + length]
+            position += length
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield number, value
+
+
+def deaggregate_record(data):
+    """
+    Unpack a KPL aggregated record into (partition_key, data) pairs.
+    Data without the KPL magic header is returned as a single record with no key.
+    """
+    if not data.startswith(KPL_MAGIC) or len(data) < len(KPL_MAGIC) + 16:
+        return [(None, data)]
+    message, digest = data[len(KPL_MAGIC):-16], data[-16:]
+    if hashlib.md5(message).digest() != digest:
+        raise ValueError("KPL aggregated record checksum mismatch")
+    key_table, records = [], []
+    for number, value in _read_fields(message):
+        if number == 1:
+            key_table.append(bytes(value).decode('utf-8'))
+        elif number == 3:
+            fields = dict(_read_fields(value))
+            records.append((fields.get(1, 0), bytes(fields.get(3, b''))))
+    return [(key_table[index], data) for index, data in records]
+
+
+def error_code(error):
+    """
+    Error code of an exception raised by a client call: the AWS error code of a botocore
+    ClientError, else the exception's class name (the modeled exceptions of a client are
+    named after their codes).
+    """
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict) and response.get('Error', {}).get('Code'):
+        return response['Error']['Code']
+    return type(error).__name__
+
+
+def retryable(error):
+    """
+    True for a failed call worth retrying: throttling, a 5xx response, or a connection
+    problem (a timeout, a dropped or refused connection).
+    """
+    if error_code(error) in RETRYABLE_ERROR_CODES:
+        return True
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict) and response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500:
+        return True
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    try:
+        from botocore.exceptions import ConnectionError as BotocoreConnectionError, HTTPClientError
+    except ImportError:
+        return False
+    return isinstance(error, (BotocoreConnectionError, HTTPClientError))
+
+
+class TokenBucket:
+    """
+    Blocking token bucket refilled at `rate` tokens per second, holding at most `rate`.
+    """
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.tokens = rate
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount):
+        amount = min(amount, self.rate)
+        while True:
+            with self._lock:
+                now = self._clock()
+                self.tokens = min(self.rate, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            self._sleep(wait)
+
+
+class KinesisProducer:
+    """
+    Buffers records per shard and sends them with put_records on a thread pool.
+
+    Parameters:
+    client: boto3 Kinesis client or a stand-in with the same put_records/list_shards API.
+    stream_name (str): Kinesis Data Stream name.
+    aggregate (bool): Pack records into KPL aggregated records.
+    max_in_flight (int): Concurrent put_records calls (at most one per shard).
+    max_retries (int): Retries of the failed entries of a call before giving up on them.
+    preserve_order (bool): Keep per-partition-key order across retries (see _rounds). Turning it
+    off lets a batch with many records per key go out in fewer calls.
+    """
+
+    def __init__(self, client, stream_name, aggregate=False, max_in_flight=8, max_retries=8,
+                 backoff_base=0.05, backoff_max=5.0, aggregated_record_bytes=DEFAULT_AGGREGATED_RECORD_BYTES,
+                 rate_limit=True, preserve_order=True, sleep=time.sleep):
+        self.client = client
+        self.stream_name = stream_name
+        self.aggregate = aggregate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.aggregated_record_bytes = aggregated_record_bytes
+        self.rate_limit = rate_limit
+        self.preserve_order = preserve_order
+        self.max_pending_batches = max_in_flight * 4
+        self._sleep = sleep
+        self.stats = {'records': 0, 'entries': 0, 'calls': 0, 'retried_entries': 0, 'throttled_entries': 0,
+                      'failed_records': 0}
+        self.failed = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="kinesis-producer")
+        self._futures = []
+        self._load_shards()
+
+    def _load_shards(self):
+        shards, token = [], None
+        while True:
+            response = (self.client.list_shards(NextToken=token) if token
+                        else self.client.list_shards(StreamName=self.stream_name))
+            shards.extend(response['Shards'])
+            token = response.get('NextToken')
+            if not token:
+                break
+        # Closed parent shards (after resharding) have an EndingSequenceNumber and take no writes
+        shards = [s for s in shards if 'EndingSequenceNumber' not in s.get('SequenceNumberRange', {})]
+        self._shards = sorted(
+            ((int(s['HashKeyRange']['StartingHashKey']), int(s['HashKeyRange']['EndingHashKey']), s['ShardId'])
+             for s in shards)
+        )
+        self._buffers = {shard_id: [] for _, _, shard_id in self._shards}
+        self._buffer_bytes = {shard_id: 0 for _, _, shard_id in self._shards}
+        self._tails = {}
+        self._buckets = {shard_id: (TokenBucket(SHARD_RECORDS_PER_SEC, sleep=self._sleep),
+                                    TokenBucket(SHARD_BYTES_PER_SEC, sleep=self._sleep))
+                         for _, _, shard_id in self._shards}
+
+    def shard_for(self, partition_key):
+        hash_key = partition_hash_key(partition_key)
+        for start, end, shard_id in self._shards:
+            if start <= hash_key <= end:
+                return shard_id, start
+        raise ValueError(f"No open shard covers hash key {hash_key}")
+
+    def _wait_for_capacity(self):
+        """
+        Block the caller while too many batches are queued (backpressure), and raise the
+        error of a batch that failed without retries.
+        """
+        while True:
+            with self._lock:
+                pending, error = [], None
+                for future in self._futures:
+                    if not future.done():
+                        pending.append(future)
+                    elif error is None:
+                        error = future.exception()
+                self._futures = pending
+                if error is None and len(pending) <= self.max_pending_batches:
+                    return
+            if error is not None:
+                raise error
+            pending[0].exception()
+
+    def put(self, data, partition_key):
+        """
+        Buffer one record; a full batch for its shard is sent in the background.
+        """
+        self._wait_for_capacity()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        size = len(data) + len(partition_key)
+        if size > MAX_RECORD_BYTES:
+            raise ValueError(f"Record of {size} bytes exceeds the 1 MiB Kinesis limit")
+        shard_id, _ = self.shard_for(partition_key)
+        with self._lock:
+            if (len(self._buffers[shard_id]) >= self._buffer_capacity()
+                    or self._buffer_bytes[shard_id] + size > MAX_BYTES_PER_CALL):
+                self._submit(shard_id)
+            self._buffers[shard_id].append((partition_key, data))
+            self._buffer_bytes[shard_id] += size
+            self.stats['records'] += 1
+
+    def put_many(self, records):
+        """
+        Buffer (data, partition_key) pairs.
+        """
+        for data, partition_key in records:
+            self.put(data, partition_key)
+
+    def _buffer_capacity(self):
+        # Aggregated batches are bounded by bytes (MAX_BYTES_PER_CALL), not by entry count
+        return MAX_RECORDS_PER_CALL if not self.aggregate else float('inf')
+
+    def _rounds(self, records):
+        """
+        Split a shard batch into rounds in which every partition key appears at most once.
+
+        A round is retried until it succeeds before the next one is sent, so a failed entry
+        is never overtaken by a later record with the same key. With aggregation, a key's
+        records travel together in one aggregated record per round.
+        """
+        if not self.preserve_order and not self.aggregate:
+            return [records]
+        per_key = {}
+        for key, data in records:
+            per_key.setdefault(key, []).append(data)
+        rounds = []
+        for key, values in per_key.items():
+            if self.aggregate:
+                chunks, chunk, chunk_bytes = [], [], 0
+                for data in values:
+                    size = len(data) + 8
+                    if chunk and chunk_bytes + size > self.aggregated_record_bytes:
+                        chunks.append(chunk)
+                        chunk, chunk_bytes = [], 0
+                    chunk.append(data)
+                    chunk_bytes += size
+                chunks.append(chunk)
+            else:
+                chunks = values
+            for index, chunk in enumerate(chunks):
+                if index == len(rounds):
+                    rounds.append([])
+                rounds[index].append((key, chunk))
+        return rounds
+
+    def _entries(self, shard_start, round_records):
+        """
+        put_records entries for one round.
+        """
+        if not self.aggregate:
+            return [{'Data': data, 'PartitionKey': key} for key, data in round_records]
+        # The explicit hash key pins every aggregated record to the shard its records hash to
+        entries, group, group_bytes = [], [], 0
+        for key, chunk in round_records:
+            size = sum(len(data) + 8 for data in chunk) + len(key)
+            if group and group_bytes + size > self.aggregated_record_bytes:
+                entries.append(self._aggregated_entry(group, shard_start))
+                group, group_bytes = [], 0
+            group.extend((key, data) for data in chunk)
+            group_bytes += size
+        if group:
+            entries.append(self._aggregated_entry(group, shard_start))
+        return entries
+
+    @staticmethod
+    def _aggregated_entry(group, shard_start):
+        return {'Data': aggregate_records(group), 'PartitionKey': group[0][0], 'ExplicitHashKey': str(shard_start)}
+
+    @staticmethod
+    def _calls(entries):
+        """
+        Split entries into put_records calls within the 500-entry / 5 MiB limits.
+        """
+        call, call_bytes = [], 0
+        for entry in entries:
+            size = len(entry['Data']) + len(entry['PartitionKey'])
+            if call and (len(call) >= MAX_RECORDS_PER_CALL or call_bytes + size > MAX_BYTES_PER_CALL):
+                yield call
+                call, call_bytes = [], 0
+            call.append(entry)
+            call_bytes += size
+        if call:
+            yield call
+
+    def _submit(self, shard_id):
+        """
+        Hand the shard's buffer to the thread pool (caller holds self._lock).
+        """
+        records = self._buffers[shard_id]
+        if not records:
+            return
+        self._buffers[shard_id] = []
+        self._buffer_bytes[shard_id] = 0
+        previous = self._tails.get(shard_id)
+        future = self._executor.submit(self._send, shard_id, records, previous)
+        self._tails[shard_id] = future
+        self._futures.append(future)
+
+    def _send(self, shard_id, records, previous):
+        # Batches of one shard go out in order: wait for the shard's previous batch
+        if previous is not None:
+            previous.exception()
+        _, shard_start = self.shard_for(records[0][0])
+        calls = [call for round_records in self._rounds(records)
+                 for call in self._calls(self._entries(shard_start, round_records))]
+        for index, call in enumerate(calls):
+            try:
+                self._send_entries(shard_id, call)
+            except Exception:
+                # The rest of the batch is not sent either, which keeps per-key order
+                self._give_up([entry for later in calls[index + 1:] for entry in later])
+                raise
+
+    def _send_entries(self, shard_id, entries):
+        attempt = 0
+        while entries:
+            if self.rate_limit:
+                record_bucket, byte_bucket = self._buckets[shard_id]
+                record_bucket.acquire(len(entries))
+                byte_bucket.acquire(sum(len(e['Data']) + len(e['PartitionKey']) for e in entries))
+            try:
+                with PUT_RECORDS_SECONDS.time():
+                    response = self.client.put_records(StreamName=self.stream_name, Records=entries)
+                results = response['Records']
+            except Exception as e:
+                if not retryable(e):
+                    # Retrying cannot help (bad request, permissions, missing stream)
+                    print(f"put_records call failed for {shard_id}, not retrying: {e}")
+                    with self._lock:
+                        self.stats['calls'] += 1
+                    self._give_up(entries)
+                    raise
+                # The whole call failed (network, throttled API call): retry every entry
+                print(f"put_records call failed for {shard_id}: {e}")
+                results = [{'ErrorCode': error_code(e)}] * len(entries)
+            failed = [(entry, result) for entry, result in zip(entries, results) if 'ErrorCode' in result]
+            throttled = sum(1 for _, r in failed if r['ErrorCode'] == 'ProvisionedThroughputExceededException')
+            with self._lock:
+                self.stats['calls'] += 1
+                self.stats['entries'] += len(entries) - len(failed)
+                self.stats['throttled_entries'] += throttled
+            PUT_ENTRIES.inc(len(entries) - len(failed))
+            if throttled:
+                THROTTLED_ENTRIES.inc(throttled)
+            if not failed:
+                return
+            if attempt >= self.max_retries:
+                print(f"Giving up on {len(failed)} entries for {shard_id}: {failed[0][1]['ErrorCode']}")
+                self._give_up([entry for entry, _ in failed])
+                return
+            with self._lock:
+                self.stats['retried_entries'] += len(failed)
+            RETRIED_ENTRIES.inc(len(failed))
+            # Exponential backoff with full jitter
+            self._sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+            attempt += 1
+            entries = [entry for entry, _ in failed]
+
+    def _give_up(self, entries):
+        """
+        Keep entries that will not be sent in self.failed and count their records.
+        """
+        failed_records = sum(self._record_count(entry) for entry in entries)
+        with self._lock:
+            self.failed.extend(entries)
+            self.stats['failed_records'] += failed_records
+        FAILED_RECORDS.inc(failed_records)
+
+    def _record_count(self, entry):
+        return len(deaggregate_record(entry['Data'])) if self.aggregate else 1
+
+    def flush(self):
+        """
+        Send every buffered record and wait for all in-flight batches. The first error of a
+        batch that failed without retries is raised once all batches are done.
+
+        Returns:
+        dict: producer statistics so far.
+        """
+        with self._lock:
+            for shard_id in self._buffers:
+                self._submit(shard_id)
+            futures, self._futures = self._futures, []
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+        with self._lock:
+            return dict(self.stats)
+
+    def close(self):
+        stats = self.flush()
+        self._executor.shutdown()
+        return stats
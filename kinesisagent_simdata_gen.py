@@ -1,11 +1,20 @@
+import argparse
 import json
 import random
 import time
 from datetime import datetime
 import math
+import metrics
+import wire_format
+from agent_log_writer import add_writer_arguments, writer_from_args
+from ffwi import calculate_ffwi
+from load_generator import add_load_arguments, encode_readings, load_config, run_load
 # Log file path for Kinesis Agent
 LOG_FILE_PATH = '/tmp/aws-kinesis-agent.log'
 
+RECORDS_OUT = metrics.counter("weather_records_out_total", "Records written", stage="agent_producer")
+WRITE_SECONDS = metrics.histogram("weather_agent_write_seconds", "Agent log write time per batch")
+
 # Pre-generated latitude and longitude points
 LAT_LONG_POINTS = [
     (round(random.uniform(45.53, 46), 10),
@@ -21,27 +30,6 @@ amplitude_humid = 10 # Humidity fluctuation ±10
 base_temp = 60  # Base temperature
 base_humidity = 30  # Base humidity
 
-def calculate_ffwi(temperature, humidity, wind_speed):
-    """
-    Calculate the Fosberg Fire Weather Index (FFWI).
-    """
-    try:
-        F = 0
-        # Calculate F (factor based on relative humidity and temperature)
-        if humidity < 100:
-            F = 1 - (2 * (100 - humidity) / ((100 - humidity) + temperature))
-            F = max(F, 0)
-        else:
-            F = 0  # If humidity is 100%, set F to 0, as there is no fire risk.
-
-        # Calculate FFWI based on the formula
-        ffwi = ((1 + wind_speed) / 0.3002) * math.sqrt(F)
-        ffwi = max(0, min(ffwi, 100))  # Ensure FFWI is in range [0, 100]
-        return ffwi
-    except Exception as e:
-        print(f"Error calculating FFWI: {e}")
-        return None
-
 def generate_mock_data(index):
     """
     Generate mock weather data.
@@ -74,32 +62,68 @@ def generate_mock_data(index):
     }
     return mock_data
 
-def write_data_to_file():
-    # Continuously write mock data to the log file every 5 seconds
+def generate_batch(index, count):
+    """
+    Generate one tick of mock weather data: a reading for each of `count` stations.
+    """
+    batch = []
+    for i in range(count):
+        coordinate = LAT_LONG_POINTS[i % len(LAT_LONG_POINTS)]
+        mock_data = generate_mock_data(index)
+        mock_data['latitude'] = coordinate[0]
+        mock_data['longitude'] = coordinate[1]
+        batch.append(mock_data)
+    return batch
+
+def write_data_to_file(writer, record_format="json"):
+    # Continuously write mock data to the log file every 5 minutes
+    # Binary records are written base64-encoded, one per line (see wire_format.py)
+    encode = wire_format.encode_text if record_format == "binary" else json.dumps
     index = 0 
     while True:
         try:
-            with open(LOG_FILE_PATH, 'a') as log_file:
-                records = []
-                for i in range(500):
-                    coordinate = LAT_LONG_POINTS[i % len(LAT_LONG_POINTS)]
-                    mock_data = generate_mock_data(index)
-                    mock_data['latitude'] = coordinate[0]
-                    mock_data['longitude'] = coordinate[1]
-                    records.append({
-                        'Data': json.dumps(mock_data),
-                        'PartitionKey': str(random.randint(1, 100))  # Random Partition Key
-                    })
-                
-                index+=1
-                for record in records:
-                    log_file.write(json.dumps(record) + '\n')
-                print(f"Mock data written to file: {records}")
+            # One reading per line: the agent sends each line as a Kinesis record
+            lines = [encode(mock_data) for mock_data in generate_batch(index, 500)]
+            index+=1
+            with WRITE_SECONDS.time():
+                writer.write_lines(lines)
+                writer.flush()
+            RECORDS_OUT.inc(len(lines))
+            print(f"Mock data written to file: {len(lines)} records ({writer.path})")
             # Wait for 300 seconds before writing the next record
             time.sleep(300)
         except Exception as e:
             print(f"Error writing data to file: {e}")
 
+def run_load_to_file(config, writer, record_format="json"):
+    """
+    Load-generation mode: write vectorized batches of readings to the agent log at the configured rate.
+    """
+    encode = wire_format.encode_batch_text if record_format == "binary" else encode_readings
+    def write(lines, keys):
+        with WRITE_SECONDS.time():
+            writer.write_lines(lines)
+        RECORDS_OUT.inc(len(lines))
+
+    with writer:
+        return run_load(config, write, encode=encode)
+
 if __name__ == "__main__":
-    print("Generating and writing mock data to file...")
-    write_data_to_file()
+    parser = argparse.ArgumentParser(description="Write mock weather data for the Kinesis Agent")
+    parser.add_argument("--output", default=LOG_FILE_PATH, help="Log file the agent tails")
+    parser.add_argument("--wire-format", choices=wire_format.FORMATS, default="json",
+                        help="Record encoding: JSON or the compact binary format as base64 lines (see wire_format.py)")
+    add_writer_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    add_load_arguments(parser)
+    args = parser.parse_args()
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port)
+
+    writer = writer_from_args(args, args.output)
+    if args.load:
+        print("Generating load for the Kinesis Agent log...")
+        run_load_to_file(load_config(args), writer, args.wire_format)
+    else:
+        print("Generating and writing mock data to file...")
+        write_data_to_file(writer, args.wire_format)
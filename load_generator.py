@@ -0,0 +1,195 @@
+"""
+Load-generation mode for the simulators.
+
+Readings for many stations are generated in NumPy batches (same sine-wave temperature and
+humidity and random wind as generate_mock_data) and paced to a target records/sec that can
+follow a burst profile. The achieved rate is reported while running.
+"""
+import json
+import math
+import time
+from datetime import datetime
+
+import numpy as np
+
+# Same parameters as the simulators
+TIME_PERIOD = 60
+AMPLITUDE_TEMP = 5
+AMPLITUDE_HUMID = 10
+BASE_TEMP = 60
+BASE_HUMIDITY = 30
+LATITUDE_RANGE = (45.53, 46)
+LONGITUDE_RANGE = (-79, -77.5)
+
+MAX_STATIONS = 1_000_000
+PROFILES = ("constant", "spike", "sine", "ramp")
+
+DEFAULTS = {
+    "rate": 1000.0,
+    "stations": 100,
+    "duration": 60.0,
+    "profile": "constant",
+    "burst_factor": 10.0,
+    "burst_period": 60.0,
+    "burst_length": 5.0,
+    "tick": 0.1,
+    "report_interval": 5.0,
+    "wind_min": 1.0,
+    "wind_max": 30.0,
+    "seed": None,
+}
+
+
+class Stations:
+    """
+    Simulated stations with random coordinates in the same area as LAT_LONG_POINTS.
+    """
+
+    def __init__(self, count, seed=None):
+        if not 1 <= count <= MAX_STATIONS:
+            raise ValueError(f"Station count must be between 1 and {MAX_STATIONS}")
+        self.rng = np.random.default_rng(seed)
+        self.count = count
+        self.latitude = np.round(self.rng.uniform(*LATITUDE_RANGE, count), 10)
+        self.longitude = np.round(self.rng.uniform(*LONGITUDE_RANGE, count), 10)
+        # Partition keys match kinesis_producer.station_partition_key
+        self.partition_keys = [f"{lat},{lon}" for lat, lon in zip(self.latitude.tolist(), self.longitude.tolist())]
+
+
+def generate_readings(stations, index, first_station, count, wind_min=1.0, wind_max=30.0):
+    """
+    Generate `count` readings for consecutive stations (wrapping around) at tick `index`.
+
+    Returns:
+    dict: column name -> NumPy array (plus a shared ISO timestamp and the station indices).
+    """
+    station = (first_station + np.arange(count)) % stations.count
+    phase = 2 * math.pi * (index / TIME_PERIOD)
+    return {
+        'timestamp': datetime.utcnow().isoformat(),
+        'station': station,
+        'latitude': stations.latitude[station],
+        'longitude': stations.longitude[station],
+        'temperature': np.full(count, round(BASE_TEMP + AMPLITUDE_TEMP * math.sin(phase), 2)),
+        'humidity': np.full(count, round(BASE_HUMIDITY + AMPLITUDE_HUMID * math.sin(phase), 2)),
+        'windSpeed': np.round(stations.rng.uniform(wind_min, wind_max, count), 2),
+    }
+
+
+def encode_readings(readings):
+    """
+    Serialize a batch of readings to JSON strings (same keys as generate_mock_data).
+    """
+    prefix = '{"timestamp": ' + json.dumps(readings['timestamp'])
+    template = prefix + ', "latitude": %r, "longitude": %r, "temperature": %r, "humidity": %r, "windSpeed": %r}'
+    return [template % row for row in zip(
+        readings['latitude'].tolist(), readings['longitude'].tolist(), readings['temperature'].tolist(),
+        readings['humidity'].tolist(), readings['windSpeed'].tolist())]
+
+
+def target_rate(config, elapsed):
+    """
+    Target records/sec at `elapsed` seconds into the run for the configured burst profile.
+    """
+    rate, profile = config['rate'], config['profile']
+    if profile == "constant":
+        return rate
+    if profile == "spike":
+        # burst_factor x rate for burst_length seconds at the start of every burst_period
+        return rate * config['burst_factor'] if elapsed % config['burst_period'] < config['burst_length'] else rate
+    if profile == "sine":
+        # Oscillates between rate and burst_factor x rate over burst_period
+        swing = (config['burst_factor'] - 1) * rate / 2
+        return rate + swing * (1 - math.cos(2 * math.pi * elapsed / config['burst_period']))
+    if profile == "ramp":
+        # Linear ramp from rate to burst_factor x rate over the run
+        return rate * (1 + (config['burst_factor'] - 1) * min(1.0, elapsed / config['duration']))
+    raise ValueError(f"Unknown profile: {profile} (expected one of {', '.join(PROFILES)})")
+
+
+def run_load(config, sink, clock=time.monotonic, sleep=time.sleep, encode=encode_readings):
+    """
+    Generate readings at the configured rate for the configured duration.
+
+    sink(lines, partition_keys) receives each batch of encoded records (JSON strings by
+    default, see wire_format.encode_batch for the binary format) with their station
+    partition keys. Returns a summary with the achieved rate.
+    """
+    stations = Stations(config['stations'], config['seed'])
+    start = clock()
+    next_report = config['report_interval']
+    owed = 0.0
+    sent = reported = 0
+    index = first_station = 0
+    last_report = last_tick = start
+    while True:
+        now = clock()
+        elapsed = now - start
+        if elapsed >= config['duration']:
+            break
+        # Accrue by wall-clock time so a slow batch is made up on the next tick
+        owed += target_rate(config, elapsed) * (now - last_tick)
+        last_tick = now
+        count = int(owed)
+        owed -= count
+        if count:
+            readings = generate_readings(stations, index, first_station, count, config['wind_min'], config['wind_max'])
+            sink(encode(readings), [stations.partition_keys[i] for i in readings['station'].tolist()])
+            sent += count
+            first_station = (first_station + count) % stations.count
+            # One sine-wave step per full pass over the stations, like one simulator tick
+            if first_station < count:
+                index += 1
+        if elapsed >= next_report:
+            interval = now - last_report
+            print(f"[{elapsed:7.1f}s] achieved {(sent - reported) / interval:,.0f} records/sec "
+                  f"(target {target_rate(config, elapsed):,.0f})")
+            reported, last_report = sent, now
+            next_report += config['report_interval']
+        # Sleep until the next tick
+        sleep(max(0.0, config['tick'] - (clock() - now)))
+
+    seconds = clock() - start
+    summary = {'records': sent, 'seconds': seconds, 'achieved_rate': sent / seconds if seconds else 0.0,
+               'stations': stations.count, 'profile': config['profile'], 'target_rate': config['rate']}
+    print(f"Load run finished: {sent} records in {seconds:.1f}s, achieved {summary['achieved_rate']:,.0f} records/sec")
+    return summary
+
+
+def add_load_arguments(parser):
+    """
+    Add the load-generator options to a simulator's argument parser.
+    """
+    group = parser.add_argument_group("load generation")
+    group.add_argument("--load", action="store_true", help="Run in load-generation mode instead of the 5-minute ticks")
+    group.add_argument("--config", help="JSON file with load options (keys as below, with underscores)")
+    group.add_argument("--rate", type=float, help=f"Target records/sec (default {DEFAULTS['rate']:g})")
+    group.add_argument("--stations", type=int, help=f"Simulated stations, up to {MAX_STATIONS:,} (default {DEFAULTS['stations']})")
+    group.add_argument("--duration", type=float, help=f"Run length in seconds (default {DEFAULTS['duration']:g})")
+    group.add_argument("--profile", choices=PROFILES, help="Burst profile (default constant)")
+    group.add_argument("--burst-factor", type=float, help="Peak rate as a multiple of --rate (default 10)")
+    group.add_argument("--burst-period", type=float, help="Seconds between bursts / sine period (default 60)")
+    group.add_argument("--burst-length", type=float, help="Seconds each spike lasts (default 5)")
+    group.add_argument("--tick", type=float, help="Pacing interval in seconds (default 0.1)")
+    group.add_argument("--report-interval", type=float, help="Seconds between rate reports (default 5)")
+    group.add_argument("--seed", type=int, help="Random seed for station coordinates and wind")
+    return group
+
+
+def load_config(args, **overrides):
+    """
+    Merge defaults, per-simulator overrides, the --config file and explicit CLI options (in that order).
+    """
+    config = dict(DEFAULTS, **overrides)
+    if getattr(args, 'config', None):
+        with open(args.config) as f:
+            file_config = json.load(f)
+        unknown = set(file_config) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown load options in {args.config}: {', '.join(sorted(unknown))}")
+        config.update(file_config)
+    for key in DEFAULTS:
+        value = getattr(args, key, None)
+        if value is not None:
+            config[key] = value
+    return config
@@ -0,0 +1,478 @@
+"""
+In-memory stand-ins for the AWS clients used by the pipeline, for local runs and benchmarks.
+They implement the subset of the boto3 client API the scripts call, with the same
+request/response shapes.
+"""
+import bisect
+import io
+import itertools
+import random
+import re
+import threading
+import time
+import uuid
+
+from kinesis_producer import SHARD_BYTES_PER_SEC, SHARD_RECORDS_PER_SEC, partition_hash_key
+
+MAX_HASH_KEY = 2 ** 128 - 1
+
+
+class FakeKinesisClient:
+    """
+    Kinesis Data Stream kept in memory: records are routed to shards by the MD5 hash of
+    their partition key over evenly split hash key ranges, like the real service.
+
+    With enforce_limits, each shard accepts at most 1000 records and 1 MiB per second and
+    rejects the rest with ProvisionedThroughputExceededException, as the service does
+    (reads too: at most 5 get_records calls per shard per second).
+    failure_rate randomly fails entries with InternalFailure, and latency adds a delay to
+    every call, for load-testing producers.
+
+    Consumers read with get_shard_iterator/get_records (read_latency delays every
+    get_records call, like the round trip to the service) or, with enhanced fan-out, with
+    register_stream_consumer/subscribe_to_shard. split_shard and merge_shards close the
+    parent shards and create children with ParentShardId, as resharding does.
+    """
+
+    class exceptions:
+        class ProvisionedThroughputExceededException(Exception):
+            pass
+
+        class ExpiredIteratorException(Exception):
+            pass
+
+        class ResourceNotFoundException(Exception):
+            pass
+
+        class ResourceInUseException(Exception):
+            pass
+
+    def __init__(self, stream_name="weather_data_stream", shard_count=1, enforce_limits=False,
+                 failure_rate=0.0, latency=0.0, read_latency=0.0):
+        self.stream_name = stream_name
+        self.stream_arn = f"arn:aws:kinesis:us-east-2:000000000000:stream/{stream_name}"
+        self.shards = []
+        self.read_latency = read_latency
+        self.get_records_calls = 0
+        self._iterators = {}
+        self._consumers = {}
+        self._shard_index = itertools.count()
+        self.enforce_limits = enforce_limits
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.calls = 0
+        self.throttled = 0
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+        self._usage = {}
+        self._read_usage = {}
+        self._create_shards(shard_count)
+
+    def _create_shards(self, shard_count):
+        step = (MAX_HASH_KEY + 1) // shard_count
+        for i in range(shard_count):
+            end = MAX_HASH_KEY if i == shard_count - 1 else (i + 1) * step - 1
+            self._add_shard(i * step, end)
+
+    def _add_shard(self, start, end, parents=()):
+        shard = {
+            'ShardId': f"shardId-{next(self._shard_index):012d}",
+            'HashKeyRange': {'StartingHashKey': str(start), 'EndingHashKey': str(end)},
+            'SequenceNumberRange': {'StartingSequenceNumber': f"{next(self._sequence):056d}"},
+            'Records': [],
+        }
+        if parents:
+            shard['ParentShardId'] = parents[0]
+        if len(parents) > 1:
+            shard['AdjacentParentShardId'] = parents[1]
+        self.shards.append(shard)
+        return shard
+
+    def _shard(self, shard_id):
+        for shard in self.shards:
+            if shard['ShardId'] == shard_id:
+                return shard
+        raise self.exceptions.ResourceNotFoundException(f"Shard {shard_id} not found")
+
+    def _shard_for(self, partition_key, explicit_hash_key=None):
+        hash_key = int(explicit_hash_key) if explicit_hash_key else partition_hash_key(partition_key)
+        for shard in self.shards:
+            if 'EndingSequenceNumber' in shard['SequenceNumberRange']:
+                continue
+            if int(shard['HashKeyRange']['StartingHashKey']) <= hash_key <= int(shard['HashKeyRange']['EndingHashKey']):
+                return shard
+        raise ValueError(f"Hash key out of range: {hash_key}")
+
+    def _check_stream(self, StreamName):
+        if StreamName != self.stream_name:
+            raise ValueError(f"Stream {StreamName} not found")
+
+    def put_record(self, StreamName, Data, PartitionKey, ExplicitHashKey=None):
+        response = self.put_records(StreamName=StreamName, Records=[
+            {'Data': Data, 'PartitionKey': PartitionKey, **({'ExplicitHashKey': ExplicitHashKey} if ExplicitHashKey else {})}
+        ])
+        return response['Records'][0]
+
+    def list_shards(self, StreamName, **kwargs):
+        self._check_stream(StreamName)
+        with self._lock:
+            return {'Shards': [{key: (dict(value) if isinstance(value, dict) else value)
+                                for key, value in shard.items() if key != 'Records'}
+                               for shard in self.shards]}
+
+    def _close(self, shard):
+        shard['SequenceNumberRange']['EndingSequenceNumber'] = f"{next(self._sequence):056d}"
+
+    def split_shard(self, StreamName, ShardToSplit, NewStartingHashKey):
+        self._check_stream(StreamName)
+        with self._lock:
+            parent = self._shard(ShardToSplit)
+            self._close(parent)
+            start, end = int(parent['HashKeyRange']['StartingHashKey']), int(parent['HashKeyRange']['EndingHashKey'])
+            self._add_shard(start, int(NewStartingHashKey) - 1, [ShardToSplit])
+            self._add_shard(int(NewStartingHashKey), end, [ShardToSplit])
+        return {}
+
+    def merge_shards(self, StreamName, ShardToMerge, AdjacentShardToMerge):
+        self._check_stream(StreamName)
+        with self._lock:
+            first, second = self._shard(ShardToMerge), self._shard(AdjacentShardToMerge)
+            self._close(first)
+            self._close(second)
+            self._add_shard(min(int(first['HashKeyRange']['StartingHashKey']), int(second['HashKeyRange']['StartingHashKey'])),
+                            max(int(first['HashKeyRange']['EndingHashKey']), int(second['HashKeyRange']['EndingHashKey'])),
+                            [ShardToMerge, AdjacentShardToMerge])
+        return {}
+
+    def _position(self, shard, iterator_type, sequence_number=None):
+        """
+        Index of the first record to read for a shard iterator type.
+        """
+        records = shard['Records']
+        if iterator_type == 'TRIM_HORIZON':
+            return 0
+        if iterator_type == 'LATEST':
+            return len(records)
+        if iterator_type in ('AT_SEQUENCE_NUMBER', 'AFTER_SEQUENCE_NUMBER'):
+            index = bisect.bisect_left([record['SequenceNumber'] for record in records], sequence_number)
+            if iterator_type == 'AFTER_SEQUENCE_NUMBER' and index < len(records) \
+                    and records[index]['SequenceNumber'] == sequence_number:
+                index += 1
+            return index
+        raise ValueError(f"Unsupported ShardIteratorType {iterator_type}")
+
+    def get_shard_iterator(self, StreamName, ShardId, ShardIteratorType, StartingSequenceNumber=None, **kwargs):
+        self._check_stream(StreamName)
+        with self._lock:
+            shard = self._shard(ShardId)
+            iterator = uuid.uuid4().hex
+            self._iterators[iterator] = (ShardId, self._position(shard, ShardIteratorType, StartingSequenceNumber))
+        return {'ShardIterator': iterator}
+
+    def get_records(self, ShardIterator, Limit=10000, **kwargs):
+        if self.read_latency:
+            time.sleep(self.read_latency)
+        with self._lock:
+            self.get_records_calls += 1
+            if ShardIterator not in self._iterators:
+                raise self.exceptions.ExpiredIteratorException("Iterator expired")
+            shard_id, position = self._iterators[ShardIterator]
+            if self.enforce_limits and not self._within_read_limit(shard_id):
+                raise self.exceptions.ProvisionedThroughputExceededException(f"Rate exceeded for shard {shard_id}")
+            del self._iterators[ShardIterator]
+            shard = self._shard(shard_id)
+            records = shard['Records'][position:position + min(Limit, 10000)]
+            position += len(records)
+            closed = 'EndingSequenceNumber' in shard['SequenceNumberRange']
+            behind = 0
+            if position < len(shard['Records']):
+                behind = int((time.time() - shard['Records'][position]['ApproximateArrivalTimestamp']) * 1000)
+            response = {'Records': [dict(record) for record in records], 'MillisBehindLatest': behind}
+            if closed and position >= len(shard['Records']):
+                # The end of a closed shard: no next iterator, the children take over
+                response['NextShardIterator'] = None
+                response['ChildShards'] = [{'ShardId': child['ShardId'],
+                                            'ParentShards': [child.get('ParentShardId'), child.get('AdjacentParentShardId')]}
+                                           for child in self.shards if shard_id in (child.get('ParentShardId'),
+                                                                                   child.get('AdjacentParentShardId'))]
+            else:
+                iterator = uuid.uuid4().hex
+                self._iterators[iterator] = (shard_id, position)
+                response['NextShardIterator'] = iterator
+        return response
+
+    def _within_read_limit(self, shard_id):
+        second = int(time.time())
+        window, calls = self._read_usage.get(shard_id, (second, 0))
+        if window != second:
+            calls = 0
+        self._read_usage[shard_id] = (second, calls + 1)
+        return calls < 5
+
+    def describe_stream_summary(self, StreamName):
+        self._check_stream(StreamName)
+        open_shards = sum(1 for shard in self.shards if 'EndingSequenceNumber' not in shard['SequenceNumberRange'])
+        return {'StreamDescriptionSummary': {'StreamName': self.stream_name, 'StreamARN': self.stream_arn,
+                                             'StreamStatus': 'ACTIVE', 'OpenShardCount': open_shards,
+                                             'ConsumerCount': len(self._consumers)}}
+
+    def register_stream_consumer(self, StreamARN, ConsumerName):
+        if StreamARN != self.stream_arn:
+            raise self.exceptions.ResourceNotFoundException(f"Stream {StreamARN} not found")
+        if ConsumerName in self._consumers:
+            raise self.exceptions.ResourceInUseException(f"Consumer {ConsumerName} already exists")
+        self._consumers[ConsumerName] = f"{StreamARN}/consumer/{ConsumerName}:{int(time.time())}"
+        return self.describe_stream_consumer(StreamARN, ConsumerName)
+
+    def describe_stream_consumer(self, StreamARN, ConsumerName):
+        if ConsumerName not in self._consumers:
+            raise self.exceptions.ResourceNotFoundException(f"Consumer {ConsumerName} not found")
+        return {'ConsumerDescription': {'ConsumerName': ConsumerName, 'ConsumerARN': self._consumers[ConsumerName],
+                                        'ConsumerStatus': 'ACTIVE', 'StreamARN': StreamARN}}
+
+    def subscribe_to_shard(self, ConsumerARN, ShardId, StartingPosition, idle_events=5, **kwargs):
+        """
+        Enhanced fan-out subscription: an event stream pushing the shard's records. The real
+        subscription lasts 5 minutes; this one ends after `idle_events` events without records
+        (or at the end of a closed shard), and the consumer resubscribes.
+        """
+        if ConsumerARN not in self._consumers.values():
+            raise self.exceptions.ResourceNotFoundException(f"Consumer {ConsumerARN} not found")
+        with self._lock:
+            shard = self._shard(ShardId)
+            position = self._position(shard, StartingPosition['Type'], StartingPosition.get('SequenceNumber'))
+            continuation = (shard['Records'][position - 1]['SequenceNumber'] if position
+                            else shard['SequenceNumberRange']['StartingSequenceNumber'])
+
+        def events():
+            nonlocal position, continuation
+            idle = 0
+            while idle < idle_events:
+                if self.read_latency:
+                    time.sleep(self.read_latency)
+                with self._lock:
+                    records = shard['Records'][position:position + 10000]
+                    position += len(records)
+                    closed = 'EndingSequenceNumber' in shard['SequenceNumberRange'] and position >= len(shard['Records'])
+                    if records:
+                        continuation = records[-1]['SequenceNumber']
+                    event = {'Records': [dict(record) for record in records], 'MillisBehindLatest': 0,
+                             'ContinuationSequenceNumber': continuation}
+                    if closed:
+                        event['ContinuationSequenceNumber'] = None
+                        event['ChildShards'] = [{'ShardId': child['ShardId']} for child in self.shards
+                                                if ShardId in (child.get('ParentShardId'),
+                                                               child.get('AdjacentParentShardId'))]
+                yield {'SubscribeToShardEvent': event}
+                if closed:
+                    return
+                idle = 0 if records else idle + 1
+
+        return {'EventStream': events()}
+
+    def _within_limits(self, shard, size):
+        """
+        Charge one record of `size` bytes to the shard's current one-second window.
+        """
+        second = int(time.time())
+        window, records, size_total = self._usage.get(shard['ShardId'], (second, 0, 0))
+        if window != second:
+            records, size_total = 0, 0
+        if records + 1 > SHARD_RECORDS_PER_SEC or size_total + size > SHARD_BYTES_PER_SEC:
+            self._usage[shard['ShardId']] = (second, records, size_total)
+            return False
+        self._usage[shard['ShardId']] = (second, records + 1, size_total + size)
+        return True
+
+    def put_records(self, StreamName, Records):
+        self._check_stream(StreamName)
+        if self.latency:
+            time.sleep(self.latency)
+        results = []
+        failed = 0
+        with self._lock:
+            self.calls += 1
+            for record in Records:
+                data = record['Data']
+                if isinstance(data, str):
+                    data = data.encode('utf-8')
+                shard = self._shard_for(record['PartitionKey'], record.get('ExplicitHashKey'))
+                if self.failure_rate and random.random() < self.failure_rate:
+                    failed += 1
+                    results.append({'ErrorCode': 'InternalFailure', 'ErrorMessage': 'Internal service failure.'})
+                    continue
+                if self.enforce_limits and not self._within_limits(shard, len(data) + len(record['PartitionKey'])):
+                    failed += 1
+                    self.throttled += 1
+                    results.append({'ErrorCode': 'ProvisionedThroughputExceededException',
+                                    'ErrorMessage': f"Rate exceeded for shard {shard['ShardId']}"})
+                    continue
+                sequence_number = f"{next(self._sequence):056d}"
+                shard['Records'].append({
+                    'SequenceNumber': sequence_number,
+                    'ApproximateArrivalTimestamp': time.time(),
+                    'Data': data,
+                    'PartitionKey': record['PartitionKey'],
+                })
+                results.append({'SequenceNumber': sequence_number, 'ShardId': shard['ShardId']})
+        return {'FailedRecordCount': failed, 'Records': results}
+
+    def records(self):
+        """
+        All stored records, shard by shard.
+        """
+        return [record for shard in self.shards for record in shard['Records']]
+
+
+class FakeAthenaClient:
+    """
+    Athena query API kept in memory. Queries go through QUEUED and RUNNING for
+    `running_polls` get_query_execution calls before they finish. ALTER TABLE ADD PARTITION
+    and MSCK REPAIR TABLE update the table's partition set, so registration can be checked;
+    other queries just succeed. Queries matching `fail_pattern` fail.
+
+    With ResultReuseConfiguration, a query identical (same text and ExecutionParameters) to
+    one that succeeded within MaxAgeInMinutes finishes immediately and is reported as reused.
+    """
+
+    ADD_PARTITION = re.compile(r"ALTER TABLE\s+(\S+)\s+ADD(?:\s+IF NOT EXISTS)?\s+PARTITION\s*\(([^)]*)\)", re.I)
+
+    def __init__(self, running_polls=0, fail_pattern=None):
+        self.running_polls = running_polls
+        self.fail_pattern = re.compile(fail_pattern, re.I) if fail_pattern else None
+        self.executions = {}
+        self.partitions = {}
+        self.queries = []
+        self._results = {}
+
+    def start_query_execution(self, QueryString, QueryExecutionContext=None, ResultConfiguration=None, **kwargs):
+        query_execution_id = str(uuid.uuid4())
+        state = 'SUCCEEDED'
+        if self.fail_pattern and self.fail_pattern.search(QueryString):
+            state = 'FAILED'
+        else:
+            match = self.ADD_PARTITION.search(QueryString)
+            if match:
+                values = tuple(value.strip().split('=')[1].strip(" '") for value in match.group(2).split(','))
+                self.partitions.setdefault(match.group(1), set()).add(values)
+        reused = False
+        reuse = kwargs.get('ResultReuseConfiguration', {}).get('ResultReuseByAgeConfiguration', {})
+        if state == 'SUCCEEDED' and reuse.get('Enabled'):
+            signature = (QueryString, tuple(kwargs.get('ExecutionParameters', ())))
+            previous = self._results.get(signature)
+            reused = previous is not None and time.time() - previous < reuse.get('MaxAgeInMinutes', 60) * 60
+            if not reused:
+                self._results[signature] = time.time()
+        self.queries.append(QueryString)
+        self.executions[query_execution_id] = {
+            'QueryString': QueryString,
+            'QueryExecutionContext': QueryExecutionContext or {},
+            'ResultConfiguration': ResultConfiguration or {},
+            'State': state,
+            'Polls': self.running_polls if reused else 0,
+            'Reused': reused,
+            **kwargs,
+        }
+        return {'QueryExecutionId': query_execution_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        execution = self.executions[QueryExecutionId]
+        execution['Polls'] += 1
+        if execution['Polls'] <= self.running_polls:
+            state = 'QUEUED' if execution['Polls'] == 1 else 'RUNNING'
+        else:
+            state = execution['State']
+        status = {'State': state}
+        if state == 'FAILED':
+            status['StateChangeReason'] = 'Query failed (simulated).'
+        return {'QueryExecution': {
+            'QueryExecutionId': QueryExecutionId,
+            'Query': execution['QueryString'],
+            'QueryExecutionContext': execution['QueryExecutionContext'],
+            'ResultConfiguration': execution['ResultConfiguration'],
+            'Status': status,
+            'Statistics': {'ResultReuseInformation': {'ReusedPreviousResult': execution['Reused']}},
+        }}
+
+
+class FakeS3Client:
+    """
+    S3 objects kept in a dict keyed by (bucket, key), for get_object/put_object callers.
+    """
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+        return {'ETag': f'"{uuid.uuid4().hex}"'}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(f"The specified key does not exist: {Key}")
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+
+class FakeQuickSightClient:
+    """
+    QuickSight SPICE ingestions kept in memory; each ingestion reports RUNNING for
+    `running_polls` describe_ingestion calls and then COMPLETED.
+    """
+
+    def __init__(self, running_polls=1):
+        self.running_polls = running_polls
+        self.ingestions = {}
+
+    def create_ingestion(self, AwsAccountId, DataSetId, IngestionId, **kwargs):
+        self.ingestions[(DataSetId, IngestionId)] = {'Polls': 0}
+        return {'IngestionId': IngestionId, 'IngestionStatus': 'INITIALIZED', 'Status': 201}
+
+    def describe_ingestion(self, AwsAccountId, DataSetId, IngestionId):
+        ingestion = self.ingestions[(DataSetId, IngestionId)]
+        ingestion['Polls'] += 1
+        status = 'RUNNING' if ingestion['Polls'] <= self.running_polls else 'COMPLETED'
+        return {'Ingestion': {'IngestionId': IngestionId, 'IngestionStatus': status}, 'Status': 200}
+
+
+class FakeSQSClient:
+    """
+    SQS queues kept in memory as lists of message bodies.
+    """
+
+    def __init__(self):
+        self.queues = {}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        if len(Entries) > 10:
+            raise ValueError("Too many entries in a single request (max 10)")
+        queue = self.queues.setdefault(QueueUrl, [])
+        successful = []
+        for entry in Entries:
+            queue.append(entry['MessageBody'])
+            successful.append({'Id': entry['Id'], 'MessageId': str(uuid.uuid4())})
+        return {'Successful': successful, 'Failed': []}
+
+
+class FakeDynamoDBClient:
+    """
+    DynamoDB tables kept in memory (get_item/put_item on the table's key attributes).
+    """
+
+    def __init__(self, key_attributes=("stream", "shard_id")):
+        self.key_attributes = key_attributes
+        self.tables = {}
+
+    def _key(self, item):
+        return tuple(item[name]['S'] for name in self.key_attributes)
+
+    def put_item(self, TableName, Item, **kwargs):
+        self.tables.setdefault(TableName, {})[self._key(Item)] = dict(Item)
+        return {}
+
+    def get_item(self, TableName, Key, **kwargs):
+        item = self.tables.get(TableName, {}).get(self._key(Key))
+        return {'Item': dict(item)} if item else {}
@@ -0,0 +1,365 @@
+"""
+Lightweight in-process metrics for the pipeline.
+
+Counters, gauges, histograms and timers live in a Registry (REGISTRY by default) and are recorded
+per batch or per call, not per record, so the cost on hot paths is a dict lookup, a lock
+and an addition. Two formatters export the registry:
+
+- prometheus_text(): the Prometheus text exposition format, served by start_http_server()
+  for the long-running simulators and the Spark driver (--metrics-port);
+- emf_document(): a CloudWatch Embedded Metric Format JSON document, printed by the Lambda
+  functions once per invocation so CloudWatch Logs turns it into metrics.
+
+Set METRICS=off to make every metric a no-op.
+"""
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from functools import lru_cache
+
+import json_codec
+
+# Latency buckets in seconds (upper bounds), 1 ms to 5 minutes
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+ENABLED = os.environ.get("METRICS", "on").lower() not in ("off", "0", "false")
+
+
+class Counter:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def reset(self):
+        with self._lock:
+            self.value = 0
+
+
+class Gauge:
+    """
+    A value that goes up and down (lag, current batch size); None until first set.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def reset(self):
+        self.value = None
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count", "max", "_lock")
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = tuple(bounds)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # One count per bucket plus the +Inf bucket
+            self.counts = [0] * (len(self.bounds) + 1)
+            self.sum = 0.0
+            self.count = 0
+            self.max = None
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def time(self):
+        """
+        Context manager observing the elapsed seconds of its block.
+        """
+        return Timer(self)
+
+    def quantile(self, q):
+        """
+        Estimated q-quantile (0..1): the upper bound of the bucket holding it (the max for +Inf).
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+
+class Timer:
+    __slots__ = ("histogram", "start", "seconds")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.seconds = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        self.histogram.observe(self.seconds)
+        return False
+
+
+class _NoOp:
+    """
+    Stand-in for every metric when metrics are disabled.
+    """
+    value = 0
+    count = 0
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def time(self):
+        return Timer(self)
+
+    def quantile(self, q):
+        return None
+
+    def reset(self):
+        pass
+
+
+_NOOP = _NoOp()
+
+
+class Registry:
+    """
+    Metric families by name; each family holds one metric per label set.
+    """
+
+    def __init__(self, enabled=ENABLED):
+        self.enabled = enabled
+        # name -> (kind, help, unit, {labels tuple: metric})
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind, factory, name, help, unit, labels):
+        if not self.enabled:
+            return _NOOP
+        key = tuple(sorted(labels.items()))
+        family = self._families.get(name)
+        if family is None:
+            with self._lock:
+                family = self._families.setdefault(name, (kind, help, unit, {}))
+        if family[0] != kind:
+            raise ValueError(f"Metric {name} is already registered as a {family[0]}")
+        metric = family[3].get(key)
+        if metric is None:
+            with self._lock:
+                metric = family[3].setdefault(key, factory())
+        return metric
+
+    def counter(self, name, help="", unit="Count", **labels):
+        return self._get("counter", Counter, name, help, unit, labels)
+
+    def gauge(self, name, help="", unit="None", **labels):
+        return self._get("gauge", Gauge, name, help, unit, labels)
+
+    def histogram(self, name, help="", unit="Seconds", buckets=DEFAULT_BUCKETS, **labels):
+        return self._get("histogram", lambda: Histogram(buckets), name, help, unit, labels)
+
+    def timer(self, name, help="", **labels):
+        """
+        Time a block into the histogram `name` (in seconds): `with registry.timer("x"): ...`
+        """
+        return self.histogram(name, help, "Seconds", **labels).time()
+
+    def families(self):
+        with self._lock:
+            return [(name, kind, help, unit, dict(metrics))
+                    for name, (kind, help, unit, metrics) in sorted(self._families.items())]
+
+    def reset(self):
+        """
+        Zero every metric (metrics stay registered, so references held by callers stay valid).
+        """
+        for _, _, _, _, metrics in self.families():
+            for metric in metrics.values():
+                metric.reset()
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help="", unit="Count", **labels):
+    return REGISTRY.counter(name, help, unit, **labels)
+
+
+def gauge(name, help="", unit="None", **labels):
+    return REGISTRY.gauge(name, help, unit, **labels)
+
+
+def histogram(name, help="", unit="Seconds", buckets=DEFAULT_BUCKETS, **labels):
+    return REGISTRY.histogram(name, help, unit, buckets, **labels)
+
+
+def timer(name, help="", **labels):
+    return REGISTRY.timer(name, help, **labels)
+
+
+_INVALID_NAME_CHARACTERS = re.compile(r"[^a-zA-Z0-9_:]")
+
+
+def _prometheus_name(name):
+    """
+    Metric or label name with the characters Prometheus does not allow replaced by "_".
+    """
+    name = _INVALID_NAME_CHARACTERS.sub("_", name)
+    return "_" + name if name[:1].isdigit() else name
+
+
+def _escape(text, quote=False):
+    text = str(text).replace("\\", "\\\\").replace("\n", "\\n")
+    return text.replace('"', '\\"') if quote else text
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{_prometheus_name(key)}="{_escape(value, quote=True)}"' for key, value in pairs) + "}"
+
+
+def prometheus_text(registry=REGISTRY):
+    """
+    The registry in the Prometheus text exposition format (version 0.0.4). Names are
+    sanitized, and label values and help texts escaped, as the format requires.
+    """
+    lines = []
+    for name, kind, help, _, metrics in registry.families():
+        name = _prometheus_name(name)
+        if help:
+            lines.append(f"# HELP {name} {_escape(help)}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, metric in sorted(metrics.items()):
+            if kind == "counter":
+                lines.append(f"{name}{_label_text(labels)} {metric.value}")
+                continue
+            if kind == "gauge":
+                if metric.value is not None:
+                    lines.append(f"{name}{_label_text(labels)} {metric.value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.bounds + (float("inf"),), metric.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_label_text(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(labels)} {metric.sum}")
+            lines.append(f"{name}_count{_label_text(labels)} {metric.count}")
+    return "\n".join(lines) + "\n"
+
+
+@lru_cache(maxsize=1024)
+def _emf_name(name, labels):
+    return name + "".join(f".{key}={value}" for key, value in labels)
+
+
+def emf_document(registry=REGISTRY, namespace="WeatherPipeline", dimensions=None, timestamp=None):
+    """
+    The registry as one CloudWatch Embedded Metric Format document.
+
+    Counters and gauges become metrics named after them (labels appended as name.key=value);
+    histograms become <name>_sum, <name>_count and <name>_max. With one document per Lambda
+    invocation, CloudWatch statistics over <name>_sum give the distribution across
+    invocations. Metrics without data are left out. dimensions (dict) are added to every metric.
+    """
+    dimensions = dict(dimensions or {})
+    document = dict(dimensions)
+    definitions = []
+
+    def put(name, value, unit):
+        document[name] = value
+        definitions.append({"Name": name, "Unit": unit})
+
+    for name, kind, _, unit, metrics in registry.families():
+        for labels, metric in metrics.items():
+            metric_name = _emf_name(name, labels)
+            if kind == "counter":
+                if metric.value:
+                    put(metric_name, metric.value, unit)
+            elif kind == "gauge":
+                if metric.value is not None:
+                    put(metric_name, metric.value, unit)
+            elif metric.count:
+                put(f"{metric_name}_sum", metric.sum, unit)
+                put(f"{metric_name}_count", metric.count, "Count")
+                put(f"{metric_name}_max", metric.max, unit)
+    document["_aws"] = {
+        "Timestamp": int((timestamp or time.time()) * 1000),
+        # EMF allows 100 metrics per document
+        "CloudWatchMetrics": [{"Namespace": namespace, "Dimensions": [sorted(dimensions)],
+                               "Metrics": definitions[:100]}],
+    }
+    return document
+
+
+def emit_emf(registry=REGISTRY, namespace="WeatherPipeline", dimensions=None, reset=True, write=print):
+    """
+    Print the registry as an EMF line (CloudWatch Logs extracts the metrics) and, by default,
+    reset it so each line covers one Lambda invocation.
+    """
+    if not registry.enabled:
+        return None
+    document = emf_document(registry, namespace, dimensions)
+    write(json_codec.dumps(document).decode("utf-8"))
+    if reset:
+        registry.reset()
+    return document
+
+
+def start_http_server(port, registry=REGISTRY, host="0.0.0.0"):
+    """
+    Serve prometheus_text() on http://<host>:<port>/metrics from a daemon thread.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = prometheus_text(registry).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Metrics served on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve Prometheus metrics on this port (http://<host>:<port>/metrics)")
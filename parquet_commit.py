@@ -0,0 +1,223 @@
+"""
+Idempotent, batch-keyed commits for the partitioned Parquet output.
+
+Appending every micro-batch duplicates data when a batch is replayed after a failure: the
+structured engine re-runs the batch ids after its last checkpoint, and the DStream job with
+--streaming-checkpoint regenerates its pending batches (same batch times, same Kinesis
+sequence ranges). BatchCommitter writes a batch in three steps:
+
+1. stage: the batch is written to <table>/_staging/<scope>/<batch id>/ (a retry overwrites it);
+2. publish: a pending manifest listing the target files is written, then every staged file
+   is renamed into its partition as b-<scope>-<batch id>-<name>;
+3. commit: the pending manifest is renamed to <table>/_commits/<scope>/<batch id>.json.
+
+A batch whose manifest exists is skipped before any Spark work, so a replay runs at full
+speed and no dedupe query is needed afterwards. A failed attempt is undone before the next
+one and by recover() at startup: the files listed in its pending manifest are deleted along
+with its staging directory. Spark and Athena ignore the _staging and _commits directories.
+
+Manifests are only needed while their batch can still be replayed, so each scope keeps
+the newest `retain` of them (at least DEFAULT_RETAINED_COMMITS, and at least the batches a
+structured checkpoint retains, spark.sql.streaming.minBatchesToRetain) and deletes older
+ones at startup and every PRUNE_INTERVAL commits.
+
+The publish step holds the locks of the partitions it writes to (compaction.partition_lock),
+so a compaction never swaps a partition while files are being renamed into it.
+
+Paths go through the Hadoop FileSystem API (compaction.HadoopFS), so local paths and S3 URIs
+both work. The commit is one rename of a small file: atomic locally and on HDFS, a copy of
+a single object on S3, which appears whole. The scope keeps the batch ids of different
+queries apart (see scope_for).
+"""
+import contextlib
+import hashlib
+import json
+import re
+import time
+
+from compaction import HadoopFS, partition_lock
+from spark_transforms import PARTITION_COLUMNS
+
+STAGING_DIR = "_staging"
+COMMITS_DIR = "_commits"
+PENDING_SUFFIX = ".pending.json"
+DEFAULT_RETAINED_COMMITS = 1000
+PRUNE_INTERVAL = 100
+
+_NAME = re.compile(r"^[A-Za-z0-9]+$")
+
+# One committer per (table, scope), kept across batches so committed ids are only checked once
+_committers = {}
+
+
+def scope_for(checkpoint_location):
+    """
+    Commit scope of a streaming query: batch ids restart at 0 with a new checkpoint, so they
+    are only comparable within one checkpoint location.
+    """
+    return hashlib.sha1(checkpoint_location.rstrip("/").encode("utf-8")).hexdigest()[:12]
+
+
+def get_committer(spark, table_path, scope):
+    key = (table_path, scope)
+    if key not in _committers:
+        _committers[key] = BatchCommitter(spark, table_path, scope)
+    return _committers[key]
+
+
+def write_batch(df, batch_id, table_path, write, scope=None):
+    """
+    Commit df as batch_id of scope (see BatchCommitter.commit), or append it without a scope.
+
+    Returns:
+    bool: False if the batch was already committed.
+    """
+    if scope is None:
+        write(df, table_path, "append")
+        return True
+    return get_committer(df.sparkSession, table_path, scope).commit(df, batch_id, write) is not None
+
+
+def recover(spark, table_path, scope):
+    """
+    Roll back the uncommitted batches of scope in table_path (see BatchCommitter.recover).
+    """
+    return get_committer(spark, table_path, scope).recover()
+
+
+class BatchCommitter:
+    """
+    Stages, publishes and commits the batches of one query (scope) into a partitioned table.
+
+    retain (int): Committed manifests kept (see prune); by default the larger of
+    DEFAULT_RETAINED_COMMITS and spark.sql.streaming.minBatchesToRetain.
+    """
+
+    def __init__(self, spark, table_path, scope, retain=None):
+        if not _NAME.match(scope):
+            raise ValueError(f"Commit scope must be alphanumeric: {scope}")
+        self.spark = spark
+        self.table_path = table_path.rstrip("/")
+        self.scope = scope
+        self.fs = HadoopFS(spark, self.table_path)
+        self.staging_root = f"{self.table_path}/{STAGING_DIR}/{scope}"
+        self.commit_root = f"{self.table_path}/{COMMITS_DIR}/{scope}"
+        if retain is None:
+            retain = max(DEFAULT_RETAINED_COMMITS, int(spark.conf.get("spark.sql.streaming.minBatchesToRetain", "100")))
+        self.retain = retain
+        self._committed = set()
+        self._commits_since_prune = 0
+
+    def _batch(self, batch_id):
+        batch = str(batch_id)
+        if not _NAME.match(batch):
+            raise ValueError(f"Batch id must be alphanumeric: {batch}")
+        return batch
+
+    def manifest_path(self, batch_id):
+        return f"{self.commit_root}/{self._batch(batch_id)}.json"
+
+    def is_committed(self, batch_id):
+        batch = self._batch(batch_id)
+        if batch not in self._committed and self.fs.exists(self.manifest_path(batch)):
+            self._committed.add(batch)
+        return batch in self._committed
+
+    def _abort(self, batch):
+        """
+        Undo a failed attempt: delete the files its pending manifest lists and its staging directory.
+        """
+        pending = f"{self.commit_root}/{batch}{PENDING_SUFFIX}"
+        removed = 0
+        if self.fs.exists(pending):
+            for name in json.loads(self.fs.read_text(pending))["files"]:
+                if self.fs.exists(f"{self.table_path}/{name}"):
+                    self.fs.delete(f"{self.table_path}/{name}")
+                    removed += 1
+            self.fs.delete(pending)
+        self.fs.delete(f"{self.staging_root}/{batch}")
+        return removed
+
+    def recover(self):
+        """
+        Clean up the attempts that never committed (to be called before the query starts).
+
+        Returns:
+        list: batch ids that were rolled back.
+        """
+        batches = {name[:-len(PENDING_SUFFIX)] for name in self.fs.names(self.commit_root)
+                   if name.endswith(PENDING_SUFFIX)}
+        batches |= set(self.fs.names(self.staging_root))
+        for batch in sorted(batches):
+            removed = self._abort(batch)
+            print(f"Rolled back uncommitted batch {batch} ({removed} published file(s) removed)")
+        self.prune()
+        return sorted(batches)
+
+    def prune(self):
+        """
+        Delete the committed manifests beyond the newest `retain`. Batch ids only grow (the
+        structured engine's counters and the DStream batch times alike), so the oldest
+        manifests belong to batches no checkpoint can replay any more.
+
+        Returns:
+        list: batch ids whose manifests were deleted.
+        """
+        self._commits_since_prune = 0
+        batches = [name[:-len(".json")] for name in self.fs.names(self.commit_root)
+                   if name.endswith(".json") and not name.endswith(PENDING_SUFFIX)]
+        # Numeric order for the digit-only ids
+        batches.sort(key=lambda batch: (len(batch), batch))
+        expired = batches[:max(0, len(batches) - self.retain)]
+        for batch in expired:
+            self.fs.delete(self.manifest_path(batch))
+            self._committed.discard(batch)
+        if expired:
+            print(f"Pruned {len(expired)} commit manifest(s) of scope {self.scope} up to batch {expired[-1]}")
+        return expired
+
+    def commit(self, df, batch_id, write, info=None):
+        """
+        Write df for batch_id unless that batch is already committed.
+
+        write(df, path, mode) writes the partitioned Parquet files (spark_transforms.write_partitioned).
+        info (dict or callable returning one) is stored in the manifest.
+
+        Returns:
+        list: table-relative paths of the committed files, or None if the batch was already committed.
+        """
+        batch = self._batch(batch_id)
+        if self.is_committed(batch):
+            return None
+        self._abort(batch)
+
+        staged = f"{self.staging_root}/{batch}"
+        write(df, staged, "overwrite")
+        staged_fs = HadoopFS(self.spark, staged)
+        moves = []
+        for partition in staged_fs.partitions():
+            relative = "/".join(f"{key}={value}" for key, value in zip(PARTITION_COLUMNS, partition))
+            for name in staged_fs.data_files(f"{staged}/{relative}"):
+                moves.append((f"{staged}/{relative}/{name}", f"{relative}/b-{self.scope}-{batch}-{name}"))
+
+        manifest = {"scope": self.scope, "batch_id": batch, "files": [target for _, target in moves]}
+        # The pending manifest lists what the publish step may leave behind if it fails midway
+        self.fs.mkdirs(self.commit_root)
+        self.fs.write_text(f"{self.commit_root}/{batch}{PENDING_SUFFIX}", json.dumps(manifest))
+        # Partition locks keep a compaction (compaction.py) from swapping a partition meanwhile
+        with contextlib.ExitStack() as locks:
+            for relative in sorted({target.rsplit("/", 1)[0] for _, target in moves}):
+                locks.enter_context(partition_lock(self.fs, self.table_path, relative))
+                self.fs.mkdirs(f"{self.table_path}/{relative}")
+            for source, target in moves:
+                self.fs.rename(source, f"{self.table_path}/{target}")
+
+        manifest.update(info() if callable(info) else (info or {}), committed_at=time.time())
+        self.fs.write_text(f"{self.commit_root}/{batch}{PENDING_SUFFIX}", json.dumps(manifest))
+        self.fs.rename(f"{self.commit_root}/{batch}{PENDING_SUFFIX}", self.manifest_path(batch))
+        self._committed.add(batch)
+        self.fs.delete(staged)
+        self._commits_since_prune += 1
+        if self._commits_since_prune >= PRUNE_INTERVAL:
+            self.prune()
+        return manifest["files"]
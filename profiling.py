@@ -0,0 +1,267 @@
+"""
+Opt-in profiling of the pipeline's entry points (the two Lambda handlers and the Spark
+batch function process_kinesis_stream).
+
+PROFILE selects the mode; it is read once at import, and when it is off (the default) the
+@profiled decorator returns the function itself and phase() returns a shared no-op context
+manager, so the instrumentation costs one attribute check per phase:
+
+- phases: per-phase wall time (decode, parse, compute, encode, aws, ...) of every
+  invocation, printed as one JSON line. Phases nest; each phase counts its own time only,
+  and the time outside any phase is reported as "other";
+- sample: phases, plus a sampling profiler: a thread records the stack of the invoking
+  thread every PROFILE_INTERVAL seconds (default 0.001) and writes the samples as collapsed
+  stacks ("frame;frame;frame count" lines, the input of flamegraph.pl and speedscope);
+- cprofile: phases, plus a deterministic cProfile run saved as a pstats .prof file (exact
+  call counts, but a much higher overhead).
+
+Profiles go to PROFILE_DIR (default /tmp/profiles), one file per invocation; an
+s3://bucket/prefix location uploads them instead, since a Lambda's /tmp is not reachable
+afterwards. PROFILE_RECORD=<path.jsonl> appends every handler event to a file, to be fed
+through the handlers locally by replay_events.py.
+"""
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+MODES = ("off", "phases", "sample", "cprofile")
+
+MODE = os.environ.get("PROFILE", "off").lower()
+if MODE in ("", "0", "false", "no"):
+    MODE = "off"
+elif MODE in ("1", "true", "on"):
+    MODE = "phases"
+if MODE not in MODES:
+    raise ValueError(f"PROFILE must be one of {', '.join(MODES)}, not {MODE}")
+ENABLED = MODE != "off"
+RECORD_PATH = os.environ.get("PROFILE_RECORD")
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+SAMPLE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.001"))
+
+# Summaries of the latest invocations in this process (replay_events.py aggregates them)
+history = deque(maxlen=10000)
+
+_local = threading.local()
+_counts = Counter()
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    __slots__ = ("invocation", "name", "start", "children")
+
+    def __init__(self, invocation, name):
+        self.invocation = invocation
+        self.name = name
+
+    def __enter__(self):
+        self.children = 0.0
+        self.invocation.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stack = self.invocation.stack
+        stack.pop()
+        phases = self.invocation.phases
+        phases[self.name] = phases.get(self.name, 0.0) + elapsed - self.children
+        if stack:
+            stack[-1].children += elapsed
+        return False
+
+
+def phase(name):
+    """
+    Context manager timing a phase of the current invocation (a no-op outside one).
+    """
+    if not ENABLED:
+        return _NULL_PHASE
+    invocation = getattr(_local, "invocation", None)
+    if invocation is None:
+        return _NULL_PHASE
+    return _Phase(invocation, name)
+
+
+def frame_label(code):
+    return f"{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}"
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stack of one thread at a fixed interval into a Counter of collapsed stacks.
+
+    Stacks are recorded root first and cut below the frame of the profiled entry point.
+    """
+
+    def __init__(self, thread_id, root_code, interval=SAMPLE_INTERVAL):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.root_code = root_code
+        self.interval = interval
+        self.samples = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame.f_code))
+                if frame.f_code is self.root_code:
+                    # Samples outside the entry point (before it starts, while it returns) are dropped
+                    self.samples[";".join(reversed(labels))] += 1
+                    break
+                frame = frame.f_back
+
+    def start(self):
+        # The profiled thread holds the GIL for up to the switch interval (5 ms by default)
+        # at a time; a shorter one lets the sampler in at its own interval
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.interval))
+        super().start()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def _save(name, data):
+    """
+    Write a profile to PROFILE_DIR (a directory or an s3:// prefix). Returns its location.
+    """
+    if PROFILE_DIR and PROFILE_DIR.startswith("s3://"):
+        import aws_clients
+        bucket, _, prefix = PROFILE_DIR[len("s3://"):].partition("/")
+        key = f"{prefix.rstrip('/')}/{name}".lstrip("/")
+        aws_clients.client("s3").put_object(Bucket=bucket, Key=key, Body=data)
+        return f"s3://{bucket}/{key}"
+    import tempfile
+    directory = PROFILE_DIR or os.path.join(tempfile.gettempdir(), "profiles")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def record_event(event):
+    """
+    Append a handler event to PROFILE_RECORD as one JSON line.
+    """
+    with open(RECORD_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(event, default=str) + "\n")
+
+
+class Invocation:
+    """
+    Profiles one call of an entry point: phase timers, plus the sampler or cProfile.
+    """
+
+    def __init__(self, name, root_code):
+        self.name = name
+        self.root_code = root_code
+        self.phases = {}
+        self.stack = []
+        self.sampler = None
+        self.profiler = None
+
+    def __enter__(self):
+        _counts[self.name] += 1
+        self.number = _counts[self.name]
+        _local.invocation = self
+        if MODE == "sample":
+            self.sampler = StackSampler(threading.get_ident(), self.root_code)
+            self.sampler.start()
+        elif MODE == "cprofile":
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        total = time.perf_counter() - self.start
+        if self.profiler:
+            self.profiler.disable()
+        if self.sampler:
+            self.sampler.stop()
+        _local.invocation = None
+        summary = self.summary(total, error=exc_type.__name__ if exc_type else None)
+        history.append(summary)
+        print(json.dumps({"profile": summary}))
+        return False
+
+    def summary(self, total, error=None):
+        stem = f"{self.name}-{os.getpid()}-{self.number:05d}"
+        summary = {
+            "entry_point": self.name,
+            "invocation": self.number,
+            "mode": MODE,
+            "total_ms": round(total * 1000, 3),
+            "phases_ms": {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()},
+            "other_ms": round(max(0.0, total - sum(self.phases.values())) * 1000, 3),
+        }
+        if error:
+            summary["error"] = error
+        try:
+            if self.sampler:
+                summary["samples"] = sum(self.sampler.samples.values())
+                summary["stacks"] = _save(f"{stem}.collapsed", self.sampler.collapsed().encode("utf-8"))
+            elif self.profiler:
+                import tempfile
+                fd, path = tempfile.mkstemp(suffix=".prof")
+                os.close(fd)
+                try:
+                    self.profiler.dump_stats(path)
+                    with open(path, "rb") as f:
+                        summary["stats"] = _save(f"{stem}.prof", f.read())
+                finally:
+                    os.remove(path)
+        except Exception as e:
+            # Losing a profile must not fail the invocation
+            summary["save_error"] = str(e)
+        return summary
+
+
+def profiled(name):
+    """
+    Decorator profiling every call of an entry point under `name`; returns the function
+    unchanged unless PROFILE or PROFILE_RECORD is set. Calls made inside another profiled
+    call (e.g. a handler calling a helper) only count as part of the outer one.
+    """
+    def decorate(func):
+        if not ENABLED and not RECORD_PATH:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if RECORD_PATH and args and isinstance(args[0], dict):
+                record_event(args[0])
+            if not ENABLED or getattr(_local, "invocation", None) is not None:
+                return func(*args, **kwargs)
+            with Invocation(name, func.__code__):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
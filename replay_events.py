@@ -0,0 +1,231 @@
+"""
+Replay recorded (or generated) events through the pipeline's entry points locally, with
+the in-memory AWS clients of local_aws.py, and summarize where the time goes.
+
+- firehose: Firehose transformation events through Lambda_process_weather_data.lambda_handler;
+- athena: S3 upload notifications through Lambda_PushToAthena.lambda_handler;
+- spark: Kinesis Agent log files (one reading per line) through the Spark batch function
+  process_kinesis_stream of kinesis-spark-etl.py, in local mode.
+
+Lambda events are read from a JSON lines file as written with PROFILE_RECORD set (see
+profiling.py), or generated with --generate. Profiling is on for the replay (PROFILE,
+default phases), so every invocation prints its per-phase summary; the tool then prints the
+phase percentiles over all invocations and, in sample mode, merges the collapsed stacks of
+all invocations into one file for flamegraph.pl or speedscope (--flamegraph).
+
+Example:
+python replay_events.py firehose --generate 20 --batch-size 500 --profile sample --flamegraph /tmp/firehose.collapsed
+"""
+import argparse
+import base64
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+
+TARGETS = ("firehose", "athena", "spark")
+
+
+def read_events(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def generate_firehose_events(count, batch_size):
+    import kinesisagent_simdata_gen as simdata
+
+    events = []
+    for index in range(count):
+        readings = simdata.generate_batch(index, batch_size)
+        events.append({'records': [
+            {'recordId': f"{index}-{i}", 'data': base64.b64encode(json.dumps(reading).encode('utf-8')).decode('ascii')}
+            for i, reading in enumerate(readings)
+        ]})
+    return events
+
+
+def generate_s3_events(count, batch_size, bucket="forest-weather-data"):
+    """
+    S3 put notifications of batch_size part files each, spread over a few day partitions.
+    """
+    events = []
+    for index in range(count):
+        day = datetime(2024, 10, 1) + timedelta(days=index % 7)
+        events.append({'Records': [
+            {'eventSource': 'aws:s3', 'eventName': 'ObjectCreated:Put',
+             's3': {'bucket': {'name': bucket}, 'object': {
+                 'key': f"forest_weather_data_parquet/year={day.year}/month={day.month:02d}/day={day.day:02d}/"
+                        f"part-{index:05d}-{i:05d}.snappy.parquet"}}}
+            for i in range(batch_size)
+        ]})
+    return events
+
+
+def replay_firehose(args):
+    import Lambda_process_weather_data as firehose_lambda
+    from ffwi_alerts import AlertEngine, QueueAlertSink
+    from local_aws import FakeSQSClient
+
+    if args.alerts:
+        firehose_lambda.alert_engine = AlertEngine(QueueAlertSink(FakeSQSClient(), "local-alerts"))
+    events = read_events(args.events) if args.events else generate_firehose_events(args.generate, args.batch_size)
+    for _ in range(args.repeat):
+        for event in events:
+            firehose_lambda.lambda_handler(event, None)
+    return len(events) * args.repeat
+
+
+def replay_athena(args):
+    import Lambda_PushToAthena as athena_lambda
+    from local_aws import FakeAthenaClient, FakeQuickSightClient, FakeS3Client
+    from s3_events import IngestionLimiter
+
+    athena_lambda.athena_client = FakeAthenaClient(running_polls=args.running_polls)
+    athena_lambda.s3_client = FakeS3Client()
+    athena_lambda.quicksight_client = FakeQuickSightClient()
+    athena_lambda.ingestion_limiter = IngestionLimiter(athena_lambda.quicksight_client, athena_lambda.AWS_ACCOUNT_ID,
+                                                       athena_lambda.QUICKSIGHT_MIN_INTERVAL)
+    athena_lambda.registrars.clear()
+    athena_lambda.orchestrators.clear()
+    athena_lambda.query_debouncer.window = 0
+    events = read_events(args.events) if args.events else generate_s3_events(args.generate, args.batch_size)
+    for _ in range(args.repeat):
+        for event in events:
+            athena_lambda.lambda_handler(event, None)
+    return len(events) * args.repeat
+
+
+def load_spark_job():
+    spec = importlib.util.spec_from_file_location(
+        "kinesis_spark_etl", os.path.join(os.path.dirname(os.path.abspath(__file__)), "kinesis-spark-etl.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def replay_spark(args):
+    from pyspark.sql import SparkSession
+
+    job = load_spark_job()
+    if args.events:
+        with open(args.events, encoding="utf-8") as f:
+            lines = [line.rstrip("\n") for line in f if line.strip()]
+    else:
+        import kinesisagent_simdata_gen as simdata
+        lines = [json.dumps(reading) for index in range(args.generate)
+                 for reading in simdata.generate_batch(index, args.batch_size)]
+    output = args.output or tempfile.mkdtemp(prefix="replay-spark-")
+    spark = SparkSession.builder.master("local[*]").appName("replay-events").getOrCreate()
+    spark.sparkContext.setLogLevel("ERROR")
+    batch_time = datetime(2024, 10, 1)
+    batches = 0
+    try:
+        for _ in range(args.repeat):
+            for start in range(0, len(lines), args.spark_batch_size):
+                rdd = spark.sparkContext.parallelize(lines[start:start + args.spark_batch_size])
+                job.process_kinesis_stream(spark, rdd, output, batch_time=batch_time)
+                batch_time += timedelta(seconds=10)
+                batches += 1
+    finally:
+        spark.stop()
+    print(f"Parquet output in {output}", file=sys.stderr)
+    return batches
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def print_summary(summaries):
+    """
+    Per-phase percentiles (ms) and share of the total time over all invocations.
+    """
+    totals = [summary["total_ms"] for summary in summaries]
+    phases = {}
+    for summary in summaries:
+        for name, ms in list(summary["phases_ms"].items()) + [("other", summary["other_ms"])]:
+            phases.setdefault(name, []).append(ms)
+    grand_total = sum(totals) or 1.0
+    print(f"{len(summaries)} invocation(s) of {summaries[0]['entry_point']}: "
+          f"p50 {percentile(totals, 50):.2f} ms, p99 {percentile(totals, 99):.2f} ms, max {max(totals):.2f} ms")
+    print(f"{'phase':<16}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'share':>8}")
+    for name, values in sorted(phases.items(), key=lambda item: -sum(item[1])):
+        print(f"{name:<16}{percentile(values, 50):>10.2f}{percentile(values, 99):>10.2f}{max(values):>10.2f}"
+              f"{sum(values) / grand_total:>8.1%}")
+
+
+def merge_stacks(summaries, path):
+    """
+    Merge the collapsed stacks of all invocations into one file.
+    """
+    merged = Counter()
+    for summary in summaries:
+        if "stacks" not in summary or summary["stacks"].startswith("s3://"):
+            continue
+        with open(summary["stacks"], encoding="utf-8") as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                merged[stack] += int(count)
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in merged.most_common():
+            f.write(f"{stack} {count}\n")
+    print(f"{sum(merged.values())} samples in {len(merged)} distinct stacks written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay events through the pipeline's handlers with profiling on")
+    parser.add_argument("target", choices=TARGETS)
+    parser.add_argument("events", nargs="?",
+                        help="JSON lines file of recorded events (spark: agent log file of readings)")
+    parser.add_argument("--generate", type=int, default=10,
+                        help="Without an events file: number of events (spark: ticks of readings) to generate")
+    parser.add_argument("--batch-size", type=int, default=500,
+                        help="Generated records per event (athena: files per S3 event)")
+    parser.add_argument("--spark-batch-size", type=int, default=10000, help="Readings per Spark batch")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the events this many times")
+    parser.add_argument("--profile", choices=("phases", "sample", "cprofile"),
+                        help="Profiling mode (default: PROFILE from the environment, or phases)")
+    parser.add_argument("--profile-dir", help="Where per-invocation profiles go (default: PROFILE_DIR or /tmp/profiles)")
+    parser.add_argument("--flamegraph", help="Merge the collapsed stacks of all invocations into this file (sample mode)")
+    parser.add_argument("--alerts", action="store_true", help="firehose: enable FFWI alerts to an in-memory SQS queue")
+    parser.add_argument("--running-polls", type=int, default=0,
+                        help="athena: polls each in-memory query stays QUEUED/RUNNING")
+    parser.add_argument("--output", help="spark: Parquet output path (default: a temporary directory)")
+    parser.add_argument("--quiet", action="store_true", help="Hide the handlers' own output")
+    args = parser.parse_args()
+
+    # The profiling mode is read when the handlers are imported
+    if args.profile:
+        os.environ["PROFILE"] = args.profile
+    elif os.environ.get("PROFILE", "off").lower() in ("", "off", "0", "false", "no"):
+        os.environ["PROFILE"] = "phases"
+    if args.profile_dir:
+        os.environ["PROFILE_DIR"] = args.profile_dir
+    os.environ.pop("PROFILE_RECORD", None)
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+    random.seed(1)
+    import profiling
+
+    replay = {"firehose": replay_firehose, "athena": replay_athena, "spark": replay_spark}[args.target]
+    output = io.StringIO() if args.quiet else sys.stdout
+    with contextlib.redirect_stdout(output):
+        replay(args)
+
+    summaries = list(profiling.history)
+    if not summaries:
+        print("No invocations were profiled")
+        return
+    print_summary(summaries)
+    if args.flamegraph:
+        merge_stacks(summaries, args.flamegraph)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Pre-aggregated rollup tables for the dashboards.
+
+Besides the per-batch region aggregates, the structured engine can maintain rollups at
+several resolutions, each a separate Parquet table partitioned by year/month/day:
+
+    region_hourly   median wind/temperature/humidity, avg/max FFWI per region (grid cell) and hour
+    region_daily    the same per region and day
+    daily_summary   the same over all regions per day
+
+Each rollup is a stateful event-time aggregation (spark_windows.windowed_aggregate), so a
+row is written once, when its window is final, with one file per day partition per trigger.
+Queries that read a rollup instead of the raw output scan a few rows per region and hour.
+"""
+import argparse
+import time
+
+from athena_partitions import projection_properties
+from parquet_commit import recover, scope_for, write_batch
+from spark_transforms import write_partitioned
+from spark_windows import DEFAULT_MEDIAN_ACCURACY, DEFAULT_WATERMARK, windowed_aggregate
+
+# name -> (window duration, group columns)
+ROLLUPS = {
+    "region_hourly": ("1 hour", ("cell",)),
+    "region_daily": ("1 day", ("cell",)),
+    "daily_summary": ("1 day", ()),
+}
+
+TABLE_PREFIX = "forest_weather"
+
+
+def rollup_path(rollup_root, name):
+    return f"{rollup_root.rstrip('/')}/{name}"
+
+
+def write_rollup(batch_df, batch_id, path, name, commit_scope=None):
+    """
+    Append the rollup rows finalized in this micro-batch, one file per day partition
+    (committed idempotently with commit_scope, see parquet_commit.py).
+    """
+    start = time.perf_counter()
+    if not write_batch(batch_df, batch_id, path, write_partitioned, commit_scope):
+        print(f"Batch {batch_id}: {name} rollup already committed, skipped")
+        return
+    print(f"Batch {batch_id}: {name} rollup written in {time.perf_counter() - start:.3f}s")
+
+
+def start_rollup_streams(records, rollup_root, checkpoint_location, trigger_options, names=None,
+                         watermark=DEFAULT_WATERMARK, accuracy=DEFAULT_MEDIAN_ACCURACY, idempotent=True):
+    """
+    Start one streaming query per rollup on the transformed readings.
+
+    Each query has its own checkpoint under <checkpoint_location>/rollups/<name>; with
+    idempotent, its batches are committed under a scope derived from that checkpoint.
+
+    Returns:
+    list: the started StreamingQuery objects.
+    """
+    queries = []
+    for name in names or ROLLUPS:
+        window_duration, group_columns = ROLLUPS[name]
+        path = rollup_path(rollup_root, name)
+        rollup_checkpoint = f"{checkpoint_location.rstrip('/')}/rollups/{name}"
+        scope = scope_for(rollup_checkpoint) if idempotent else None
+        if scope:
+            recover(records.sparkSession, path, scope)
+        rollup = windowed_aggregate(records, window_duration, watermark=watermark, accuracy=accuracy,
+                                    group_columns=group_columns)
+        queries.append(
+            rollup.writeStream.outputMode("append")
+            .foreachBatch(lambda batch_df, batch_id, path=path, name=name, scope=scope:
+                          write_rollup(batch_df, batch_id, path, name, scope))
+            .queryName(f"KinesisWeatherRollup_{name}")
+            .option("checkpointLocation", rollup_checkpoint)
+            .trigger(**trigger_options)
+            .start()
+        )
+        print(f"Rollup {name} ({window_duration} windows) -> {path}")
+    return queries
+
+
+def create_table_ddl(name, location, start_year=2024, end_year=2035):
+    """
+    Athena DDL for a rollup table, with partition projection so new days need no registration.
+    """
+    location = rollup_path(location, name)
+    columns = (["cell bigint", "region string"] if ROLLUPS[name][1] else []) + [
+        "MedianWindSpeed double", "MedianTemperature double", "MedianHumidity double",
+        "AverageFFWI double", "MaxFFWI double", "RecordCount bigint",
+        "window_start timestamp", "window_end timestamp",
+    ]
+    properties = ",\n  ".join(f"'{key}' = '{value}'"
+                              for key, value in projection_properties(location, start_year, end_year).items())
+    return (
+        f"CREATE EXTERNAL TABLE IF NOT EXISTS {TABLE_PREFIX}_{name} (\n  " + ",\n  ".join(columns) + "\n)\n"
+        "PARTITIONED BY (year string, month string, day string)\n"
+        "STORED AS PARQUET\n"
+        f"LOCATION '{location}/'\n"
+        f"TBLPROPERTIES (\n  {properties}\n)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the Athena DDL of the rollup tables")
+    parser.add_argument("rollup_path", help="S3 location of the rollups (--rollup-path of the Spark job)")
+    parser.add_argument("--rollups", nargs="+", choices=list(ROLLUPS), default=list(ROLLUPS))
+    args = parser.parse_args()
+    for name in args.rollups:
+        print(create_table_ddl(name, args.rollup_path) + ";\n")
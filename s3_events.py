@@ -0,0 +1,150 @@
+"""
+Coalescing of S3 upload notifications for Lambda_PushToAthena.
+
+A Spark batch writes many Parquet part files per day partition, and each file produces an
+S3 event. The events of one invocation (several Records, optionally wrapped in SQS messages
+when the bucket notifies a queue with a batching window) are grouped by partition so each
+partition is queried once, a debouncer skips partitions queried moments ago by an earlier
+invocation, and QuickSight refreshes are rate-limited to one ingestion in flight per dataset.
+"""
+import hashlib
+import json
+import time
+import urllib.parse
+import uuid
+
+from athena_partitions import parse_partition, table_directory
+
+INGESTION_RUNNING_STATES = ('INITIALIZED', 'QUEUED', 'RUNNING')
+
+
+def s3_records(event):
+    """
+    All S3 records in an event, whether it comes straight from S3 or from SQS messages
+    carrying S3 notifications. S3 test events are skipped.
+    """
+    for record in event.get('Records', []):
+        if 's3' in record:
+            yield record
+        elif 'body' in record:
+            yield from s3_records(json.loads(record['body']))
+
+
+def group_by_partition(event):
+    """
+    Group the uploaded objects of an event by table partition.
+
+    The table is the directory above the partition path (e.g. forest_weather_data_parquet,
+    or region_daily for a rollup), so a day written to several tables gives one entry each.
+
+    Returns:
+    tuple: dict of (bucket, table directory, (year, month, day)) -> {'prefix': partition prefix,
+    'keys': [object keys], 'sequencers': [S3 event sequencer of each key, '' if absent]} in
+    first-seen order, and the list of object keys without a partition path.
+    """
+    partitions = {}
+    unmatched = []
+    for record in s3_records(event):
+        bucket = record['s3']['bucket']['name']
+        key = urllib.parse.unquote_plus(record['s3']['object']['key'])
+        try:
+            values, prefix = parse_partition(key)
+        except ValueError:
+            unmatched.append(key)
+            continue
+        files = partitions.setdefault((bucket, table_directory(prefix), values),
+                                      {'prefix': prefix, 'keys': [], 'sequencers': []})
+        files['keys'].append(key)
+        files['sequencers'].append(record['s3']['object'].get('sequencer', ''))
+    return partitions, unmatched
+
+
+def upload_marker(files):
+    """
+    Marker of the uploads of a partition in one event (a group_by_partition entry): the same
+    files give the same marker, new files or a rewritten file (new sequencer) a new one.
+    """
+    uploads = sorted(zip(files['keys'], files['sequencers']))
+    return hashlib.sha1(json.dumps(uploads).encode('utf-8')).hexdigest()
+
+
+class Debouncer:
+    """
+    Lets a key through at most once per `window` seconds.
+
+    Kept at module level in the Lambda, so it spans warm invocations of the same instance.
+    """
+
+    def __init__(self, window, clock=time.monotonic):
+        self.window = window
+        self._clock = clock
+        self._last = {}
+
+    def ready(self, key):
+        """
+        True unless the key was recorded less than `window` seconds ago.
+        """
+        last = self._last.get(key)
+        return last is None or self._clock() - last >= self.window
+
+    def record(self, key):
+        """
+        Start the window of a key. Called once its query has started, so a query that
+        could not be started is retried by the next event.
+        """
+        self._last[key] = self._clock()
+
+
+class IngestionLimiter:
+    """
+    Starts QuickSight SPICE ingestions with at most one in flight per dataset and at least
+    `min_interval` seconds between starts.
+
+    An ingestion that is still running when a new refresh is requested will not include the
+    newest data; the refresh is then reported as deferred and happens on the next request
+    after the running one completes.
+    """
+
+    def __init__(self, quicksight_client, aws_account_id, min_interval=60.0, clock=time.monotonic):
+        self.quicksight_client = quicksight_client
+        self.aws_account_id = aws_account_id
+        self.min_interval = min_interval
+        self._clock = clock
+        self._last_started = {}
+        self._in_flight = {}
+
+    def _running(self, dataset_id):
+        ingestion_id = self._in_flight.get(dataset_id)
+        if ingestion_id is None:
+            return False
+        response = self.quicksight_client.describe_ingestion(
+            AwsAccountId=self.aws_account_id, DataSetId=dataset_id, IngestionId=ingestion_id)
+        if response['Ingestion']['IngestionStatus'] in INGESTION_RUNNING_STATES:
+            return True
+        del self._in_flight[dataset_id]
+        return False
+
+    def refresh(self, dataset_id):
+        """
+        Start an ingestion unless one is running or the last one started too recently.
+
+        Returns:
+        str: The new ingestion id, or None if the refresh was deferred.
+        """
+        last = self._last_started.get(dataset_id)
+        if last is not None and self._clock() - last < self.min_interval:
+            print(f"QuickSight refresh of {dataset_id} deferred: last ingestion started {self._clock() - last:.0f}s ago")
+            return None
+        if self._running(dataset_id):
+            print(f"QuickSight refresh of {dataset_id} deferred: ingestion {self._in_flight[dataset_id]} still running")
+            return None
+        ingestion_id = str(uuid.uuid4())
+        response = self.quicksight_client.create_ingestion(
+            AwsAccountId=self.aws_account_id,
+            DataSetId=dataset_id,
+            IngestionId=ingestion_id  # Unique ID for the ingestion process
+        )
+        print("QuickSight dataset refresh started:", response)
+        self._in_flight[dataset_id] = ingestion_id
+        self._last_started[dataset_id] = self._clock()
+        return ingestion_id
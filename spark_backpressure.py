@@ -0,0 +1,157 @@
+"""
+Backpressure and adaptive batch intervals for the Spark engines (see backpressure.py).
+
+- DStream: receiver backpressure is turned on (Spark's PID rate estimator caps what the
+  receivers accept per batch from the measured processing rate), optionally with a hard
+  per-receiver max rate. The batch interval of a StreamingContext cannot change while it
+  runs, so DStreamLagListener feeds the controller for the lag gauges and logs the interval
+  it would choose.
+- Structured Streaming: QueryLagListener feeds the controller from the query progress.
+  With --trigger adaptive, run_adaptive restarts the query with the controller's
+  processing-time trigger and, for the Kinesis source, its batch size limit as a per-shard
+  fetch cap (kinesis.maxFetchRecordsPerShard), so a burst is read in micro-batches that
+  fit the latency target instead of one oversized batch. The checkpoint and the idempotent
+  commit make the restart safe, but it costs a query start, so settings that moved less
+  than the controller's deadband are not applied, and nothing is restarted while the query
+  is behind: a processing-time trigger already starts the next batch at once then. The
+  jsonl and socket sources have no per-record limit; with them the controller only paces
+  the triggers (mostly lengthening the interval under light load, for fewer and fuller
+  Parquet commits).
+"""
+from pyspark.sql.streaming import StreamingQueryListener
+
+from backpressure import BatchController
+
+ADAPTIVE_TRIGGER = "adaptive"
+
+
+def backpressure_conf(conf, max_rate=None, initial_rate=None):
+    """
+    Turn on receiver backpressure in a SparkConf (DStream engine).
+
+    max_rate and initial_rate are records/sec per receiver.
+    """
+    conf.set("spark.streaming.backpressure.enabled", "true")
+    if initial_rate:
+        conf.set("spark.streaming.backpressure.initialRate", str(int(initial_rate)))
+    if max_rate:
+        conf.set("spark.streaming.receiver.maxRate", str(int(max_rate)))
+    return conf
+
+
+def _millis(option):
+    """
+    Seconds of a Scala Option[Long] of milliseconds (0 when empty).
+    """
+    return option.get() / 1000 if option.isDefined() else 0.0
+
+
+def dstream_lag_listener(controller, batch_interval):
+    """
+    A StreamingListener reporting each DStream batch to the controller: lag is the total
+    delay (scheduling delay, i.e. time queued behind earlier batches, plus processing time).
+    """
+    # Imported here: pyspark.streaming is absent from newer Spark releases.
+    from pyspark.streaming.listener import StreamingListener
+
+    class DStreamLagListener(StreamingListener):
+        def onBatchCompleted(self, batchCompleted):
+            info = batchCompleted.batchInfo()
+            processing = _millis(info.processingDelay())
+            lag = _millis(info.totalDelay())
+            interval, _ = controller.update(info.numRecords(), processing, lag)
+            if lag > batch_interval or abs(interval - batch_interval) > batch_interval / 2:
+                print(f"Batch lag {lag:.1f}s (processing {processing:.1f}s); "
+                      f"a {interval:.1f}s batch interval would suit the current load")
+
+    return DStreamLagListener()
+
+
+class QueryLagListener(StreamingQueryListener):
+    """
+    Reports every micro-batch of a streaming query to the controller.
+
+    The query progress has no per-record arrival times, so the lag is estimated from the
+    queue the batches form: whenever a batch takes longer than the trigger interval, the
+    next one starts late by the difference (Lindley's recursion), and a batch's lag is how
+    late it started plus its duration.
+    """
+
+    def __init__(self, controller, interval, query_name=None):
+        self.controller = controller
+        self.interval = interval
+        self.query_name = query_name
+        self._wait = 0.0
+
+    def onQueryStarted(self, event):
+        self._wait = 0.0
+
+    def onQueryProgress(self, event):
+        progress = event.progress
+        if self.query_name and progress.name != self.query_name:
+            return
+        duration = progress.batchDuration / 1000
+        self.controller.update(progress.numInputRows, duration, self._wait + duration)
+        # How late the next batch starts
+        self._wait = max(0.0, self._wait + duration - self.interval)
+
+    def onQueryIdle(self, event):
+        pass
+
+    def onQueryTerminated(self, event):
+        pass
+
+
+def interval_trigger(seconds):
+    return f"{max(seconds, 0.1):.1f} seconds"
+
+
+def restart_settings(controller, interval, max_records):
+    """
+    The (interval, max_records) to restart the query with, or None to keep it running.
+
+    max_records is None when the source has no record cap to adjust.
+    """
+    if controller.behind:
+        return None
+    wanted_records = controller.max_records if max_records is not None else None
+    if controller.within_deadband(interval, controller.interval) and (
+            max_records is None or controller.within_deadband(max_records, wanted_records)):
+        return None
+    return controller.interval, wanted_records
+
+
+def run_adaptive(spark, start_query, controller=None, cap_records=False, poll_seconds=5.0):
+    """
+    Run a streaming query with a processing-time trigger chosen by the controller.
+
+    start_query(trigger, max_records) starts the query and returns it; with cap_records,
+    max_records is the controller's batch size limit for the source, otherwise None. The
+    query is restarted when restart_settings() says so. Returns when the query terminates
+    on its own (a failure raises).
+    """
+    controller = controller or BatchController(stage="spark", initial_interval=10.0)
+    interval = controller.interval
+    max_records = controller.max_records if cap_records else None
+    listener = QueryLagListener(controller, interval)
+    spark.streams.addListener(listener)
+    try:
+        while True:
+            query = start_query(interval_trigger(interval), max_records)
+            listener.query_name = query.name
+            print(f"Streaming query running with a {interval:.1f}s trigger"
+                  f"{f' and at most {max_records} records per batch' if max_records else ''}")
+            wanted = None
+            while not query.awaitTermination(poll_seconds):
+                wanted = restart_settings(controller, interval, max_records)
+                if wanted:
+                    print(f"Lag {controller.lag_seconds:.1f}s: trigger interval {interval:.1f}s -> {wanted[0]:.1f}s"
+                          f"{f', batch limit {max_records} -> {wanted[1]}' if max_records else ''}")
+                    query.stop()
+                    break
+            if wanted is None:
+                return query
+            interval, max_records = wanted
+            listener.interval = interval
+    finally:
+        spark.streams.removeListener(listener)
@@ -0,0 +1,144 @@
+import time
+import uuid
+
+from pyspark import StorageLevel
+from pyspark.sql import Observation
+from pyspark.sql.functions import count, lit
+from pyspark.sql.functions import max as max_
+
+import metrics
+import profiling
+from parquet_commit import get_committer
+from spark_transforms import aggregate_by_region, write_partitioned
+from spark_validation import rejected_records, valid_records, write_dead_letters
+
+DEFAULT_STORAGE_LEVEL = "MEMORY_AND_DISK"
+
+RECORDS_OUT = metrics.counter("weather_records_out_total", "Records passed on", stage="spark")
+BATCH_SECONDS = metrics.histogram("weather_batch_seconds", "Batch processing time", stage="spark")
+WRITE_SECONDS = metrics.histogram("weather_parquet_write_seconds", "Parquet write time", stage="spark")
+
+
+def storage_level(name):
+    """
+    Look up a pyspark StorageLevel by name (e.g. "MEMORY_AND_DISK").
+    """
+    level = getattr(StorageLevel, name, None)
+    if not isinstance(level, StorageLevel):
+        raise ValueError(f"Unknown storage level: {name}")
+    return level
+
+
+def record_metrics(stats):
+    """
+    Add a batch's stats to the metrics registry.
+    """
+    rejects = stats.get("rejects", {})
+    metrics.counter("weather_records_in_total", "Records received", stage="spark").inc(
+        stats["records"] + sum(rejects.values()))
+    RECORDS_OUT.inc(stats["records"])
+    for reason, rejected in rejects.items():
+        metrics.counter("weather_rejects_total", "Records rejected", stage="spark", reason=reason).inc(rejected)
+    BATCH_SECONDS.observe(stats["total_seconds"])
+    if "write_seconds" in stats:
+        WRITE_SECONDS.observe(stats["write_seconds"])
+
+
+def count_rejects(cached):
+    """
+    Count the valid rows and the rejects per reason code of a validated batch in one small job.
+
+    Returns:
+    tuple: (valid row count, {reason code: reject count}).
+    """
+    counts = {row["reject_reason"]: row["count"] for row in cached.groupBy("reject_reason").count().collect()}
+    return counts.pop(None, 0), counts
+
+
+def execute_batch(records, output_path, batch_id=None, verbose=False, level=DEFAULT_STORAGE_LEVEL,
+                  dead_letter_path=None, dead_letter_format="jsonl", commit_scope=None):
+    """
+    Aggregate one batch of transformed readings and write it in a single Spark job.
+
+    The readings are persisted so the parse/validate/FFWI work runs once even when the
+    verbose debug output adds actions, and unpersisted after the write. Counts come
+    from Observation metrics collected during the write instead of extra count() jobs.
+
+    When the readings carry a reject_reason column (transform_records(keep_rejects=True)),
+    rejects are counted per reason code, appended to dead_letter_path if given, and left
+    out of the aggregation.
+
+    With commit_scope the batch is committed idempotently under its batch id (see
+    parquet_commit.py): a batch id that is already committed is skipped without any Spark work.
+
+    Returns:
+    dict: record/region/reject counts and timings for the batch.
+    """
+    start = time.perf_counter()
+    batch_id = batch_id if batch_id is not None else uuid.uuid4().hex[:8]
+    committer = get_committer(records.sparkSession, output_path, commit_scope) if commit_scope else None
+    if committer and committer.is_committed(batch_id):
+        # A replay of a batch that already reached the table
+        print(f"Batch {batch_id}: already committed, skipped")
+        metrics.counter("weather_batches_skipped_total", "Replayed batches skipped as already committed",
+                        stage="spark").inc()
+        return {"batch_id": batch_id, "skipped": True, "total_seconds": time.perf_counter() - start}
+
+    cached = records.persist(storage_level(level))
+    try:
+        validated = "reject_reason" in cached.columns
+        if validated:
+            # One pass over the cached batch gives the reject counters and whether anything is valid
+            with profiling.phase("compute"):
+                valid_count, rejects = count_rejects(cached)
+            stats = {"batch_id": batch_id, "rejected": sum(rejects.values()), "rejects": rejects}
+            if rejects:
+                print(f"Batch {batch_id}: rejected {stats['rejected']} records: "
+                      + ", ".join(f"{reason}={n}" for reason, n in sorted(rejects.items())))
+                if dead_letter_path:
+                    with profiling.phase("dead_letters"):
+                        write_dead_letters(rejected_records(cached), dead_letter_path, batch_id, dead_letter_format)
+            has_records = valid_count > 0
+            valid = valid_records(cached)
+        else:
+            # A limit(1) scan that fills the cache instead of recomputing the batch.
+            stats = {"batch_id": batch_id}
+            with profiling.phase("compute"):
+                has_records = not cached.isEmpty()
+            valid = cached
+        # Empty batches are kept away from the observations: AQE prunes an empty aggregate
+        # and its metrics would never arrive.
+        if not has_records:
+            stats.update(records=0, regions=0, total_seconds=time.perf_counter() - start)
+            record_metrics(stats)
+            return stats
+
+        # Named observations: metrics are attached to the write's query execution.
+        record_stats = Observation(f"records_{batch_id}")
+        region_stats = Observation(f"regions_{batch_id}")
+        observed = valid.observe(record_stats, count(lit(1)).alias("records"), max_("ffwi").alias("max_ffwi"))
+        aggregated = aggregate_by_region(observed).observe(region_stats, count(lit(1)).alias("regions"))
+
+        write_start = time.perf_counter()
+        with profiling.phase("write"):
+            if committer:
+                committer.commit(aggregated, batch_id, write_partitioned,
+                                 info=lambda: {**record_stats.get, **region_stats.get})
+            else:
+                write_partitioned(aggregated, output_path)
+        write_seconds = time.perf_counter() - write_start
+
+        stats.update(record_stats.get)
+        stats.update(region_stats.get)
+        if verbose:
+            aggregated.printSchema()
+            aggregated.show(truncate=False)
+    finally:
+        cached.unpersist()
+
+    stats["write_seconds"] = write_seconds
+    stats["total_seconds"] = time.perf_counter() - start
+    print(f"Batch {batch_id}: {stats['records']} records, {stats['regions']} regions, "
+          f"write {write_seconds:.3f}s, total {stats['total_seconds']:.3f}s")
+    record_metrics(stats)
+    return stats
@@ -0,0 +1,80 @@
+from pyspark.sql.functions import col, lit, pandas_udf, sqrt, udf, when
+from pyspark.sql.types import DoubleType
+
+from ffwi import calculate_ffwi, calculate_ffwi_batch
+
+# Available FFWI implementations for the Spark job:
+#   udf    - row-at-a-time Python UDF (every row is pickled to a Python worker)
+#   pandas - Arrow-backed pandas_udf running the vectorized NumPy kernel per batch
+#   native - pure Catalyst column expression, no Python round trip
+FFWI_MODES = ("udf", "pandas", "native")
+DEFAULT_FFWI_MODE = "native"
+
+_pandas_ffwi_udf = None
+
+
+def ffwi_python_udf(temperature, humidity, wind_speed):
+    """
+    Row-at-a-time Python UDF column for FFWI.
+    """
+    return udf(calculate_ffwi, DoubleType())(temperature, humidity, wind_speed)
+
+
+def ffwi_pandas_udf(temperature, humidity, wind_speed):
+    """
+    Arrow-backed pandas UDF column for FFWI, evaluated one Arrow batch at a time.
+    """
+    global _pandas_ffwi_udf
+    if _pandas_ffwi_udf is None:
+        # Defined lazily so the module imports on clusters without pandas/pyarrow.
+        import pandas as pd
+
+        @pandas_udf(DoubleType())
+        def _ffwi(t: pd.Series, h: pd.Series, w: pd.Series) -> pd.Series:
+            # NaN results are turned into nulls by the Arrow serializer.
+            return pd.Series(calculate_ffwi_batch(t.astype("float64"), h.astype("float64"), w.astype("float64")))
+
+        _pandas_ffwi_udf = _ffwi
+    return _pandas_ffwi_udf(temperature, humidity, wind_speed)
+
+
+def ffwi_native_column(temperature, humidity, wind_speed):
+    """
+    FFWI as a native Spark column expression.
+
+    Mirrors ffwi.calculate_ffwi branch for branch, so Catalyst can fuse it into
+    whole-stage codegen. Readings the scalar version rejects come back as null.
+    """
+    t, h, w = temperature, humidity, wind_speed
+    dry = lit(100.0) - h
+    denominator = dry + t
+
+    F = when(h < 100, lit(1.0) - (lit(2.0) * dry / denominator)).otherwise(lit(0.0))
+    F = when(F < 0, lit(0.0)).otherwise(F)
+    ffwi = ((lit(1.0) + w) / lit(0.3002)) * sqrt(F)
+    ffwi = when(ffwi > 100, lit(100.0)).otherwise(ffwi)
+    ffwi = when(ffwi > 0, ffwi).otherwise(lit(0.0))
+
+    invalid = h.isNull() | w.isNull() | ((h < 100) & (t.isNull() | (denominator == 0)))
+    return when(invalid, lit(None).cast(DoubleType())).otherwise(ffwi)
+
+
+def ffwi_column(mode=DEFAULT_FFWI_MODE, temperature="temperature", humidity="humidity", wind_speed="windSpeed"):
+    """
+    Build the FFWI column for the selected implementation.
+    """
+    t, h, w = col(temperature), col(humidity), col(wind_speed)
+    if mode == "udf":
+        return ffwi_python_udf(t, h, w)
+    if mode == "pandas":
+        return ffwi_pandas_udf(t, h, w)
+    if mode == "native":
+        return ffwi_native_column(t, h, w)
+    raise ValueError(f"Unknown FFWI mode: {mode} (expected one of {', '.join(FFWI_MODES)})")
+
+
+def with_ffwi(df, mode=DEFAULT_FFWI_MODE):
+    """
+    Add the calculated FFWI column to a DataFrame of weather readings.
+    """
+    return df.withColumn("ffwi", ffwi_column(mode))
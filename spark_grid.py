@@ -0,0 +1,56 @@
+"""
+Spatial grid cell IDs as Spark column expressions (same arithmetic as spatial_grid.py).
+"""
+from pyspark.sql.functions import col, floor, format_string, greatest, least, lit, pow, shiftleft, shiftright
+
+from spatial_grid import (COMPACT_STEPS, DEFAULT_RESOLUTION, MORTON_MASK, RESOLUTION_SHIFT, SPREAD_STEPS,
+                          check_resolution)
+
+
+def _spread_column(column):
+    for shift, mask in SPREAD_STEPS:
+        column = column.bitwiseOR(shiftleft(column, shift)).bitwiseAND(lit(mask))
+    return column
+
+
+def _compact_column(column):
+    column = column.bitwiseAND(lit(SPREAD_STEPS[-1][1]))
+    for shift, mask in COMPACT_STEPS:
+        column = column.bitwiseOR(shiftright(column, shift)).bitwiseAND(lit(mask))
+    return column
+
+
+def cell_id_column(latitude="latitude", longitude="longitude", resolution=DEFAULT_RESOLUTION):
+    """
+    Column expression with the cell ID of each row.
+    """
+    check_resolution(resolution)
+    cells = 1 << resolution
+    lat_index = greatest(least(floor((col(latitude) + 90.0) / 360.0 * cells), lit(cells // 2 - 1)), lit(0)).cast("long")
+    lon_index = greatest(least(floor((col(longitude) + 180.0) / 360.0 * cells), lit(cells - 1)), lit(0)).cast("long")
+    return (
+        lit(resolution << RESOLUTION_SHIFT).cast("long")
+        .bitwiseOR(_spread_column(lon_index))
+        .bitwiseOR(shiftleft(_spread_column(lat_index), 1))
+    )
+
+
+def cell_center_columns(cell="cell"):
+    """
+    Column expressions with the latitude and longitude of the cell centers.
+    """
+    morton = col(cell).bitwiseAND(lit(MORTON_MASK))
+    size = lit(360.0) / pow(lit(2.0), shiftright(col(cell), RESOLUTION_SHIFT))
+    return (
+        (_compact_column(shiftright(morton, 1)) + 0.5) * size - 90.0,
+        (_compact_column(morton) + 0.5) * size - 180.0,
+    )
+
+
+def with_region_label(df, cell="cell"):
+    """
+    Add the human-readable "region" label ("<lat>_<lon>" of the cell center). Meant to run
+    after aggregating by cell, so the string is built once per group instead of per row.
+    """
+    latitude, longitude = cell_center_columns(cell)
+    return df.withColumn("region", format_string("%.3f_%.3f", latitude, longitude))
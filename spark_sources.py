@@ -0,0 +1,62 @@
+from pyspark.sql.functions import col
+
+# Structured Streaming sources. Each one returns a streaming DataFrame with a
+# single string column "value" holding one JSON reading per row.
+SOURCES = ("kinesis", "jsonl", "socket")
+
+
+def kinesis_source(spark, stream_name, region, endpoint_url, starting_position="TRIM_HORIZON",
+                   max_records_per_shard=None):
+    """
+    Read the Kinesis Data Stream (needs the spark-sql-kinesis-connector on the classpath, as on EMR).
+
+    max_records_per_shard caps what a micro-batch reads from each shard; the rest waits for
+    the next micro-batch instead of making this one oversized.
+    """
+    reader = (
+        spark.readStream.format("aws-kinesis")
+        .option("kinesis.streamName", stream_name)
+        .option("kinesis.region", region)
+        .option("kinesis.endpointUrl", endpoint_url)
+        .option("kinesis.startingposition", starting_position)
+    )
+    if max_records_per_shard:
+        reader = reader.option("kinesis.maxFetchRecordsPerShard", int(max_records_per_shard))
+    return reader.load().select(col("data").cast("string").alias("value"))
+
+
+def jsonl_source(spark, input_path, max_files_per_trigger=None):
+    """
+    Read a directory of JSONL files (e.g. the logs written by kinesisagent_simdata_gen.py) for local runs.
+    Only files that appear in the directory after they are complete are picked up.
+    """
+    reader = spark.readStream.format("text")
+    if max_files_per_trigger:
+        reader = reader.option("maxFilesPerTrigger", max_files_per_trigger)
+    return reader.load(input_path)
+
+
+def socket_source(spark, host, port):
+    """
+    Read newline-delimited JSON from a TCP socket (testing only, not fault tolerant).
+    """
+    return spark.readStream.format("socket").option("host", host).option("port", port).load()
+
+
+def build_source(spark, args, max_records_per_shard=None):
+    """
+    Create the streaming source selected on the command line.
+
+    max_records_per_shard overrides --max-records-per-shard (kinesis only: the other sources
+    have no per-record limit).
+    """
+    if args.source == "kinesis":
+        return kinesis_source(spark, args.stream_name, args.region, args.endpoint_url,
+                              max_records_per_shard=max_records_per_shard or args.max_records_per_shard)
+    if args.source == "jsonl":
+        if not args.input_path:
+            raise ValueError("--input-path is required for the jsonl source")
+        return jsonl_source(spark, args.input_path, args.max_files_per_trigger)
+    if args.source == "socket":
+        return socket_source(spark, args.host, args.port)
+    raise ValueError(f"Unknown source: {args.source} (expected one of {', '.join(SOURCES)})")
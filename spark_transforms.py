@@ -0,0 +1,116 @@
+from pyspark.sql.functions import base64, coalesce, col, dayofmonth, expr, from_json, month, struct, to_timestamp, when, year
+from pyspark.sql.types import DoubleType, StringType, StructField, StructType
+
+from spark_ffwi import DEFAULT_FFWI_MODE, with_ffwi
+from spark_grid import cell_id_column, with_region_label
+from spark_validation import valid_records, with_reject_reason
+from spark_wire import BINARY_TEXT_PREFIX, DEFAULT_WIRE_FORMAT, binary_reading_column
+from spatial_grid import DEFAULT_RESOLUTION
+
+# Schema of a sensor reading as produced by the simulators
+RECORD_SCHEMA = StructType([
+    StructField("timestamp", StringType(), True),
+    StructField("latitude", DoubleType(), True),
+    StructField("longitude", DoubleType(), True),
+    StructField("temperature", DoubleType(), True),
+    StructField("humidity", DoubleType(), True),
+    StructField("windSpeed", DoubleType(), True)
+])
+
+# Kinesis Agent log lines wrap the reading in a {"Data": "<json>", "PartitionKey": ...} envelope
+ENVELOPE_SCHEMA = StructType([
+    StructField("Data", StringType(), True),
+    StructField("PartitionKey", StringType(), True)
+])
+
+PARTITION_COLUMNS = ["year", "month", "day"]
+DEFAULT_MAX_RECORDS_PER_FILE = 1_000_000
+
+
+def parse_records(df, column="value", wire_format=DEFAULT_WIRE_FORMAT):
+    """
+    Parse a column of JSON strings into reading columns with from_json.
+    Both bare readings and Kinesis Agent envelopes are accepted. The payload is kept in a
+    "raw" column for the dead-letter sink (see spark_validation.py).
+
+    With wire_format "auto", records in the binary wire format (raw or base64, see
+    wire_format.py) are detected per row and decoded too; their raw payload is kept as base64.
+    """
+    raw = col(column).cast("string")
+    payload = coalesce(from_json(raw, ENVELOPE_SCHEMA).getField("Data"), raw)
+    record = from_json(payload, RECORD_SCHEMA)
+    if wire_format == "auto":
+        binary = binary_reading_column(col(column), RECORD_SCHEMA)
+        record = when(binary.getField("binary"),
+                      struct(*[binary.getField(field.name).alias(field.name) for field in RECORD_SCHEMA.fields])
+                      ).otherwise(record)
+        # Raw binary records are kept as base64, base64 lines as they are
+        payload = when(binary.getField("binary") & ~raw.startswith(BINARY_TEXT_PREFIX),
+                       base64(col(column).cast("binary"))).otherwise(payload)
+    elif wire_format != "json":
+        raise ValueError(f"Unknown wire format: {wire_format} (expected json or auto)")
+    return df.select(record.alias("record"), payload.alias("raw")).select("record.*", "raw")
+
+
+def add_region(df, resolution=DEFAULT_RESOLUTION):
+    """
+    Map: Add the spatial grid cell of each reading (see spatial_grid.py), used to group data by region.
+    """
+    return df.withColumn("cell", cell_id_column("latitude", "longitude", resolution))
+
+
+def add_partition_columns(df, timestamp_column="timestamp"):
+    """
+    Derive the year/month/day partition columns from a reading's timestamp.
+    """
+    ts = to_timestamp(col(timestamp_column))
+    return df.withColumn("year", year(ts)).withColumn("month", month(ts)).withColumn("day", dayofmonth(ts))
+
+
+def aggregate_by_region(df):
+    """
+    Reduce: Median weather and average FFWI per region (grid cell) and day.
+    The region label is derived from the cell after aggregating.
+    """
+    return with_region_label(
+        add_partition_columns(df)
+        .groupBy("cell", *PARTITION_COLUMNS)
+        .agg(
+            expr("percentile_approx(windSpeed, 0.5)").alias("MedianWindSpeed"),
+            expr("percentile_approx(temperature, 0.5)").alias("MedianTemperature"),
+            expr("percentile_approx(humidity, 0.5)").alias("MedianHumidity"),
+            expr("avg(ffwi)").alias("AverageFFWI")
+        )
+    )
+
+
+def transform_records(df, ffwi_mode=DEFAULT_FFWI_MODE, resolution=DEFAULT_RESOLUTION, keep_rejects=False):
+    """
+    Validate parsed readings and add FFWI and grid cell columns.
+
+    By default only valid readings are returned. With keep_rejects every row is kept with its
+    reject_reason and raw payload, for execute_batch to split off and dead-letter the rejects.
+    """
+    df = with_reject_reason(df)
+    if not keep_rejects:
+        df = valid_records(df)
+    return add_region(with_ffwi(df, ffwi_mode), resolution)
+
+
+def write_partitioned(df, output_path, mode="append", sort_columns=("cell",), max_records_per_file=DEFAULT_MAX_RECORDS_PER_FILE):
+    """
+    Write DataFrame as Parquet with year/month/day partitioning.
+
+    Rows are shuffled by the partition columns so each write adds one file per day partition
+    (split at max_records_per_file) instead of one per task, and sorted by grid cell inside the
+    file so Parquet row-group min/max statistics let spatial filters skip row groups.
+    """
+    sort_columns = [name for name in sort_columns if name in df.columns]
+    (
+        df.repartition(*PARTITION_COLUMNS)
+        .sortWithinPartitions(*PARTITION_COLUMNS, *sort_columns)
+        .write.mode(mode)
+        .option("maxRecordsPerFile", max_records_per_file)
+        .partitionBy(*PARTITION_COLUMNS)
+        .parquet(output_path)
+    )
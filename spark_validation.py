@@ -0,0 +1,97 @@
+"""
+Validation of parsed readings as column expressions.
+
+Every row gets a reject_reason: null for a valid reading, otherwise the code of the first
+check it fails. The checks compile into one CASE WHEN expression evaluated by Spark, so
+valid rows continue without any per-row Python work, and rejects are written to a
+dead-letter sink with their raw payload instead of being dropped silently.
+"""
+from pyspark.sql.functions import col, current_timestamp, lit, to_timestamp, when
+
+# Valid ranges, same as the former filter_extremes
+LIMITS = {
+    "temperature": (-80, 80),
+    "humidity": (0, 100),
+    "windSpeed": (0, 50),
+}
+READING_FIELDS = ("timestamp", "latitude", "longitude", "temperature", "humidity", "windSpeed")
+
+# Checks run in this order; a row is tagged with the first one it fails
+REASON_CODES = (
+    "malformed_json",
+    "missing_timestamp",
+    "invalid_timestamp",
+    "missing_location",
+) + tuple(code for field in LIMITS for code in (f"missing_{field}", f"{field}_out_of_range"))
+
+DEAD_LETTER_FORMATS = ("jsonl", "parquet")
+
+
+def reject_checks():
+    """
+    (reason code, predicate) pairs in REASON_CODES order.
+    """
+    malformed = None
+    for field in READING_FIELDS:
+        malformed = col(field).isNull() if malformed is None else malformed & col(field).isNull()
+    checks = [
+        ("malformed_json", malformed),
+        ("missing_timestamp", col("timestamp").isNull()),
+        ("invalid_timestamp", to_timestamp(col("timestamp")).isNull()),
+        ("missing_location", col("latitude").isNull() | col("longitude").isNull()),
+    ]
+    for field, (low, high) in LIMITS.items():
+        checks.append((f"missing_{field}", col(field).isNull()))
+        checks.append((f"{field}_out_of_range", ~col(field).between(low, high)))
+    return checks
+
+
+def reject_reason_column():
+    """
+    Reason code of the first failed check, or null for a valid reading.
+    """
+    reason = None
+    for code, predicate in reject_checks():
+        reason = when(predicate, lit(code)) if reason is None else reason.when(predicate, lit(code))
+    return reason
+
+
+def with_reject_reason(df):
+    """
+    Add the reject_reason column. The raw payload is only kept on rejected rows.
+    """
+    return (
+        df.withColumn("reject_reason", reject_reason_column())
+        .withColumn("raw", when(col("reject_reason").isNotNull(), col("raw")))
+    )
+
+
+def valid_records(df):
+    """
+    Valid rows, without the validation columns.
+    """
+    return df.filter(col("reject_reason").isNull()).drop("reject_reason", "raw")
+
+
+def rejected_records(df):
+    return df.filter(col("reject_reason").isNotNull())
+
+
+def write_dead_letters(rejects, path, batch_id, fmt="jsonl"):
+    """
+    Append rejected rows (raw payload, reason code, batch id and rejection time) to the
+    dead-letter sink, partitioned by reason code.
+    """
+    if fmt not in DEAD_LETTER_FORMATS:
+        raise ValueError(f"Unknown dead-letter format: {fmt} (expected one of {', '.join(DEAD_LETTER_FORMATS)})")
+    writer = (
+        rejects.select("raw", "reject_reason", lit(str(batch_id)).alias("batch_id"),
+                       current_timestamp().alias("rejected_at"))
+        .coalesce(1)
+        .write.mode("append")
+        .partitionBy("reject_reason")
+    )
+    if fmt == "parquet":
+        writer.parquet(path)
+    else:
+        writer.json(path)
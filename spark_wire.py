@@ -0,0 +1,106 @@
+"""
+Decoding of binary wire-format readings (see wire_format.py) in the Spark ETL.
+
+Binary records are unpacked by an Arrow pandas UDF without a Python loop over the rows:
+the values' lengths and first bytes come from the Arrow offsets and data buffers, raw
+records are read with one np.frombuffer and base64 ones are decoded in one call per
+batch. Only rows that start like a record without its exact size or encoding (e.g. base64
+with surrounding whitespace) are checked one by one. It is only used with --wire-format
+auto; JSON-only streams keep the pure Catalyst from_json path without the Python round trip.
+"""
+from pyspark.sql.functions import pandas_udf
+from pyspark.sql.types import BooleanType, StructField, StructType
+
+WIRE_FORMATS = ("json", "auto")
+DEFAULT_WIRE_FORMAT = "json"
+# First character of a base64-encoded binary record
+BINARY_TEXT_PREFIX = "w"
+
+_decode_udf = None
+
+
+def binary_records(values):
+    """
+    Find and unpack the binary records in a Series of bytes values.
+
+    Returns:
+    tuple: (bool array, True for the rows holding a record of the current SCHEMA_ID;
+    RECORD_DTYPE array of those records in row order).
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    import wire_format
+
+    array = pa.array(values, type=pa.binary())
+    offsets = np.frombuffer(array.buffers()[1], dtype=np.int32)[:len(array) + 1]
+    data = np.frombuffer(array.buffers()[2] or b"", dtype=np.uint8)
+    starts, lengths = offsets[:-1], np.diff(offsets)
+    first = np.zeros(len(array), dtype=np.uint8)
+    first[lengths > 0] = data[starts[lengths > 0]]
+    raw = (lengths == wire_format.RECORD_SIZE) & (first == wire_format.MAGIC)
+    text = (lengths == wire_format.TEXT_SIZE) & (first == ord(BINARY_TEXT_PREFIX))
+
+    def packed(mask):
+        # The selected values back to back (a filtered array's data starts at its first offset)
+        selected = pc.filter(array, pa.array(mask))
+        bounds = np.frombuffer(selected.buffers()[1], dtype=np.int32)[[0, len(selected)]]
+        return selected.buffers()[2].to_pybytes()[bounds[0]:bounds[1]]
+
+    records = np.zeros(len(array), dtype=wire_format.RECORD_DTYPE)
+    if raw.any():
+        records[raw] = np.frombuffer(packed(raw), dtype=wire_format.RECORD_DTYPE)
+    if text.any():
+        valid, decoded = wire_format.decode_text_buffer(packed(text))
+        text[text] = valid
+        records[text] = np.frombuffer(decoded, dtype=wire_format.RECORD_DTYPE)
+    # A record of an unknown schema id is not decoded: its row takes the JSON path and is
+    # rejected there, instead of failing the whole batch in batch_columns
+    found = (raw | text) & (records["magic"] == wire_format.MAGIC) & (records["schema"] == wire_format.SCHEMA_ID)
+    # Rows that start like a record without its exact size or encoding
+    for row in np.flatnonzero(~found & ((first == wire_format.MAGIC) | (first == ord(BINARY_TEXT_PREFIX)))).tolist():
+        record = wire_format.binary_record(bytes(values.iloc[row]))
+        if record is not None and len(record) == wire_format.RECORD_SIZE and record[1] == wire_format.SCHEMA_ID:
+            records[row] = np.frombuffer(record, dtype=wire_format.RECORD_DTYPE)[0]
+            found[row] = True
+    return found, records[found]
+
+
+def _udf(record_schema):
+    global _decode_udf
+    if _decode_udf is None:
+        # Defined lazily so the module imports on clusters without pandas/pyarrow.
+        import numpy as np
+        import pandas as pd
+
+        import wire_format
+
+        fields = [field.name for field in record_schema.fields]
+        schema = StructType(record_schema.fields + [StructField("binary", BooleanType(), True)])
+
+        @pandas_udf(schema)
+        def _decode(values: pd.Series) -> pd.DataFrame:
+            binary, records = binary_records(values)
+            # NaN is turned into null by the Arrow serializer
+            result = pd.DataFrame({field: np.full(len(values), np.nan) for field in fields if field != "timestamp"})
+            result.insert(0, "timestamp", pd.Series([None] * len(values), dtype=object))
+            if binary.any():
+                columns = wire_format.batch_columns(records)
+                result.loc[binary, "timestamp"] = pd.Series(columns["timestamp"], dtype=object).to_numpy()
+                for field in fields:
+                    if field != "timestamp":
+                        result.loc[binary, field] = columns[field]
+            result["binary"] = binary
+            return result[fields + ["binary"]]
+
+        _decode_udf = _decode
+    return _decode_udf
+
+
+def binary_reading_column(column, record_schema):
+    """
+    Struct column of decoded binary readings plus a "binary" flag (false, with null fields,
+    for rows that are not in the binary format).
+    """
+    return _udf(record_schema)(column.cast("binary"))
@@ -0,0 +1,177 @@
+"""
+Spatial grid of integer cell IDs for the station readings.
+
+The world is divided into square cells of 360 / 2**resolution degrees (resolution 12 is
+about 0.088 degrees, close to the former 0.1-degree rounded regions). A cell ID packs the
+resolution into the top bits and the Morton (Z-order) interleave of the latitude and
+longitude cell indexes into the rest, so:
+
+- IDs are plain longs, computed per row with a few shifts and masks (NumPy arrays here,
+  Spark column expressions in spark_grid.py), instead of a string built per row;
+- nearby cells have nearby IDs, so sorting by cell clusters data spatially and a bounding
+  box maps to an ID range that Parquet min/max statistics can prune on;
+- the parent cell at the next coarser resolution is the ID shifted right by two bits, and
+  neighbors are found by stepping the decoded indexes.
+
+A reading without finite coordinates (NaN marks a missing value) has no cell: its ID is
+INVALID_CELL, which is negative so no real cell ID can collide with it, and which the
+other functions pass through (NaN centers, an INVALID_CELL parent, no neighbors).
+"""
+import numpy as np
+
+DEFAULT_RESOLUTION = 12
+# Resolution 1 has two cells: the western and eastern hemispheres
+MIN_RESOLUTION = 1
+MAX_RESOLUTION = 26
+RESOLUTION_SHIFT = 56
+MORTON_MASK = (1 << RESOLUTION_SHIFT) - 1
+INVALID_CELL = -1
+
+# (shift, mask) steps spreading a 32-bit integer to the even bits of a 64-bit one
+SPREAD_STEPS = (
+    (16, 0x0000FFFF0000FFFF),
+    (8, 0x00FF00FF00FF00FF),
+    (4, 0x0F0F0F0F0F0F0F0F),
+    (2, 0x3333333333333333),
+    (1, 0x5555555555555555),
+)
+# (shift, mask) steps gathering the even bits back
+COMPACT_STEPS = (
+    (1, 0x3333333333333333),
+    (2, 0x0F0F0F0F0F0F0F0F),
+    (4, 0x00FF00FF00FF00FF),
+    (8, 0x0000FFFF0000FFFF),
+    (16, 0x00000000FFFFFFFF),
+)
+
+
+def cell_size(resolution):
+    """
+    Edge length of a cell in degrees.
+    """
+    return 360.0 / (1 << resolution)
+
+
+def check_resolution(resolution):
+    if not MIN_RESOLUTION <= resolution <= MAX_RESOLUTION:
+        raise ValueError(f"Resolution must be between {MIN_RESOLUTION} and {MAX_RESOLUTION}")
+
+
+def _spread(x):
+    for shift, mask in SPREAD_STEPS:
+        x = (x | (x << shift)) & mask
+    return x
+
+
+def _compact(x):
+    x = x & SPREAD_STEPS[-1][1]
+    for shift, mask in COMPACT_STEPS:
+        x = (x | (x >> shift)) & mask
+    return x
+
+
+def _encode(lat_index, lon_index, resolution):
+    return (np.int64(resolution) << RESOLUTION_SHIFT) | _spread(lon_index) | (_spread(lat_index) << 1)
+
+
+def cell_ids(latitude, longitude, resolution=DEFAULT_RESOLUTION):
+    """
+    Cell IDs of NumPy arrays (or scalars) of coordinates; INVALID_CELL where a coordinate
+    is not finite.
+    """
+    check_resolution(resolution)
+    cells = 1 << resolution
+    latitude, longitude = np.broadcast_arrays(np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float))
+    invalid = ~(np.isfinite(latitude) & np.isfinite(longitude))
+    # Masked before the integer cast, which would warn and give an arbitrary index
+    latitude, longitude = np.where(invalid, 0.0, latitude), np.where(invalid, 0.0, longitude)
+    lat_index = np.clip(np.floor((latitude + 90.0) / 360.0 * cells), 0, cells // 2 - 1)
+    lon_index = np.clip(np.floor((longitude + 180.0) / 360.0 * cells), 0, cells - 1)
+    ids = _encode(lat_index.astype(np.int64), lon_index.astype(np.int64), resolution)
+    # [()] keeps scalars scalar
+    return np.where(invalid, np.int64(INVALID_CELL), ids)[()]
+
+
+def decode(cell):
+    """
+    Resolution and latitude/longitude cell indexes of a cell ID (or array of IDs).
+    """
+    cell = np.asarray(cell, dtype=np.int64)
+    morton = cell & MORTON_MASK
+    return cell >> RESOLUTION_SHIFT, _compact(morton >> 1), _compact(morton)
+
+
+def cell_center(cell):
+    """
+    (latitude, longitude) of the center of a cell.
+    """
+    invalid = np.asarray(cell, dtype=np.int64) < 0
+    resolution, lat_index, lon_index = decode(np.where(invalid, 0, cell))
+    size = 360.0 / (np.int64(1) << resolution)
+    return (np.where(invalid, np.nan, (lat_index + 0.5) * size - 90.0)[()],
+            np.where(invalid, np.nan, (lon_index + 0.5) * size - 180.0)[()])
+
+
+def parent(cell, resolution=None):
+    """
+    Enclosing cell at a coarser resolution (default: one level up).
+    """
+    cell = np.asarray(cell, dtype=np.int64)
+    invalid = cell < 0
+    cell_resolution, _, _ = decode(cell)
+    resolution = cell_resolution - 1 if resolution is None else resolution
+    resolution = np.where(invalid, MIN_RESOLUTION, resolution)
+    cell_resolution = np.where(invalid, MIN_RESOLUTION, cell_resolution)
+    if np.any(resolution < MIN_RESOLUTION) or np.any(resolution > cell_resolution):
+        raise ValueError(f"Parent resolution must be between {MIN_RESOLUTION} and the cell's resolution")
+    levels = cell_resolution - resolution
+    parents = (resolution.astype(np.int64) << RESOLUTION_SHIFT) | ((cell & MORTON_MASK) >> (2 * levels))
+    return np.where(invalid, np.int64(INVALID_CELL), parents)[()]
+
+
+def neighbors(cell):
+    """
+    IDs of the up to 8 cells around a cell (longitude wraps around, latitude stops at the poles).
+    """
+    if int(cell) < 0:
+        return []
+    resolution, lat_index, lon_index = (int(value) for value in decode(cell))
+    cells = 1 << resolution
+    result = []
+    for d_lat in (-1, 0, 1):
+        for d_lon in (-1, 0, 1):
+            lat = lat_index + d_lat
+            if (d_lat, d_lon) == (0, 0) or not 0 <= lat < cells // 2:
+                continue
+            cell_id = int(_encode(np.int64(lat), np.int64((lon_index + d_lon) % cells), resolution))
+            if cell_id not in result:
+                result.append(cell_id)
+    return result
+
+
+def _check_bbox(*bounds):
+    if not np.all(np.isfinite(bounds)):
+        raise ValueError("Bounding box coordinates must be finite")
+
+
+def bbox_cell_range(min_lat, min_lon, max_lat, max_lon, resolution=DEFAULT_RESOLUTION):
+    """
+    Smallest and largest cell ID inside a bounding box. Every cell of the box lies in this
+    range (the Morton order grows with both indexes), so `cell BETWEEN lo AND hi` is a
+    cheap pre-filter that file and row-group statistics can prune on.
+    """
+    _check_bbox(min_lat, min_lon, max_lat, max_lon)
+    lo = int(cell_ids(min_lat, min_lon, resolution))
+    hi = int(cell_ids(max_lat, max_lon, resolution))
+    return lo, hi
+
+
+def bbox_cells(min_lat, min_lon, max_lat, max_lon, resolution=DEFAULT_RESOLUTION):
+    """
+    All cell IDs covering a bounding box, for exact `cell IN (...)` filters.
+    """
+    _check_bbox(min_lat, min_lon, max_lat, max_lon)
+    _, lat_lo, lon_lo = decode(cell_ids(min_lat, min_lon, resolution))
+    _, lat_hi, lon_hi = decode(cell_ids(max_lat, max_lon, resolution))
+    lat_index, lon_index = np.meshgrid(np.arange(lat_lo, lat_hi + 1), np.arange(lon_lo, lon_hi + 1))
+    return sorted(_encode(lat_index.ravel(), lon_index.ravel(), resolution).tolist())
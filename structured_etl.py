@@ -0,0 +1,74 @@
+from parquet_commit import recover, scope_for
+from spark_batch import DEFAULT_STORAGE_LEVEL, execute_batch
+from spark_ffwi import DEFAULT_FFWI_MODE
+from spark_transforms import parse_records, transform_records
+from spark_wire import DEFAULT_WIRE_FORMAT
+from spark_windows import DEFAULT_MEDIAN_ACCURACY, DEFAULT_WATERMARK, windowed_aggregate, write_windows
+from spatial_grid import DEFAULT_RESOLUTION
+
+DEFAULT_TRIGGER = "10 seconds"
+COMMIT_MODES = ("idempotent", "append")
+
+
+def trigger_options(trigger):
+    """
+    Translate the --trigger value into DataStreamWriter.trigger() keyword arguments.
+    Accepts a processing-time interval ("10 seconds"), "once" or "available-now".
+    """
+    if trigger == "once":
+        return {"once": True}
+    if trigger == "available-now":
+        return {"availableNow": True}
+    return {"processingTime": trigger}
+
+
+def write_batch(batch_df, batch_id, output_path, verbose=False, level=DEFAULT_STORAGE_LEVEL,
+                dead_letter_path=None, dead_letter_format="jsonl", commit_scope=None):
+    """
+    Aggregate one micro-batch by region and append it to the partitioned Parquet output.
+    """
+    return execute_batch(batch_df, output_path, batch_id=batch_id, verbose=verbose, level=level,
+                         dead_letter_path=dead_letter_path, dead_letter_format=dead_letter_format,
+                         commit_scope=commit_scope)
+
+
+def start_structured_stream(source_df, output_path, checkpoint_location,
+                            trigger=DEFAULT_TRIGGER, ffwi_mode=DEFAULT_FFWI_MODE,
+                            verbose=False, level=DEFAULT_STORAGE_LEVEL,
+                            window_duration=None, slide_duration=None, watermark=DEFAULT_WATERMARK,
+                            median_accuracy=DEFAULT_MEDIAN_ACCURACY, resolution=DEFAULT_RESOLUTION,
+                            dead_letter_path=None, dead_letter_format="jsonl", wire_format=DEFAULT_WIRE_FORMAT,
+                            commit_mode="idempotent"):
+    """
+    Start the Structured Streaming version of the ETL on a source DataFrame with a JSON "value" column.
+    Parsing, validation and FFWI run as Catalyst expressions (binary wire-format records,
+    with wire_format "auto", are decoded by a pandas UDF).
+
+    Without window_duration each micro-batch is aggregated and written with the same layout
+    as the DStream job, and rejected readings go to dead_letter_path. With it, regions are
+    aggregated statefully over event-time windows (see spark_windows.windowed_aggregate),
+    each window is written once it is final, and rejects are dropped.
+
+    With commit_mode "idempotent" every batch is committed under its batch id (see
+    parquet_commit.py), so batches replayed from the checkpoint after a failure are not
+    written twice; uncommitted attempts of the previous run are rolled back first.
+    """
+    commit_scope = scope_for(checkpoint_location) if commit_mode == "idempotent" else None
+    if commit_scope:
+        recover(source_df.sparkSession, output_path, commit_scope)
+    records = transform_records(parse_records(source_df, wire_format=wire_format), ffwi_mode, resolution, keep_rejects=not window_duration)
+    if window_duration:
+        windows = windowed_aggregate(records, window_duration, slide_duration, watermark, median_accuracy)
+        writer = windows.writeStream.outputMode("append").foreachBatch(
+            lambda batch_df, batch_id: write_windows(batch_df, batch_id, output_path, commit_scope))
+    else:
+        writer = records.writeStream.foreachBatch(
+            lambda batch_df, batch_id: write_batch(batch_df, batch_id, output_path, verbose, level,
+                                                   dead_letter_path, dead_letter_format, commit_scope))
+    return (
+        writer
+        .queryName("KinesisWeatherDataProcessing")
+        .option("checkpointLocation", checkpoint_location)
+        .trigger(**trigger_options(trigger))
+        .start()
+    )
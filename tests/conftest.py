@@ -0,0 +1,8 @@
+"""
+The scripts live at the top of the repository and import each other as top-level modules.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
@@ -0,0 +1,122 @@
+"""
+Buffering and rotation of the Kinesis Agent log writer, with a fake clock.
+"""
+import gzip
+import os
+import zlib
+
+import pytest
+
+from agent_log_writer import RotatingLogWriter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def lines(start, count):
+    return [f'{{"reading": {i}}}' for i in range(start, start + count)]
+
+
+def read_all(writer):
+    """
+    Lines of the rotated files and the active file, oldest first.
+    """
+    result = []
+    for path in writer.rotated_files + [writer.path]:
+        if os.path.exists(path):
+            with (gzip.open(path, "rt") if writer.compress else open(path)) as f:
+                result.extend(f.read().splitlines())
+    return result
+
+
+def writer(tmp_path, clock, **kwargs):
+    settings = dict(max_bytes=10 ** 9, max_age=10 ** 9, buffer_bytes=10 ** 9, flush_interval=10 ** 9, clock=clock)
+    settings.update(kwargs)
+    return RotatingLogWriter(str(tmp_path / "logs" / "weather.log"), **settings)
+
+
+def test_lines_are_buffered_until_a_threshold(tmp_path):
+    clock = Clock()
+    log = writer(tmp_path, clock, buffer_bytes=100, flush_interval=5)
+    log.write_lines(lines(0, 2))
+    assert not os.path.exists(log.path)
+    log.write_lines(lines(2, 5))
+    assert read_all(log) == lines(0, 7)
+    log.write_lines(lines(7, 1))
+    assert read_all(log) == lines(0, 7)
+    # Written by the next call once the interval has passed
+    clock.now += 5
+    log.write_lines(lines(8, 1))
+    assert read_all(log) == lines(0, 9)
+    log.write_lines([])
+    log.write_lines(lines(9, 1))
+    log.close()
+    assert read_all(log) == lines(0, 10) and log.bytes_written == sum(len(line) + 1 for line in lines(0, 10))
+
+
+def test_rotation_by_size(tmp_path):
+    log = writer(tmp_path, Clock(), max_bytes=200)
+    for start in range(0, 100, 5):
+        log.write_lines(lines(start, 5))
+        log.flush()
+    log.close()
+    assert len(log.rotated_files) >= 5
+    assert all(os.path.getsize(path) >= 200 for path in log.rotated_files)
+    assert all(os.path.getsize(path) < 200 + 100 for path in log.rotated_files)
+    assert read_all(log) == lines(0, 100)
+
+
+def test_rotation_by_age(tmp_path):
+    clock = Clock()
+    log = writer(tmp_path, clock, max_age=60)
+    log.write_lines(lines(0, 3))
+    log.flush()
+    clock.now += 59
+    log.flush()
+    assert log.rotated_files == []
+    clock.now += 1
+    log.flush()
+    assert len(log.rotated_files) == 1 and not os.path.exists(log.path)
+    # Nothing to rotate until the next write opens a new file
+    clock.now += 120
+    log.flush()
+    log.write_lines(lines(3, 2))
+    log.close()
+    assert len(log.rotated_files) == 1 and read_all(log) == lines(0, 5)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_reopened_file_keeps_its_size(tmp_path, compress):
+    clock = Clock()
+    first = writer(tmp_path, clock, compress=compress)
+    first.write_lines(lines(0, 200))
+    first.close()
+    size = os.path.getsize(first.path)
+
+    # A restarted generator appends to the active file and rotates it at the limit
+    second = writer(tmp_path, clock, compress=compress, max_bytes=size + 10)
+    second.write_lines(lines(200, 1))
+    second.flush()
+    assert len(second.rotated_files) == 1
+    second.close()
+    assert read_all(second) == lines(0, 201)
+
+
+def test_unknown_fsync_policy(tmp_path):
+    with pytest.raises(ValueError, match="fsync"):
+        writer(tmp_path, Clock(), fsync="always")
+
+
+def test_fsync_on_every_flush(tmp_path):
+    log = writer(tmp_path, Clock(), fsync="flush", compress=True, buffer_bytes=1)
+    log.write_lines(lines(0, 3))
+    # Flushed through the compressor: readable before the gzip trailer is written
+    with open(log.path, "rb") as f:
+        assert zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(f.read()).decode().splitlines() == lines(0, 3)
+    log.close()
+    assert read_all(log) == lines(0, 3)
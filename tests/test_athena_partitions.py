@@ -0,0 +1,105 @@
+"""
+Partition registration and the S3 upload handling of Lambda_PushToAthena.
+"""
+import pytest
+
+import Lambda_PushToAthena as athena_lambda
+from athena_partitions import FileManifest, PartitionRegistrar, parse_partition, table_directory
+from local_aws import FakeAthenaClient, FakeQuickSightClient, FakeS3Client
+from s3_events import Debouncer, IngestionLimiter, group_by_partition
+
+RAW_KEY = "forest_weather_data_parquet/year=2024/month=10/day=1/part-00000.snappy.parquet"
+ROLLUP_KEY = "weather-rollups/region_daily/year=2024/month=10/day=1/part-00000.snappy.parquet"
+
+
+def s3_event(*keys, bucket="forest-weather-data"):
+    return {"Records": [{"s3": {"bucket": {"name": bucket}, "object": {"key": key}}} for key in keys]}
+
+
+def test_parse_partition():
+    assert parse_partition(RAW_KEY) == (("2024", "10", "1"), "forest_weather_data_parquet/year=2024/month=10/day=1/")
+    assert table_directory(parse_partition(ROLLUP_KEY)[1]) == "region_daily"
+    assert table_directory("year=2024/month=10/day=1/") == ""
+    with pytest.raises(ValueError):
+        parse_partition("forest_weather_data_parquet/_SUCCESS")
+
+
+def test_registers_each_partition_once_across_restarts(tmp_path):
+    athena = FakeAthenaClient()
+    manifest = FileManifest(str(tmp_path / "partitions.json"))
+    location = "s3://bucket/forest_weather_data_parquet/year=2024/month=10/day=1/"
+    registrar = PartitionRegistrar(athena, "s3://bucket/query-results/", manifest=manifest)
+    assert registrar.register(("2024", "10", "1"), location)
+    assert not registrar.register(("2024", "10", "1"), location)
+    assert athena.partitions["forest_weather_data_parquet"] == {("2024", "10", "1")}
+
+    # A new instance (cold start) reads the manifest instead of registering again
+    restarted = PartitionRegistrar(athena, "s3://bucket/query-results/", manifest=manifest)
+    assert not restarted.register(("2024", "10", "1"), location)
+    assert restarted.register(("2024", "10", "2"), location.replace("day=1", "day=2"))
+    assert registrar.queries + restarted.queries == 2
+
+
+def test_failed_registration_is_not_cached():
+    registrar = PartitionRegistrar(FakeAthenaClient(fail_pattern="ALTER TABLE"), "s3://bucket/query-results/")
+    with pytest.raises(RuntimeError):
+        registrar.register(("2024", "10", "1"), "s3://bucket/t/year=2024/month=10/day=1/")
+    assert ("2024", "10", "1") not in registrar.registered
+
+
+def test_group_by_partition_splits_tables():
+    partitions, unmatched = group_by_partition(s3_event(RAW_KEY, RAW_KEY.replace("00000", "00001"), ROLLUP_KEY,
+                                                        "forest_weather_data_parquet/_SUCCESS"))
+    assert [(directory, len(files["keys"])) for (_, directory, _), files in partitions.items()] == [
+        ("forest_weather_data_parquet", 2), ("region_daily", 1)]
+    assert unmatched == ["forest_weather_data_parquet/_SUCCESS"]
+
+
+def test_debouncer_window():
+    now = [0.0]
+    debouncer = Debouncer(60, clock=lambda: now[0])
+    assert debouncer.ready("a")
+    # Nothing is suppressed until a query started
+    assert debouncer.ready("a")
+    debouncer.record("a")
+    now[0] = 59
+    assert not debouncer.ready("a")
+    now[0] = 60
+    assert debouncer.ready("a")
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    athena = FakeAthenaClient()
+    quicksight = FakeQuickSightClient()
+    monkeypatch.setattr(athena_lambda, "athena_client", athena)
+    monkeypatch.setattr(athena_lambda, "s3_client", FakeS3Client())
+    monkeypatch.setattr(athena_lambda, "quicksight_client", quicksight)
+    monkeypatch.setattr(athena_lambda, "ingestion_limiter",
+                        IngestionLimiter(quicksight, athena_lambda.AWS_ACCOUNT_ID, 0))
+    monkeypatch.setattr(athena_lambda, "query_debouncer", Debouncer(60))
+    monkeypatch.setattr(athena_lambda, "registrars", {})
+    monkeypatch.setattr(athena_lambda, "orchestrators", {})
+    return athena
+
+
+def test_handler_retries_a_partition_whose_query_failed_to_start(handler, monkeypatch):
+    query_partition = athena_lambda.query_partition
+
+    def throttled(*args):
+        raise RuntimeError("ThrottlingException")
+
+    monkeypatch.setattr(athena_lambda, "query_partition", throttled)
+    assert athena_lambda.handle_event(s3_event(RAW_KEY))["statusCode"] == 500
+    monkeypatch.setattr(athena_lambda, "query_partition", query_partition)
+    assert athena_lambda.handle_event(s3_event(RAW_KEY))["statusCode"] == 200
+    # Now debounced
+    queries = len(handler.queries)
+    athena_lambda.handle_event(s3_event(RAW_KEY))
+    assert len(handler.queries) == queries
+
+
+def test_handler_does_not_register_rollup_files(handler):
+    athena_lambda.handle_event(s3_event(ROLLUP_KEY, RAW_KEY))
+    assert handler.partitions == {"forest_weather_data_parquet": {("2024", "10", "1")}}
+    assert not any("region_daily" in query for query in handler.queries)
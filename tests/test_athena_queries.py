@@ -0,0 +1,143 @@
+"""
+Athena query polling, asynchronous checks and result reuse, against the in-memory Athena.
+"""
+import pytest
+
+import Lambda_PushToAthena as athena_lambda
+from athena_queries import QueryOrchestrator, normalize_query, wait_for_query
+from local_aws import FakeAthenaClient, FakeQuickSightClient, FakeS3Client
+from s3_events import Debouncer, IngestionLimiter, group_by_partition, upload_marker
+
+QUERY = 'SELECT * FROM "default"."forest_weather_data_parquet" WHERE year = ? AND month = ? AND day = ?'
+PARAMETERS = ["'2024'", "'10'", "'1'"]
+KEY = "forest_weather_data_parquet/year=2024/month=10/day=1/part-00000.snappy.parquet"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def orchestrator(athena, clock=None, **kwargs):
+    sleeps = []
+    return QueryOrchestrator(athena, "default", "s3://bucket/query-results/", clock=clock or Clock(),
+                             sleep=sleeps.append, **kwargs), sleeps
+
+
+def test_polls_with_exponential_backoff():
+    athena = FakeAthenaClient(running_polls=7)
+    execution_id = athena.start_query_execution(QueryString=QUERY)["QueryExecutionId"]
+    sleeps = []
+    assert wait_for_query(athena, execution_id, initial_poll=0.25, max_poll=5.0, sleep=sleeps.append) == "SUCCEEDED"
+    assert sleeps == [0.25, 0.5, 1.0, 2.0, 4.0, 5.0, 5.0]
+
+
+def test_poll_timeout_and_failure():
+    athena = FakeAthenaClient(running_polls=100, fail_pattern="broken")
+    execution_id = athena.start_query_execution(QueryString=QUERY)["QueryExecutionId"]
+    with pytest.raises(TimeoutError, match="QUEUED"):
+        wait_for_query(athena, execution_id, timeout=0.0, sleep=lambda seconds: None)
+    athena.running_polls = 0
+    execution_id = athena.start_query_execution(QueryString="SELECT broken")["QueryExecutionId"]
+    assert wait_for_query(athena, execution_id, sleep=lambda seconds: None) == "FAILED"
+
+
+def test_asynchronous_checks_step_through_the_states():
+    athena = FakeAthenaClient(running_polls=2)
+    queries, _ = orchestrator(athena)
+    execution_id, cached = queries.submit(QUERY, PARAMETERS)
+    assert not cached
+    assert [queries.check(execution_id) for _ in range(3)] == ["QUEUED", "RUNNING", "SUCCEEDED"]
+    # Known to have succeeded: an identical query is answered from the local cache
+    assert queries.submit(QUERY, PARAMETERS) == (execution_id, True)
+    assert queries.executed == 1 and queries.cache_hits == 1
+
+
+def test_failed_queries_are_not_cached():
+    athena = FakeAthenaClient(fail_pattern="day = \\?")
+    queries, _ = orchestrator(athena)
+    assert queries.run(QUERY, PARAMETERS)[1] == "FAILED"
+    assert queries.run(QUERY, PARAMETERS)[1] == "FAILED"
+    assert queries.executed == 2 and queries.cache_hits == 0
+
+
+def test_local_cache_keys_and_expiry():
+    athena = FakeAthenaClient()
+    clock = Clock()
+    queries, _ = orchestrator(athena, clock, reuse_minutes=5)
+    first, _ = queries.run(QUERY, PARAMETERS)
+    assert normalize_query(f"\n  {QUERY.replace(' ', '   ')} ;\n") == QUERY
+    assert queries.submit(f"\n  {QUERY} ;", PARAMETERS) == (first, True)
+    assert not queries.submit(QUERY, ["'2024'", "'10'", "'2'"])[1]
+    clock.now = 301.0
+    assert not queries.submit(QUERY, PARAMETERS)[1]
+    # Athena result reuse is requested with the same age limit
+    request = athena.executions[first]
+    assert request["ResultReuseConfiguration"]["ResultReuseByAgeConfiguration"] == {"Enabled": True,
+                                                                                    "MaxAgeInMinutes": 5}
+    assert request["ExecutionParameters"] == PARAMETERS
+
+
+def test_reuse_can_be_disabled():
+    athena = FakeAthenaClient()
+    queries, _ = orchestrator(athena, reuse_minutes=0)
+    first, _ = queries.run(QUERY, PARAMETERS)
+    second, _ = queries.run(QUERY, PARAMETERS)
+    assert first != second and queries.cache_hits == 0
+    assert "ResultReuseConfiguration" not in athena.executions[second]
+
+
+def test_versioned_queries_are_only_reused_for_the_same_data():
+    athena = FakeAthenaClient()
+    queries, _ = orchestrator(athena)
+    first, _ = queries.run(QUERY, PARAMETERS, version="upload-1")
+    assert queries.submit(QUERY, PARAMETERS, version="upload-1") == (first, True)
+    second, state = queries.run(QUERY, PARAMETERS, version="upload-2")
+    assert second != first and state == "SUCCEEDED"
+    # Athena would reuse on the query text alone, so it is not asked to
+    assert "ResultReuseConfiguration" not in athena.executions[first]
+    assert not athena.executions[second]["Reused"]
+
+
+def s3_event(*uploads, bucket="forest-weather-data"):
+    return {"Records": [{"s3": {"bucket": {"name": bucket}, "object": {"key": key, "sequencer": sequencer}}}
+                        for key, sequencer in uploads]}
+
+
+def test_upload_marker():
+    def marker(*uploads):
+        partitions, _ = group_by_partition(s3_event(*uploads))
+        return upload_marker(next(iter(partitions.values())))
+
+    other = KEY.replace("00000", "00001")
+    assert marker((KEY, "0A"), (other, "0B")) == marker((other, "0B"), (KEY, "0A"))
+    assert marker((KEY, "0A")) != marker((KEY, "0C"))
+    assert marker((KEY, "0A")) != marker((KEY, "0A"), (other, "0B"))
+
+
+def test_handler_reads_a_rewritten_partition_afresh(monkeypatch):
+    athena = FakeAthenaClient()
+    quicksight = FakeQuickSightClient()
+    monkeypatch.setattr(athena_lambda, "athena_client", athena)
+    monkeypatch.setattr(athena_lambda, "s3_client", FakeS3Client())
+    monkeypatch.setattr(athena_lambda, "quicksight_client", quicksight)
+    monkeypatch.setattr(athena_lambda, "ingestion_limiter", IngestionLimiter(quicksight, athena_lambda.AWS_ACCOUNT_ID, 0))
+    monkeypatch.setattr(athena_lambda, "query_debouncer", Debouncer(0))
+    monkeypatch.setattr(athena_lambda, "registrars", {})
+    monkeypatch.setattr(athena_lambda, "orchestrators", {})
+
+    def partition_queries():
+        return [e for e in athena.executions.values() if e["QueryString"] == athena_lambda.PARTITION_QUERY]
+
+    assert athena_lambda.handle_event(s3_event((KEY, "0A")))["statusCode"] == 200
+    # The same upload delivered again is answered from the cache
+    assert athena_lambda.handle_event(s3_event((KEY, "0A")))["statusCode"] == 200
+    assert len(partition_queries()) == 1
+    # The file written again: queried again, without Athena result reuse
+    assert athena_lambda.handle_event(s3_event((KEY, "0B")))["statusCode"] == 200
+    assert len(partition_queries()) == 2
+    assert not any("ResultReuseConfiguration" in execution or execution["Reused"]
+                   for execution in partition_queries())
@@ -0,0 +1,37 @@
+"""
+The process-wide client cache of aws_clients.
+"""
+import pytest
+
+import aws_clients
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    aws_clients.clear()
+    yield
+    aws_clients.clear()
+
+
+def test_clients_are_created_once():
+    athena = aws_clients.client("athena", region_name="us-east-2")
+    assert aws_clients.client("athena", region_name="us-east-2") is athena
+    assert aws_clients.client("athena", region_name="us-west-2") is not athena
+
+
+def test_nested_overrides_are_cached():
+    retries = aws_clients.client("s3", region_name="us-east-2", retries={"mode": "standard", "max_attempts": 3})
+    same = aws_clients.client("s3", region_name="us-east-2", retries={"max_attempts": 3, "mode": "standard"})
+    assert same is retries
+    # botocore counts the first attempt too: 3 retries are 4 attempts in all
+    assert retries.meta.config.retries["total_max_attempts"] == 4
+    other = aws_clients.client("s3", region_name="us-east-2", retries={"mode": "standard", "max_attempts": 5})
+    assert other is not retries
+    assert aws_clients.client("s3", region_name="us-east-2") not in (retries, other)
+
+
+def test_lazy_client_is_created_on_first_use():
+    stand_in = aws_clients.lazy("sqs", region_name="us-east-2")
+    assert "not created yet" in repr(stand_in)
+    assert stand_in.meta.region_name == "us-east-2"
+    assert stand_in._client is aws_clients.client("sqs", region_name="us-east-2")
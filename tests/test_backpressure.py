@@ -0,0 +1,189 @@
+"""
+BatchController in a simulated stream: convergence, clamping and bounded lag under a 10x burst.
+
+The simulation runs on a fake clock. Records arrive at a given rate; a batch waits the
+controller's interval, takes up to max_records of the backlog (oldest first) and costs
+BATCH_OVERHEAD seconds plus RECORD_COST per record.
+"""
+import pytest
+
+from backpressure import BatchController
+
+BATCH_OVERHEAD = 1.0
+RECORD_COST = 1 / 20000
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def simulate(controller, clock, rate_at, seconds):
+    """
+    Run batches for `seconds` of simulated time. Returns one (time, records, lag, interval,
+    max_records) tuple per batch.
+    """
+    backlog = []    # [arrival time, records] of 0.1 s slices not taken yet, oldest first
+    arrived_until = clock.now
+    history = []
+    end = clock.now + seconds
+    while clock.now < end:
+        clock.now += controller.interval
+        # Records keep arriving while a batch waits and while the previous one is processed
+        while arrived_until < clock.now:
+            step = min(0.1, clock.now - arrived_until)
+            backlog.append([arrived_until, rate_at(arrived_until) * step])
+            arrived_until += step
+        batch, oldest = 0.0, None
+        while backlog and batch < controller.max_records:
+            oldest = backlog[0][0] if oldest is None else oldest
+            take = min(backlog[0][1], controller.max_records - batch)
+            batch += take
+            backlog[0][1] -= take
+            if backlog[0][1] <= 0:
+                backlog.pop(0)
+        # As KinesisConsumer.run measures it: the wait of the oldest record when the batch starts
+        lag = clock.now - oldest if oldest is not None else 0.0
+        processing = BATCH_OVERHEAD + RECORD_COST * batch
+        clock.now += processing
+        controller.update(int(batch), processing, lag)
+        history.append((clock.now, batch, lag, controller.interval, controller.max_records))
+    return history
+
+
+def controller(clock, **options):
+    settings = dict(target_latency=10.0, min_interval=0.5, max_interval=30.0, min_records=1000,
+                    max_records=1_000_000, stage="test", clock=clock)
+    settings.update(options)
+    return BatchController(**settings)
+
+
+def test_batch_size_converges_to_the_latency_budget():
+    clock = Clock()
+    batches = controller(clock)
+    # A backlog large enough to fill any batch
+    simulate(batches, clock, lambda now: 50000, 300)
+    # Largest batch processed within utilization x target latency:
+    # M = 0.8 * 10 * M / (1 + M / 20000), so M = 140000 (8 s of processing)
+    assert batches.max_records == pytest.approx(140000, rel=0.02)
+    assert BATCH_OVERHEAD + RECORD_COST * batches.max_records == pytest.approx(8.0, rel=0.02)
+
+
+@pytest.mark.parametrize("limit, floor", [(50000, 1000), (1_000_000, 200000)])
+def test_settings_stay_within_their_bounds(limit, floor):
+    clock = Clock()
+    batches = controller(clock, max_records=limit, min_records=floor, max_interval=5.0)
+    for rate in (50000, 10, 0, 5000):
+        for _, _, _, interval, max_records in simulate(batches, clock, lambda now: rate, 120):
+            assert floor <= max_records <= limit
+            assert 0.5 <= interval <= 5.0
+
+
+def test_interval_stretches_under_light_load_within_the_budget():
+    clock = Clock()
+    batches = controller(clock, min_records=5000)
+    history = simulate(batches, clock, lambda now: 100, 600)
+    # 5000 records at 100/s would take 50 s, but the oldest record of a batch also waits for
+    # the previous batch and its own: the interval settles within the target minus both
+    intervals = [interval for _, _, _, interval, _ in history[10:]]
+    assert max(intervals) - min(intervals) < 0.05
+    assert intervals[-1] == pytest.approx(
+        batches.utilization * (batches.target_latency - 2 * batches.processing_seconds), rel=0.02)
+    assert max(lag + BATCH_OVERHEAD + RECORD_COST * size for _, size, lag, _, _ in history[10:]) <= \
+        batches.target_latency * 1.01
+
+
+def test_lag_stays_bounded_under_a_10x_burst():
+    clock = Clock()
+    batches = controller(clock)
+    base = 1000
+
+    def rate_at(now):
+        return base * 10 if 120 <= now < 240 else base
+
+    history = simulate(batches, clock, rate_at, 600)
+    burst = [lag for at, _, lag, _, _ in history if 120 <= at < 300]
+    after = [lag for at, _, lag, _, _ in history if at >= 360]
+    # The batches grow to absorb the burst instead of queueing it
+    assert max(size for at, size, _, _, _ in history if 120 <= at < 300) > 10 * batches.min_records
+    assert max(burst) < 2 * batches.target_latency
+    assert max(after) <= batches.target_latency
+    # Back to pacing the light load once the burst is drained
+    assert history[-1][3] > batches.min_interval
+
+
+def test_deadband():
+    batches = controller(Clock(), deadband=1.0)
+    assert batches.within_deadband(10.0, 10.0)
+    assert batches.within_deadband(10.0, 19.0) and batches.within_deadband(10.0, 5.5)
+    assert not batches.within_deadband(10.0, 21.0) and not batches.within_deadband(10.0, 4.0)
+
+
+def test_spark_restarts_only_outside_the_deadband_and_never_while_behind():
+    pytest.importorskip("pyspark")
+    from spark_backpressure import restart_settings
+
+    batches = controller(Clock())
+    batches.interval, batches.max_records = 12.0, 15000
+    assert restart_settings(batches, 10.0, 10000) is None
+    assert restart_settings(batches, 10.0, None) is None
+    batches.max_records = 40000
+    assert restart_settings(batches, 10.0, 10000) == (12.0, 40000)
+    # Without a source cap only the interval counts
+    assert restart_settings(batches, 10.0, None) is None
+    batches.interval = 25.0
+    assert restart_settings(batches, 10.0, None) == (25.0, None)
+    batches.behind = True
+    assert restart_settings(batches, 10.0, 10000) is None
+
+
+def test_run_adaptive_applies_the_controller_settings():
+    pytest.importorskip("pyspark")
+    from spark_backpressure import run_adaptive
+
+    class Streams:
+        def __init__(self):
+            self.listeners = []
+
+        def addListener(self, listener):
+            self.listeners.append(listener)
+
+        def removeListener(self, listener):
+            self.listeners.remove(listener)
+
+    class Spark:
+        streams = Streams()
+
+    class Query:
+        name = "test"
+
+        def __init__(self, polls):
+            self.polls = polls
+            self.stopped = False
+
+        def awaitTermination(self, timeout):
+            # Each poll, the load changes: first a burst, then it is drained
+            self.polls -= 1
+            if self.polls == 1:
+                batches.max_records, batches.behind = 80000, True
+            elif self.polls == 0:
+                batches.behind = False
+            return self.stopped or self.polls < -5
+
+        def stop(self):
+            self.stopped = True
+
+    batches = controller(Clock(), initial_interval=10.0)
+    started = []
+
+    def start_query(trigger, max_records):
+        started.append((trigger, max_records))
+        return Query(polls=2 if len(started) == 1 else 0)
+
+    query = run_adaptive(Spark(), start_query, batches, cap_records=True, poll_seconds=0)
+    # One restart, once the burst was drained, with the new limit
+    assert started == [("10.0 seconds", 10000), ("10.0 seconds", 80000)]
+    assert not query.stopped and Spark.streams.listeners == []
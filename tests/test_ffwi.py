@@ -0,0 +1,85 @@
+"""
+The vectorized FFWI kernel against the original scalar formula.
+"""
+import itertools
+import math
+import random
+import warnings
+
+import numpy as np
+import pytest
+
+from ffwi import calculate_ffwi, calculate_ffwi_batch
+
+SPECIAL = [math.inf, -math.inf, 0.0, -1.0, 50.0, 99.0, 100.0, 150.0, -100.0, 1e308, -1e308]
+
+
+def scalar_ffwi(temperature, humidity, wind_speed):
+    """
+    The formula every stage used to copy (raises ZeroDivisionError on a zero denominator).
+    """
+    if humidity < 100:
+        F = 1 - (2 * (100 - humidity) / ((100 - humidity) + temperature))
+        F = max(F, 0)
+    else:
+        F = 0
+    ffwi = ((1 + wind_speed) / 0.3002) * math.sqrt(F)
+    return max(0, min(ffwi, 100))
+
+
+def expected(reading):
+    try:
+        return scalar_ffwi(*reading)
+    except ZeroDivisionError:
+        return None
+
+
+def test_matches_the_scalar_formula_on_random_readings():
+    rng = random.Random(1)
+    readings = [(rng.uniform(-40, 130), rng.uniform(0, 110), rng.uniform(0, 80)) for _ in range(10000)]
+    batch = calculate_ffwi_batch(*zip(*readings))
+    assert batch == pytest.approx([expected(reading) for reading in readings], abs=1e-9)
+
+
+def test_matches_the_scalar_formula_on_extreme_readings_without_warnings():
+    readings = list(itertools.product(SPECIAL, repeat=3)) + [(-50.0, 50.0, 10.0)]
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        batch = calculate_ffwi_batch(*zip(*readings))
+        scalars = [calculate_ffwi(*reading) for reading in readings]
+    for reading, value, scalar in zip(readings, batch.tolist(), scalars):
+        wanted = expected(reading)
+        if wanted is None:
+            assert math.isnan(value) and scalar is None, reading
+        else:
+            assert value == pytest.approx(wanted) and scalar == pytest.approx(wanted), reading
+
+
+@pytest.mark.parametrize("reading", [(math.nan, 50.0, 10.0), (70.0, math.nan, 10.0), (70.0, 50.0, math.nan),
+                                     (math.nan, 100.0, math.nan)])
+def test_nan_means_missing(reading):
+    # The scalar formula returned 0 here; NaN is how callers pass missing fields
+    assert calculate_ffwi(*reading) is None
+    assert np.isnan(calculate_ffwi_batch(*reading))
+
+
+def test_temperature_is_ignored_at_full_humidity():
+    assert calculate_ffwi(math.nan, 100.0, 10.0) == 0.0
+    assert calculate_ffwi(math.inf, 120.0, 10.0) == 0.0
+
+
+def test_scalar_version_matches_the_kernel():
+    rng = random.Random(2)
+    values = SPECIAL + [math.nan, 0.5, 99.999, 100.0001]
+    readings = list(itertools.product(values, repeat=3))
+    readings += [(rng.uniform(-40, 130), rng.uniform(0, 110), rng.uniform(0, 80)) for _ in range(10000)]
+    readings += [(None, 100.0, 5.0), (70.0, None, 5.0), (70, 50, 10)]
+    batch = calculate_ffwi_batch(*([math.nan if v is None else v for v in column] for column in zip(*readings)))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        for reading, value in zip(readings, batch.tolist()):
+            scalar = calculate_ffwi(*reading)
+            if math.isnan(value):
+                assert scalar is None, reading
+            else:
+                assert scalar == value, reading
@@ -0,0 +1,127 @@
+"""
+AlertEngine levels, hysteresis, cooldown, rise checks and station eviction, and the sinks.
+"""
+import json
+
+import pytest
+
+from ffwi_alerts import AlertEngine, FileAlertSink, ListAlertSink, QueueAlertSink, event_time, sink_from_spec
+from local_aws import FakeSQSClient
+
+T0 = event_time("2024-10-01T12:00:00")
+NO_RISE = 10 ** 9
+
+
+def engine(**kwargs):
+    settings = dict(ewma_alpha=1.0, rise_per_hour=NO_RISE, cooldown=0.0)
+    settings.update(kwargs)
+    return AlertEngine(ListAlertSink(), **settings)
+
+
+def feed(alerts_engine, values, station="38.5,-121.25", step=60.0, start=T0):
+    """
+    Readings of one station every `step` seconds; the alerts of each reading.
+    """
+    return [alerts_engine.update(station, start + i * step, value) for i, value in enumerate(values)]
+
+
+def levels(alerts):
+    return [[alert["level"] for alert in reading] for reading in alerts]
+
+
+def test_steps_up_through_the_levels():
+    alerts = feed(engine(), [10, 35, 40, 55, 80, 90])
+    assert levels(alerts) == [[], ["elevated"], [], ["high"], ["extreme"], []]
+    assert alerts[3][0]["threshold"] == 50.0 and alerts[3][0]["kind"] == "level"
+    assert alerts[1][0]["event_time"] == "2024-10-01T12:01:00+00:00"
+    # Straight to the top: one alert for the highest level reached
+    assert levels(feed(engine(), [80])) == [["extreme"]]
+
+
+def test_hysteresis_on_the_way_down():
+    alerts_engine = engine(hysteresis=5.0)
+    # Hovering just under 50 keeps "high"; only 45 and below drops it
+    alerts = feed(alerts_engine, [55, 48, 52, 46, 51, 44, 51])
+    assert levels(alerts) == [["high"], [], [], [], [], [], ["high"]]
+    assert alerts_engine.stations["38.5,-121.25"].level == 2
+
+
+def test_ewma_smooths_single_spikes():
+    alerts = feed(engine(ewma_alpha=0.25), [10, 90, 10, 10])
+    # 10 -> 30 (elevated) -> 25 -> 21.25
+    assert levels(alerts) == [[], ["elevated"], [], []]
+
+
+def test_cooldown_suppresses_repeated_alerts():
+    alerts_engine = engine(hysteresis=0.0, cooldown=1800.0)
+    # Re-entering "elevated" 10 minutes later is suppressed, 40 minutes later it alerts again
+    alerts = feed(alerts_engine, [35, 20, 35, 20, 20, 35], step=600.0)
+    assert levels(alerts) == [["elevated"], [], [], [], [], ["elevated"]]
+    assert alerts_engine.suppressed == 1
+    # Cooldown is per level: "high" still alerts right after "elevated"
+    assert levels(feed(engine(cooldown=1800.0), [35, 55], station="other")) == [["elevated"], ["high"]]
+
+
+def test_rise_check_waits_for_min_rise_span():
+    alerts_engine = engine(levels=(("extreme", 1000.0),), rise_per_hour=20.0, min_rise_span=600.0, cooldown=3600.0)
+    # +10 in 5 minutes is fast, but the kept readings only span 300 s
+    alerts = feed(alerts_engine, [10, 15, 20], step=150.0)
+    assert alerts == [[], [], []]
+    alerts = feed(alerts_engine, [25], start=T0 + 600.0)
+    assert len(alerts[0]) == 1 and alerts[0][0]["kind"] == "rise"
+    assert alerts[0][0]["rise_per_hour"] == pytest.approx(90.0) and alerts[0][0]["window_seconds"] == 600.0
+    # Still rising, but within the cooldown
+    assert feed(alerts_engine, [30], start=T0 + 750.0) == [[]]
+    assert alerts_engine.suppressed == 1
+
+
+def test_slow_rise_does_not_alert():
+    alerts = feed(engine(levels=(("extreme", 1000.0),), rise_per_hour=20.0, min_rise_span=600.0),
+                  [10, 11, 12, 13], step=600.0)
+    assert alerts == [[], [], [], []]
+
+
+def test_stations_expire_after_the_ttl():
+    alerts_engine = engine(station_ttl=3600.0)
+    alerts_engine.process(["a", "b"], [T0, T0 + 1800.0], [10, 10])
+    assert list(alerts_engine.stations) == ["a", "b"]
+    alerts_engine.process(["c"], [T0 + 3601.0], [10])
+    assert list(alerts_engine.stations) == ["b", "c"] and alerts_engine.evicted == 1
+    # An expired station starts over as new and alerts again
+    alerts_engine.process(["a"], [T0 + 3700.0], [35])
+    assert alerts_engine.sink.alerts[-1]["station"] == "a"
+
+
+def test_max_stations_drops_the_least_recently_updated():
+    alerts_engine = engine(max_stations=2)
+    alerts_engine.process(["a", "b", "a", "c"], [T0] * 4, [10] * 4)
+    assert list(alerts_engine.stations) == ["a", "c"] and alerts_engine.evicted == 1
+
+
+def test_process_sends_alerts_to_the_sink():
+    alerts_engine = engine()
+    sent = alerts_engine.process(["a", "b", "a"], [T0, T0, T0 + 60], [35, 10, 55])
+    assert [(alert["station"], alert["level"]) for alert in sent] == [("a", "elevated"), ("a", "high")]
+    assert alerts_engine.sink.alerts == sent and alerts_engine.alerts_sent == 2
+    assert alerts_engine.process(["b"], [T0 + 60], [10]) == []
+    assert alerts_engine.alerts_sent == 2
+
+
+def test_sink_from_spec(tmp_path):
+    assert sink_from_spec(None) is None and sink_from_spec("") is None
+    path = tmp_path / "alerts" / "ffwi.jsonl"
+    sink = sink_from_spec(f"file:{path}")
+    assert isinstance(sink, FileAlertSink)
+    sink.send([{"station": "a"}, {"station": "b"}])
+    sink.send([{"station": "c"}])
+    assert [json.loads(line)["station"] for line in path.read_text().splitlines()] == ["a", "b", "c"]
+
+    sqs = FakeSQSClient()
+    url = "https://sqs.us-east-2.amazonaws.com/000000000000/ffwi-alerts"
+    sink = sink_from_spec(f"sqs:{url}", sqs_client_factory=lambda: sqs)
+    assert isinstance(sink, QueueAlertSink)
+    sink.send([{"station": str(i)} for i in range(25)])
+    assert [json.loads(body)["station"] for body in sqs.queues[url]] == [str(i) for i in range(25)]
+
+    with pytest.raises(ValueError, match="Unknown alert sink"):
+        sink_from_spec("kafka:weather-alerts")
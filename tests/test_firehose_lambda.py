@@ -0,0 +1,83 @@
+"""
+The Firehose transformation Lambda on real event shapes.
+"""
+import base64
+import json
+import logging
+
+import pytest
+
+import Lambda_process_weather_data as firehose_lambda
+import wire_format
+
+READING = {"timestamp": "2024-10-01T12:00:00", "latitude": 45.7, "longitude": -78.3,
+           "temperature": 85.0, "humidity": 20.0, "windSpeed": 15.0}
+
+
+def record(record_id, data):
+    if not isinstance(data, bytes):
+        data = json.dumps(data).encode("utf-8")
+    return {"recordId": record_id, "data": base64.b64encode(data).decode("ascii")}
+
+
+def decoded(output):
+    return json.loads(base64.b64decode(output["data"]))
+
+
+@pytest.fixture(autouse=True)
+def no_alerts(monkeypatch):
+    monkeypatch.setattr(firehose_lambda, "alert_engine", None)
+
+
+def test_batch_is_computed_per_record():
+    readings = [READING, dict(READING, humidity=100.0), dict(READING, temperature=40, windSpeed=0)]
+    output = firehose_lambda.process_records([record(str(i), reading) for i, reading in enumerate(readings)])
+    results = output["records"]
+    assert [result["recordId"] for result in results] == ["0", "1", "2"]
+    assert all(result["result"] == "Ok" for result in results)
+    values = [decoded(result)["ffwi"] for result in results]
+    assert values[0] == pytest.approx(firehose_lambda.calculate_ffwi_batch(85.0, 20.0, 15.0).item())
+    assert values[1] == 0.0
+    assert decoded(results[0])["latitude"] == READING["latitude"]
+
+
+def test_columns_take_numbers_only():
+    payloads = [READING, None, {"temperature": "hot", "humidity": True, "windSpeed": 3}]
+    temperature, humidity, wind_speed = firehose_lambda.weather_columns(payloads)
+    assert temperature[0] == 85.0 and humidity[0] == 20.0 and wind_speed[0] == 15.0
+    assert all(value != value for value in (temperature[1], humidity[1], temperature[2], humidity[2]))
+    assert wind_speed[2] == 3.0
+
+
+def test_binary_records_are_decoded():
+    raw = wire_format.encode(READING)
+    output = firehose_lambda.process_records([record("raw", raw), record("text", wire_format.encode_text(READING).encode("ascii"))])
+    for result in output["records"]:
+        assert result["result"] == "Ok"
+        assert decoded(result)["timestamp"] == READING["timestamp"]
+        assert decoded(result)["temperature"] == READING["temperature"]
+
+
+def test_failed_records_pass_the_original_data_through():
+    bad = [record("missing", {"temperature": 70}), {"recordId": "not-base64", "data": "%%%"},
+           record("not-json", b"{truncated"), record("list", [1, 2, 3])]
+    output = firehose_lambda.process_records(bad + [record("ok", READING)])
+    results = {result["recordId"]: result for result in output["records"]}
+    for original in bad:
+        assert results[original["recordId"]] == {"recordId": original["recordId"], "result": "ProcessingFailed",
+                                                  "data": original["data"]}
+    assert results["ok"]["result"] == "Ok"
+
+
+def test_missing_temperature_at_full_humidity_is_logged_at_debug(caplog):
+    caplog.set_level(logging.DEBUG)
+    output = firehose_lambda.process_records([record("wet", {"humidity": 100, "windSpeed": 3}),
+                                              record("ok", READING)])
+    results = output["records"]
+    assert [result["result"] for result in results] == ["Ok", "Ok"]
+    assert decoded(results[0]) == {"humidity": 100, "windSpeed": 3, "ffwi": 0.0}
+
+
+def test_handler_event():
+    response = firehose_lambda.lambda_handler({"records": [record("1", READING)]}, None)
+    assert response["records"][0]["result"] == "Ok"
@@ -0,0 +1,103 @@
+"""
+KinesisConsumer against the in-memory stream of local_aws: checkpoints, restarts and resharding.
+"""
+import contextlib
+import io
+
+import pytest
+
+from kinesis_consumer import SHARD_END, FileCheckpointStore, KinesisConsumer, SQLiteCheckpointStore
+from local_aws import FakeKinesisClient
+
+RECORDS = 2000
+
+
+def stream(shard_count=4, records=RECORDS, start=0):
+    client = FakeKinesisClient(shard_count=shard_count)
+    put(client, start, records)
+    return client
+
+
+def put(client, start, count, keys=50):
+    for offset in range(start, start + count, 500):
+        client.put_records(StreamName=client.stream_name, Records=[
+            {"Data": str(i).encode("utf-8"), "PartitionKey": f"station-{i % keys}"}
+            for i in range(offset, min(offset + 500, start + count))])
+
+
+def consume(client, store, stop_after_batches=None, **options):
+    """
+    Run a consumer until it is idle (or for a number of batches). Returns the records it processed.
+    """
+    consumer = KinesisConsumer(client, client.stream_name, store, poll_interval=0.01)
+    received = []
+
+    def process(records):
+        received.extend(records)
+        if stop_after_batches is not None and consumer.stats["batches"] + 1 >= stop_after_batches:
+            consumer.stop()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        consumer.run(process, max_batch_seconds=0.05, idle_timeout=0.5, **options)
+    return received
+
+
+def values(records):
+    return [int(record["Data"]) for record in records]
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def open_store(request, tmp_path):
+    def open_store(stream_name):
+        if request.param == "file":
+            return FileCheckpointStore(str(tmp_path / "checkpoints.json"), stream_name)
+        return SQLiteCheckpointStore(str(tmp_path / "checkpoints.db"), stream_name)
+    return open_store
+
+
+def test_resumes_after_restart(open_store):
+    client = stream()
+    first = consume(client, open_store(client.stream_name), stop_after_batches=2, max_batch_records=300)
+    assert 0 < len(first) <= 600
+
+    # A new process: only what the store persisted survives
+    store = open_store(client.stream_name)
+    checkpoints = {shard["ShardId"]: store.get(shard["ShardId"]) for shard in client.shards}
+    assert any(checkpoints.values())
+    second = consume(client, store)
+    for record in second:
+        checkpoint = checkpoints[record["ShardId"]]
+        assert checkpoint is None or record["SequenceNumber"] > checkpoint
+    assert set(values(first)) | set(values(second)) == set(range(RECORDS))
+    # Only records read but not checkpointed by the first run are delivered twice
+    assert len(first) + len(second) - RECORDS < len(first)
+
+    # Everything is checkpointed now
+    assert consume(client, open_store(client.stream_name)) == []
+
+
+def test_new_records_after_restart(open_store):
+    client = stream(shard_count=2)
+    assert len(consume(client, open_store(client.stream_name))) == RECORDS
+    put(client, RECORDS, 300)
+    assert sorted(values(consume(client, open_store(client.stream_name)))) == list(range(RECORDS, RECORDS + 300))
+
+
+def test_children_are_read_after_their_parents(open_store):
+    client = stream(shard_count=2)
+    parent = client.shards[0]
+    start, end = (int(parent["HashKeyRange"][key]) for key in ("StartingHashKey", "EndingHashKey"))
+    client.split_shard(StreamName=client.stream_name, ShardToSplit=parent["ShardId"],
+                       NewStartingHashKey=str((start + end) // 2))
+    put(client, RECORDS, 1000)
+
+    store = open_store(client.stream_name)
+    records = consume(client, store)
+    assert sorted(values(records)) == list(range(RECORDS + 1000))
+    # Per partition key, the order of the puts is kept across the split
+    by_key = {}
+    for record in records:
+        by_key.setdefault(record["PartitionKey"], []).append(int(record["Data"]))
+    assert all(key_values == sorted(key_values) for key_values in by_key.values())
+    assert store.get(parent["ShardId"]) == SHARD_END
+    assert len({record["ShardId"] for record in records}) == 4
@@ -0,0 +1,153 @@
+"""
+KinesisProducer retries, KPL aggregation and per-key ordering, against the in-memory stream.
+"""
+import itertools
+import random
+import threading
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from kinesis_producer import KinesisProducer, aggregate_records, deaggregate_record, retryable
+from local_aws import FakeKinesisClient
+
+
+def client_error(code, status=400):
+    return ClientError({"Error": {"Code": code, "Message": code},
+                        "ResponseMetadata": {"HTTPStatusCode": status}}, "PutRecords")
+
+
+class ScriptedClient(FakeKinesisClient):
+    """
+    Fails the entries named in `fail` (by data) once, or raises the scripted call errors first.
+    """
+
+    def __init__(self, fail=(), errors=(), **kwargs):
+        super().__init__(**kwargs)
+        self.fail = set(fail)
+        self.errors = list(errors)
+        self.sent = []
+
+    def put_records(self, StreamName, Records):
+        self.sent.append([record["Data"] for record in Records])
+        if self.errors:
+            raise self.errors.pop(0)
+        failing = [record for record in Records if record["Data"] in self.fail]
+        self.fail -= {record["Data"] for record in failing}
+        response = super().put_records(StreamName, [r for r in Records if r not in failing])
+        results = iter(response["Records"])
+        response["Records"] = [{"ErrorCode": "ProvisionedThroughputExceededException", "ErrorMessage": "Rate exceeded"}
+                               if record in failing else next(results) for record in Records]
+        response["FailedRecordCount"] = len(failing)
+        return response
+
+
+def producer(client, **kwargs):
+    return KinesisProducer(client, client.stream_name, rate_limit=False, sleep=lambda seconds: None, **kwargs)
+
+
+def stored(client):
+    return [record["Data"] for record in client.records()]
+
+
+def test_only_failed_entries_are_retried():
+    data = [f"reading-{i}".encode() for i in range(10)]
+    client = ScriptedClient(fail={data[2], data[7]})
+    sender = producer(client, preserve_order=False)
+    sender.put_many((value, f"station-{i}") for i, value in enumerate(data))
+    stats = sender.close()
+    assert client.sent == [data, [data[2], data[7]]]
+    assert sorted(stored(client)) == sorted(data)
+    assert stats["retried_entries"] == stats["throttled_entries"] == 2
+    assert stats["entries"] == 10 and stats["failed_records"] == 0
+
+
+def test_transient_call_errors_are_retried():
+    errors = [client_error("ThrottlingException"), client_error("InternalError", status=503),
+              EndpointConnectionError(endpoint_url="https://kinesis.us-east-2.amazonaws.com"),
+              FakeKinesisClient.exceptions.ProvisionedThroughputExceededException("Rate exceeded")]
+    assert all(retryable(error) for error in errors)
+    client = ScriptedClient(errors=errors)
+    sender = producer(client)
+    sender.put(b"reading", "station")
+    stats = sender.close()
+    assert len(client.sent) == 5 and stored(client) == [b"reading"]
+    assert stats["retried_entries"] == 4
+
+
+@pytest.mark.parametrize("code", ["ValidationException", "AccessDeniedException", "ResourceNotFoundException"])
+def test_other_call_errors_are_raised_without_retries(code):
+    client = ScriptedClient(errors=[client_error(code)] * 3)
+    sender = producer(client)
+    sender.put_many([(b"a", "station-1"), (b"b", "station-1")])
+    with pytest.raises(ClientError, match=code):
+        sender.flush()
+    assert len(client.sent) == 1
+    assert [entry["Data"] for entry in sender.failed] == [b"a", b"b"]
+    assert sender.stats["failed_records"] == 2 and sender.stats["retried_entries"] == 0
+
+
+def test_entries_are_given_up_on_after_the_last_retry():
+    client = ScriptedClient(errors=[client_error("ThrottlingException")] * 3)
+    sender = producer(client, max_retries=2)
+    sender.put(b"reading", "station")
+    stats = sender.close()
+    assert len(client.sent) == 3 and stored(client) == []
+    assert stats["failed_records"] == 1 and len(sender.failed) == 1
+
+
+def test_aggregation_roundtrip():
+    records = [("station-1", b"a"), ("station-2", b""), ("station-1", bytes(range(256)) * 10), ("été", b"c")]
+    aggregated = aggregate_records(records)
+    assert deaggregate_record(aggregated) == records
+    assert deaggregate_record(b'{"plain": "json"}') == [(None, b'{"plain": "json"}')]
+    with pytest.raises(ValueError, match="checksum"):
+        deaggregate_record(aggregated[:-1] + bytes([aggregated[-1] ^ 1]))
+
+
+def test_aggregated_records_reach_their_shards():
+    client = FakeKinesisClient(shard_count=4)
+    sender = producer(client, aggregate=True, aggregated_record_bytes=1024)
+    readings = [(f"{i}:{j}".encode(), f"station-{i}") for j in range(50) for i in range(20)]
+    sender.put_many(readings)
+    stats = sender.close()
+    assert stats["entries"] < len(readings)
+    received = []
+    for shard in client.shards:
+        for record in shard["Records"]:
+            for key, data in deaggregate_record(record["Data"]):
+                # The explicit hash key keeps every record on the shard its own key maps to
+                assert client._shard_for(key) is shard
+                received.append((data, key))
+    assert sorted(received) == sorted(readings)
+
+
+@pytest.mark.parametrize("aggregate", [False, True])
+def test_order_per_partition_key_under_concurrency(aggregate):
+    random.seed(7)
+    client = FakeKinesisClient(shard_count=4, failure_rate=0.3)
+    sender = producer(client, aggregate=aggregate, aggregated_record_bytes=256, max_in_flight=8, max_retries=50)
+    counters = {key: itertools.count() for key in (f"station-{i}" for i in range(40))}
+    lock = threading.Lock()
+
+    def put_readings(keys):
+        for _ in range(100):
+            for key in keys:
+                # The counter and the put are one step, so put order is counter order
+                with lock:
+                    sender.put(f"{key}:{next(counters[key])}".encode(), key)
+
+    threads = [threading.Thread(target=put_readings, args=(list(counters)[i::4],)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = sender.close()
+    assert stats["retried_entries"] > 0 and stats["failed_records"] == 0
+
+    received = {}
+    for record in client.records():
+        for key, data in (deaggregate_record(record["Data"]) if aggregate else [(None, record["Data"])]):
+            key, index = data.decode().rsplit(":", 1)
+            received.setdefault(key, []).append(int(index))
+    assert received == {key: list(range(100)) for key in counters}
@@ -0,0 +1,175 @@
+"""
+Rate shaping and deterministic output of the load generator, and the load mode of both
+simulators.
+"""
+import argparse
+import json
+
+import pytest
+
+import load_generator
+import wire_format
+from load_generator import DEFAULTS, add_load_arguments, load_config, run_load, target_rate
+
+
+class Clock:
+    """
+    Fake monotonic clock advanced by sleep() and by slow sinks.
+    """
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def config(**options):
+    return dict(DEFAULTS, **options)
+
+
+def run(options, sink_seconds=0.0):
+    """
+    run_load on a fake clock; the (time, count) of every batch, the lines, the keys and the summary.
+    """
+    clock = Clock()
+    batches, lines, keys = [], [], []
+
+    def sink(batch, partition_keys):
+        batches.append((clock.now - 100.0, len(batch)))
+        lines.extend(batch)
+        keys.extend(partition_keys)
+        clock.now += sink_seconds
+
+    summary = run_load(config(**options), sink, clock=clock, sleep=clock.sleep)
+    return batches, lines, keys, summary
+
+
+def test_profiles():
+    base = config(rate=100.0, burst_factor=10.0, burst_period=60.0, burst_length=5.0, duration=100.0)
+    assert target_rate(dict(base, profile="constant"), 42.0) == 100.0
+    spike = dict(base, profile="spike")
+    assert [target_rate(spike, t) for t in (0.0, 4.9, 5.0, 59.9, 60.0)] == [1000.0, 1000.0, 100.0, 100.0, 1000.0]
+    sine = dict(base, profile="sine")
+    assert [target_rate(sine, t) for t in (0.0, 30.0, 60.0)] == pytest.approx([100.0, 1000.0, 100.0])
+    ramp = dict(base, profile="ramp")
+    assert [target_rate(ramp, t) for t in (0.0, 50.0, 100.0, 200.0)] == pytest.approx([100.0, 550.0, 1000.0, 1000.0])
+    with pytest.raises(ValueError, match="Unknown profile"):
+        target_rate(dict(base, profile="square"), 0.0)
+
+
+def test_constant_rate():
+    batches, lines, _, summary = run(dict(rate=1000.0, duration=10.0, tick=0.1))
+    # The first tick accrues nothing; then 100 records per 0.1 s tick
+    assert summary["records"] == len(lines) == pytest.approx(10000, abs=100)
+    # Float error in the carried fraction moves a record between ticks now and then
+    assert {count for _, count in batches} <= {99, 100, 101}
+    assert summary["achieved_rate"] == pytest.approx(1000.0, rel=0.02)
+
+
+def test_fractional_rates_are_carried_over():
+    _, lines, _, _ = run(dict(rate=3.0, duration=20.0, tick=0.1))
+    assert len(lines) == pytest.approx(60, abs=1)
+
+
+def test_spike_bursts():
+    batches, _, _, _ = run(dict(rate=1000.0, profile="spike", burst_factor=10.0, burst_period=10.0, burst_length=2.0,
+                                duration=30.0, tick=0.1))
+    in_burst = [count for t, count in batches if 0.2 <= t % 10.0 < 2.0]
+    between = [count for t, count in batches if 2.2 <= t % 10.0 < 9.9]
+    assert sum(in_burst) / len(in_burst) == pytest.approx(1000, rel=0.01)
+    assert sum(between) / len(between) == pytest.approx(100, rel=0.01)
+
+
+@pytest.mark.parametrize("profile, average", [("sine", 5.5), ("ramp", 5.5)])
+def test_shaped_totals(profile, average):
+    # Both average (1 + factor) / 2 x rate over a whole period / the run
+    _, lines, _, _ = run(dict(rate=100.0, profile=profile, burst_factor=10.0, burst_period=20.0, duration=20.0))
+    assert len(lines) == pytest.approx(100 * average * 20, rel=0.02)
+
+
+def test_slow_sink_is_caught_up():
+    # Each batch takes 0.25 s, longer than the tick: the rate is kept by sending more per batch
+    batches, lines, _, _ = run(dict(rate=1000.0, duration=10.0, tick=0.1), sink_seconds=0.25)
+    assert len(lines) == pytest.approx(10000, rel=0.03)
+    assert max(count for _, count in batches) == 250
+
+
+def test_seeded_runs_are_reproducible():
+    def without_timestamps(lines):
+        return [{key: value for key, value in json.loads(line).items() if key != "timestamp"} for line in lines]
+
+    options = dict(rate=500.0, duration=3.0, stations=7, seed=42, wind_min=20.0, wind_max=30.0)
+    _, first, first_keys, _ = run(options)
+    _, second, second_keys, _ = run(options)
+    assert without_timestamps(first) == without_timestamps(second) and first_keys == second_keys
+    _, other, other_keys, _ = run(dict(options, seed=43))
+    assert without_timestamps(other) != without_timestamps(first) and other_keys != first_keys
+
+    readings = without_timestamps(first)
+    # Stations are visited round robin and keyed by their coordinates
+    assert len(set(first_keys)) == 7 and first_keys[:14] == first_keys[:7] * 2
+    assert all(key == f"{r['latitude']},{r['longitude']}" for key, r in zip(first_keys, readings))
+    assert all(20.0 <= r["windSpeed"] <= 30.0 for r in readings)
+    assert all(45.53 <= r["latitude"] <= 46 and -79 <= r["longitude"] <= -77.5 for r in readings)
+
+
+def test_station_count_is_bounded():
+    with pytest.raises(ValueError):
+        load_generator.Stations(0)
+    with pytest.raises(ValueError):
+        load_generator.Stations(load_generator.MAX_STATIONS + 1)
+
+
+def test_config_precedence(tmp_path):
+    parser = argparse.ArgumentParser()
+    add_load_arguments(parser)
+    path = tmp_path / "load.json"
+    path.write_text(json.dumps({"rate": 2000, "stations": 50, "profile": "spike"}))
+    args = parser.parse_args(["--config", str(path), "--stations", "10"])
+    merged = load_config(args, wind_min=20.0, rate=1.0)
+    assert (merged["rate"], merged["stations"], merged["profile"], merged["wind_min"]) == (2000, 10, "spike", 20.0)
+    assert merged["duration"] == DEFAULTS["duration"]
+    path.write_text(json.dumps({"rat": 2000}))
+    with pytest.raises(ValueError, match="rat"):
+        load_config(args)
+
+
+LOAD = dict(DEFAULTS, rate=2000.0, duration=0.3, stations=20, seed=1, tick=0.05, report_interval=60.0)
+
+
+@pytest.mark.parametrize("record_format", ["json", "binary"])
+def test_agent_simulator_load_mode(tmp_path, record_format):
+    import kinesisagent_simdata_gen
+    from agent_log_writer import RotatingLogWriter
+
+    writer = RotatingLogWriter(str(tmp_path / "weather.log"))
+    summary = kinesisagent_simdata_gen.run_load_to_file(dict(LOAD), writer, record_format)
+    lines = (tmp_path / "weather.log").read_text().splitlines()
+    assert summary["records"] == len(lines) > 0
+    readings = [wire_format.loads(line) for line in lines]
+    assert {(r["latitude"], r["longitude"]) for r in readings} <= set(zip(
+        load_generator.Stations(20, seed=1).latitude.tolist(), load_generator.Stations(20, seed=1).longitude.tolist()))
+    if record_format == "binary":
+        assert all(len(line) == wire_format.TEXT_SIZE for line in lines)
+
+
+@pytest.mark.parametrize("record_format", ["json", "binary"])
+def test_api_simulator_load_mode(record_format):
+    pytest.importorskip("boto3")
+    import api_simdata_gen
+    from local_aws import FakeKinesisClient
+
+    client = FakeKinesisClient(api_simdata_gen.STREAM_NAME, shard_count=2)
+    summary, stats = api_simdata_gen.run_load_to_kinesis(dict(LOAD, wind_min=20.0, wind_max=30.0), client,
+                                                         record_format=record_format)
+    records = client.records()
+    assert summary["records"] == stats["records"] == len(records) > 0
+    for record in records:
+        reading = wire_format.loads(record["Data"])
+        assert record["PartitionKey"] == f"{reading['latitude']},{reading['longitude']}"
+        assert 20.0 <= reading["windSpeed"] <= 30.0
+        assert (record["Data"][:1] == bytes([wire_format.MAGIC])) == (record_format == "binary")
@@ -0,0 +1,147 @@
+"""
+Metric semantics, the Prometheus text exposition and the CloudWatch EMF document.
+"""
+import json
+import math
+
+import pytest
+
+from metrics import Registry, emf_document, emit_emf, prometheus_text
+
+
+def test_counters_and_gauges():
+    registry = Registry(enabled=True)
+    records = registry.counter("records_total", "Records", stage="spark")
+    records.inc()
+    records.inc(4)
+    # The same name and labels give the same metric, whatever the label order
+    assert registry.counter("records_total", stage="spark") is records and records.value == 5
+    assert registry.counter("records_total", stage="lambda") is not records
+    lag = registry.gauge("lag_seconds")
+    assert lag.value is None
+    lag.set(3.5)
+    lag.set(1.25)
+    assert lag.value == 1.25
+    with pytest.raises(ValueError, match="already registered as a counter"):
+        registry.gauge("records_total")
+    registry.reset()
+    assert records.value == 0 and lag.value is None
+
+
+def test_histograms():
+    registry = Registry(enabled=True)
+    latency = registry.histogram("latency_seconds", buckets=(0.1, 1.0, 10.0))
+    assert latency.quantile(0.5) is None
+    for value in (0.05, 0.1, 0.5, 2.0, 20.0):
+        latency.observe(value)
+    # Upper bounds are inclusive: 0.1 lands in the 0.1 bucket
+    assert latency.counts == [2, 1, 1, 1]
+    assert latency.count == 5 and latency.sum == pytest.approx(22.65) and latency.max == 20.0
+    assert [latency.quantile(q) for q in (0.2, 0.4, 0.6, 0.8, 1.0)] == [0.1, 0.1, 1.0, 10.0, 20.0]
+    with registry.timer("latency_seconds") as timer:
+        pass
+    assert timer.seconds >= 0
+    assert registry.histogram("latency_seconds") is latency and latency.count == 6
+
+
+def test_disabled_registry_records_nothing():
+    registry = Registry(enabled=False)
+    registry.counter("records_total").inc(3)
+    registry.histogram("latency_seconds").observe(1.0)
+    with registry.timer("latency_seconds"):
+        pass
+    assert registry.counter("records_total").value == 0
+    assert registry.families() == []
+    assert emit_emf(registry, write=pytest.fail) is None
+
+
+def test_prometheus_text():
+    registry = Registry(enabled=True)
+    registry.counter("weather_records_total", "Records in", stage="spark").inc(7)
+    registry.gauge("weather_lag_seconds", "Consumer lag").set(2.5)
+    registry.gauge("weather_unset")
+    histogram = registry.histogram("weather_batch_seconds", "Batch duration", buckets=(0.5, 1.0), stage="spark")
+    histogram.observe(0.25)
+    histogram.observe(0.75)
+    histogram.observe(3.0)
+    assert prometheus_text(registry).splitlines() == [
+        "# HELP weather_batch_seconds Batch duration",
+        "# TYPE weather_batch_seconds histogram",
+        'weather_batch_seconds_bucket{stage="spark",le="0.5"} 1',
+        'weather_batch_seconds_bucket{stage="spark",le="1.0"} 2',
+        'weather_batch_seconds_bucket{stage="spark",le="+Inf"} 3',
+        'weather_batch_seconds_sum{stage="spark"} 4.0',
+        'weather_batch_seconds_count{stage="spark"} 3',
+        "# HELP weather_lag_seconds Consumer lag",
+        "# TYPE weather_lag_seconds gauge",
+        "weather_lag_seconds 2.5",
+        "# HELP weather_records_total Records in",
+        "# TYPE weather_records_total counter",
+        'weather_records_total{stage="spark"} 7',
+        "# TYPE weather_unset gauge",
+    ]
+
+
+def test_prometheus_escaping():
+    registry = Registry(enabled=True)
+    registry.counter("weather.rejects-total", 'Rejects by "reason"\\code\nper stage',
+                     reason='bad "json"\\\n').inc()
+    registry.counter("2xx_responses").inc()
+    assert prometheus_text(registry).splitlines() == [
+        "# TYPE _2xx_responses counter",
+        "_2xx_responses 1",
+        '# HELP weather_rejects_total Rejects by "reason"\\\\code\\nper stage',
+        "# TYPE weather_rejects_total counter",
+        'weather_rejects_total{reason="bad \\"json\\"\\\\\\n"} 1',
+    ]
+
+
+def test_emf_document():
+    registry = Registry(enabled=True)
+    registry.counter("records_total", stage="lambda").inc(10)
+    registry.counter("rejects_total", reason="json").inc(0)
+    registry.gauge("batch_size", unit="Count").set(500)
+    histogram = registry.histogram("invocation_seconds")
+    histogram.observe(0.5)
+    histogram.observe(1.5)
+    registry.histogram("unused_seconds")
+    document = emf_document(registry, namespace="Weather", dimensions={"Function": "f", "Env": "dev"},
+                            timestamp=1700000000.5)
+    assert document["_aws"] == {
+        "Timestamp": 1700000000500,
+        "CloudWatchMetrics": [{
+            "Namespace": "Weather",
+            "Dimensions": [["Env", "Function"]],
+            "Metrics": [{"Name": "batch_size", "Unit": "Count"},
+                        {"Name": "invocation_seconds_sum", "Unit": "Seconds"},
+                        {"Name": "invocation_seconds_count", "Unit": "Count"},
+                        {"Name": "invocation_seconds_max", "Unit": "Seconds"},
+                        {"Name": "records_total.stage=lambda", "Unit": "Count"}],
+        }],
+    }
+    # Every metric has its value at the top level, next to the dimensions
+    assert {key: value for key, value in document.items() if key != "_aws"} == {
+        "Function": "f", "Env": "dev", "batch_size": 500, "invocation_seconds_sum": 2.0,
+        "invocation_seconds_count": 2, "invocation_seconds_max": 1.5, "records_total.stage=lambda": 10}
+
+
+def test_emf_is_capped_at_100_metrics():
+    registry = Registry(enabled=True)
+    for i in range(150):
+        registry.counter(f"counter_{i:03d}").inc()
+    assert len(emf_document(registry)["_aws"]["CloudWatchMetrics"][0]["Metrics"]) == 100
+
+
+def test_emit_emf_prints_one_line_and_resets():
+    registry = Registry(enabled=True)
+    records = registry.counter("records_total")
+    records.inc(3)
+    lines = []
+    document = emit_emf(registry, dimensions={"Function": "f"}, write=lines.append)
+    assert len(lines) == 1 and "\n" not in lines[0]
+    assert json.loads(lines[0]) == document and document["records_total"] == 3
+    assert records.value == 0
+    emit_emf(registry, write=lines.append, reset=False)
+    assert "records_total" not in json.loads(lines[1])
+    assert math.isclose(json.loads(lines[1])["_aws"]["Timestamp"] / 1000, document["_aws"]["Timestamp"] / 1000,
+                        abs_tol=60)
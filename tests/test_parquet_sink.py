@@ -0,0 +1,131 @@
+"""
+Idempotent batch commits (parquet_commit.py) and compaction (compaction.py) on a local
+Spark session.
+"""
+import json
+
+import pytest
+
+pytest.importorskip("pyspark")
+
+from compaction import HadoopFS, LOCKS_DIR, compact_partition, partition_lock  # noqa: E402
+from parquet_commit import BatchCommitter  # noqa: E402
+from spark_transforms import write_partitioned  # noqa: E402
+
+PARTITION = ("2024", "10", "1")
+
+
+@pytest.fixture(scope="module")
+def spark():
+    from pyspark.sql import SparkSession
+
+    try:
+        session = SparkSession.builder.master("local[2]").appName("test-parquet-sink") \
+            .config("spark.sql.shuffle.partitions", "2").config("spark.ui.enabled", "false").getOrCreate()
+    except Exception as e:  # No Java runtime
+        pytest.skip(f"Spark is not available: {e}")
+    session.sparkContext.setLogLevel("ERROR")
+    yield session
+    session.stop()
+
+
+def readings(spark, start, count, day="1"):
+    return spark.createDataFrame(
+        [(f"r{i}", i % 7, float(i), "2024", "10", day) for i in range(start, start + count)],
+        "id string, cell bigint, ffwi double, year string, month string, day string")
+
+
+def ids(spark, path):
+    return sorted(row.id for row in spark.read.parquet(path).select("id").collect())
+
+
+def test_recommit_of_a_batch_is_a_no_op(spark, tmp_path):
+    table = str(tmp_path / "table")
+    committer = BatchCommitter(spark, table, "scope1")
+    files = committer.commit(readings(spark, 0, 50), 7, write_partitioned)
+    assert files and all(name.startswith("year=2024/month=10/day=1/b-scope1-7-") for name in files)
+    assert committer.commit(readings(spark, 0, 50), 7, write_partitioned) is None
+
+    # After a restart, the manifest on disk is what stops the replay
+    restarted = BatchCommitter(spark, table, "scope1")
+    assert restarted.recover() == []
+    assert restarted.commit(readings(spark, 0, 50), 7, write_partitioned) is None
+    assert ids(spark, table) == sorted(f"r{i}" for i in range(50))
+    assert sorted(HadoopFS(spark, table).data_files(f"{table}/year=2024/month=10/day=1")) == \
+        sorted(name.rsplit("/", 1)[1] for name in files)
+
+    # Another scope (another checkpoint) has its own batch ids
+    assert BatchCommitter(spark, table, "scope2").commit(readings(spark, 50, 10), 7, write_partitioned)
+    assert len(ids(spark, table)) == 60
+
+
+def test_old_manifests_are_pruned(spark, tmp_path, monkeypatch):
+    import parquet_commit
+
+    table = str(tmp_path / "table")
+    monkeypatch.setattr(parquet_commit, "PRUNE_INTERVAL", 4)
+    committer = BatchCommitter(spark, table, "scope1", retain=2)
+    assert BatchCommitter(spark, table, "scope2").retain == parquet_commit.DEFAULT_RETAINED_COMMITS
+    for batch in (8, 9, 10):
+        committer.commit(readings(spark, batch * 10, 10), batch, write_partitioned)
+    assert HadoopFS(spark, table).names(committer.commit_root) == ["10.json", "8.json", "9.json"]
+    # The fourth commit prunes, in numeric batch order
+    committer.commit(readings(spark, 110, 10), 11, write_partitioned)
+    assert HadoopFS(spark, table).names(committer.commit_root) == ["10.json", "11.json"]
+    assert committer.is_committed(11) and not committer.is_committed(9)
+    # Data files stay; only the manifests go
+    assert len(ids(spark, table)) == 40
+
+    committer.commit(readings(spark, 120, 10), 12, write_partitioned)
+    restarted = BatchCommitter(spark, table, "scope1", retain=2)
+    restarted.recover()
+    assert HadoopFS(spark, table).names(committer.commit_root) == ["11.json", "12.json"]
+
+
+def test_failed_attempt_is_rolled_back_on_recover(spark, tmp_path):
+    table = str(tmp_path / "table")
+
+    def crash_after_staging(df, path, mode):
+        write_partitioned(df, path, mode)
+        raise RuntimeError("executor lost")
+
+    with pytest.raises(RuntimeError):
+        BatchCommitter(spark, table, "scope1").commit(readings(spark, 0, 20), 3, crash_after_staging)
+    restarted = BatchCommitter(spark, table, "scope1")
+    assert restarted.recover() == ["3"]
+    assert restarted.commit(readings(spark, 0, 20), 3, write_partitioned)
+    assert ids(spark, table) == sorted(f"r{i}" for i in range(20))
+
+
+def test_compaction_keeps_every_row(spark, tmp_path):
+    table = str(tmp_path / "table")
+    for batch in range(5):
+        write_partitioned(readings(spark, batch * 20, 20), table, "append")
+    directory = f"{table}/year=2024/month=10/day=1"
+    assert len(HadoopFS(spark, table).data_files(directory)) == 5
+
+    stats = compact_partition(spark, table, PARTITION)
+    assert (stats["files_before"], stats["files_after"]) == (5, 1)
+    assert ids(spark, table) == sorted(f"r{i}" for i in range(100))
+    assert len(HadoopFS(spark, table).data_files(directory)) == 1
+    # Already compact, and the lock was released
+    assert compact_partition(spark, table, PARTITION) is None
+    assert HadoopFS(spark, table).names(f"{table}/{LOCKS_DIR}") == []
+
+
+def test_partition_lock(spark, tmp_path):
+    table = str(tmp_path / "table")
+    fs = HadoopFS(spark, table)
+    with partition_lock(fs, table, "year=2024/month=10/day=1"):
+        with pytest.raises(TimeoutError):
+            with partition_lock(fs, table, "year=2024/month=10/day=1", timeout=0, poll=0):
+                pass
+        # Other partitions are not blocked
+        with partition_lock(fs, table, "year=2024/month=10/day=2", timeout=0):
+            pass
+
+    # A lock left behind by a crashed holder is taken over once stale
+    fs.create_new(f"{table}/{LOCKS_DIR}/year=2024-month=10-day=1.lock",
+                  json.dumps({"owner": "crashed", "acquired_at": 0}))
+    with partition_lock(fs, table, "year=2024/month=10/day=1", timeout=0, stale=60):
+        pass
@@ -0,0 +1,111 @@
+"""
+Cell IDs, parents, neighbors and bounding boxes of the spatial grid.
+"""
+import random
+import warnings
+
+import numpy as np
+import pytest
+
+import spatial_grid
+from spatial_grid import INVALID_CELL, bbox_cell_range, bbox_cells, cell_center, cell_ids, cell_size, neighbors, parent
+
+
+def test_cells_contain_their_points():
+    rng = random.Random(3)
+    latitude = np.array([rng.uniform(-90, 90) for _ in range(1000)])
+    longitude = np.array([rng.uniform(-180, 180) for _ in range(1000)])
+    for resolution in (1, 5, 12, 26):
+        cells = cell_ids(latitude, longitude, resolution)
+        center_lat, center_lon = cell_center(cells)
+        assert np.all(np.abs(center_lat - latitude) <= cell_size(resolution) / 2)
+        assert np.all(np.abs(center_lon - longitude) <= cell_size(resolution) / 2)
+        assert np.all(cells >> spatial_grid.RESOLUTION_SHIFT == resolution)
+    with pytest.raises(ValueError):
+        cell_ids(0.0, 0.0, 27)
+
+
+def test_grid_edges_are_clamped():
+    # The poles and the antimeridian fall in the last row and column instead of past them
+    cells = 1 << 12
+    _, lat_index, lon_index = spatial_grid.decode(cell_ids([90.0, -90.0, 0.0, 0.0], [0.0, 0.0, 180.0, -180.0]))
+    assert lat_index.tolist()[:2] == [cells // 2 - 1, 0]
+    assert lon_index.tolist()[2:] == [cells - 1, 0]
+
+
+def test_missing_coordinates_have_no_cell():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        cells = cell_ids([np.nan, 10.0, np.inf, 38.5], [0.0, np.nan, 5.0, -121.25])
+        assert cells.tolist()[:3] == [INVALID_CELL] * 3
+        assert cells[3] == cell_ids(38.5, -121.25)
+        assert cell_ids(np.nan, 0.0) == INVALID_CELL
+        center_lat, center_lon = cell_center(cells)
+        assert np.isnan(center_lat[:3]).all() and np.isnan(center_lon[:3]).all()
+        assert parent(cells).tolist()[:3] == [INVALID_CELL] * 3
+        assert parent(cells, 5)[3] == cell_ids(38.5, -121.25, 5)
+    assert neighbors(INVALID_CELL) == []
+
+
+def test_parent_is_the_cell_at_the_coarser_resolution():
+    rng = random.Random(4)
+    latitude = np.array([rng.uniform(-90, 90) for _ in range(1000)])
+    longitude = np.array([rng.uniform(-180, 180) for _ in range(1000)])
+    cells = cell_ids(latitude, longitude, 12)
+    assert np.array_equal(parent(cells), cell_ids(latitude, longitude, 11))
+    for resolution in (1, 6, 12):
+        assert np.array_equal(parent(cells, resolution), cell_ids(latitude, longitude, resolution))
+    with pytest.raises(ValueError):
+        parent(cells, 13)
+    with pytest.raises(ValueError):
+        parent(cell_ids(0.0, 0.0, 1))
+
+
+def test_neighbors():
+    resolution = 12
+    size = cell_size(resolution)
+    cell = cell_ids(38.5, -121.25, resolution)
+    around = neighbors(cell)
+    lat, lon = cell_center(cell)
+    expected = {int(cell_ids(lat + d_lat * size, lon + d_lon * size, resolution))
+                for d_lat in (-1, 0, 1) for d_lon in (-1, 0, 1) if (d_lat, d_lon) != (0, 0)}
+    assert len(around) == 8 and set(around) == expected
+
+
+def test_neighbors_wrap_around_the_antimeridian():
+    east = cell_ids(10.0, 179.99)
+    west = cell_ids(10.0, -179.99)
+    assert west in neighbors(east) and east in neighbors(west)
+
+
+def test_neighbors_stop_at_the_poles():
+    rows = (1 << 12) // 2
+    for latitude, row, next_row in ((89.99, rows - 1, rows - 2), (-89.99, 0, 1)):
+        around = neighbors(cell_ids(latitude, 0.0))
+        # Two cells in the same row and three in the next one, none past the pole
+        assert sorted(int(spatial_grid.decode(c)[1]) for c in around) == sorted([row] * 2 + [next_row] * 3)
+    # Resolution 1: two cells, each the other's only neighbor
+    assert neighbors(cell_ids(0.0, -90.0, 1)) == [int(cell_ids(0.0, 90.0, 1))]
+
+
+def test_bounding_boxes():
+    box = (37.0, -123.0, 39.0, -120.0)
+    cells = bbox_cells(*box, resolution=8)
+    lo, hi = bbox_cell_range(*box, resolution=8)
+    assert cells[0] == lo and cells[-1] == hi
+    _, lat_lo, lon_lo = spatial_grid.decode(lo)
+    _, lat_hi, lon_hi = spatial_grid.decode(hi)
+    assert len(set(cells)) == (lat_hi - lat_lo + 1) * (lon_hi - lon_lo + 1)
+    rng = random.Random(5)
+    inside = cell_ids([rng.uniform(37, 39) for _ in range(500)], [rng.uniform(-123, -120) for _ in range(500)], 8)
+    assert set(inside.tolist()) <= set(cells)
+    outside = cell_ids([rng.uniform(-90, 90) for _ in range(2000)], [rng.uniform(-180, 180) for _ in range(2000)], 8)
+    assert all((lo <= c <= hi) for c in set(outside.tolist()) & set(cells))
+    # Reaching the poles and the antimeridian
+    assert bbox_cells(89.0, 179.0, 90.0, 180.0, resolution=8) == [int(cell_ids(89.5, 179.5, 8))]
+    assert bbox_cells(-90.0, -180.0, 90.0, 180.0, resolution=2) == sorted(
+        int(cell_ids(lat, lon, 2)) for lat in (-45.0, 45.0) for lon in (-135.0, -45.0, 45.0, 135.0))
+    with pytest.raises(ValueError):
+        bbox_cells(np.nan, 0.0, 1.0, 1.0)
+    with pytest.raises(ValueError):
+        bbox_cell_range(0.0, 0.0, 1.0, np.inf)
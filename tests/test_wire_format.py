@@ -0,0 +1,105 @@
+"""
+The binary wire format: encoding, decoding and format detection, also in the Spark UDF's
+batch decoder.
+"""
+import base64
+import json
+
+import numpy as np
+import pytest
+
+import wire_format
+
+READING = {"timestamp": "2024-10-01T12:30:15.250000", "latitude": 38.5, "longitude": -121.25,
+           "temperature": 85.5, "humidity": 12.0, "windSpeed": 7.75}
+MISSING = {"timestamp": None, "latitude": 40.0, "longitude": -120.0,
+           "temperature": None, "humidity": 100.0, "windSpeed": None}
+
+
+def other_schema(record, schema_id=2):
+    return record[:1] + bytes([schema_id]) + record[2:]
+
+
+def test_record_roundtrip():
+    record = wire_format.encode(READING)
+    assert len(record) == wire_format.RECORD_SIZE == 50
+    assert wire_format.decode(record) == READING
+    assert wire_format.decode(wire_format.encode(MISSING)) == MISSING
+    # Offsets are kept: 14:00+02:00 is 12:00 UTC
+    assert wire_format.decode(wire_format.encode({"timestamp": "2024-10-01T14:00:00+02:00"}))["timestamp"] \
+        == "2024-10-01T12:00:00"
+
+
+def test_loads_detects_the_format():
+    text = wire_format.encode_text(READING)
+    assert len(text) == wire_format.TEXT_SIZE
+    assert wire_format.loads(wire_format.encode(READING)) == READING
+    assert wire_format.loads(text) == READING
+    assert wire_format.loads(text.encode("ascii") + b"\n") == READING
+    assert wire_format.loads(json.dumps(READING).encode()) == READING
+
+
+def test_truncated_and_unknown_records_are_rejected():
+    record = wire_format.encode(READING)
+    with pytest.raises(ValueError):
+        wire_format.decode(record[:-1])
+    with pytest.raises(ValueError, match="schema id 2"):
+        wire_format.decode(other_schema(record))
+    with pytest.raises(ValueError):
+        wire_format.loads(record[:20])
+    # Truncated base64 is not valid base64, so it is not taken for a binary record
+    assert wire_format.binary_record(wire_format.encode_text(READING)[:-3]) is None
+    with pytest.raises(ValueError):
+        wire_format.decode_batch([record, record[:-1]])
+    with pytest.raises(ValueError, match="schema id"):
+        wire_format.decode_batch([record, other_schema(record)])
+
+
+def test_batch_roundtrip():
+    readings = {"timestamp": READING["timestamp"],
+                "latitude": np.array([38.5, 39.0]), "longitude": np.array([-121.25, -122.0]),
+                "temperature": np.array([85.5, np.nan]), "humidity": np.array([12.0, 30.0]),
+                "windSpeed": np.array([7.75, 0.0])}
+    records = wire_format.encode_batch(readings)
+    assert [wire_format.decode(record)["latitude"] for record in records] == [38.5, 39.0]
+    assert wire_format.decode(records[1])["temperature"] is None
+    columns = wire_format.decode_batch(records)
+    assert columns["timestamp"] == [READING["timestamp"]] * 2
+    for field in wire_format.FIELDS:
+        np.testing.assert_array_equal(columns[field], readings[field])
+    assert [wire_format.loads(text) for text in wire_format.encode_batch_text(readings)] \
+        == [wire_format.decode(record) for record in records]
+
+
+def test_text_buffer():
+    other = dict(READING, latitude=41.0)
+    lines = [wire_format.encode_text(READING), "%" * wire_format.TEXT_SIZE, wire_format.encode_text(other),
+             # Padding lost: not a record
+             wire_format.encode_text(READING)[:-1] + "A"]
+    valid, raw = wire_format.decode_text_buffer("".join(lines).encode("ascii"))
+    assert valid.tolist() == [True, False, True, False]
+    assert raw == wire_format.encode(READING) + wire_format.encode(other)
+
+
+def test_spark_decoder_leaves_unknown_schemas_to_validation():
+    pd = pytest.importorskip("pandas")
+    pytest.importorskip("pyarrow")
+    spark_wire = pytest.importorskip("spark_wire")
+
+    record = wire_format.encode(READING)
+    values = pd.Series([
+        record,
+        wire_format.encode_text(READING).encode("ascii"),
+        other_schema(record),
+        base64.b64encode(other_schema(record)),
+        json.dumps(READING).encode(),
+        record[:-1],
+        # Not the exact size: checked by the per-row fallback
+        wire_format.encode_text(READING).encode("ascii") + b"\n",
+        base64.b64encode(other_schema(record)) + b"\n",
+    ])
+    found, records = spark_wire.binary_records(values)
+    assert found.tolist() == [True, True, False, False, False, False, True, False]
+    columns = wire_format.batch_columns(records)
+    assert columns["timestamp"] == [READING["timestamp"]] * 3
+    np.testing.assert_array_equal(columns["latitude"], [READING["latitude"]] * 3)
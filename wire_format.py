@@ -0,0 +1,222 @@
+"""
+Compact binary wire format for sensor readings.
+
+A JSON reading is about 150 bytes, most of it key names and the ISO timestamp. The binary
+form is a fixed 50-byte little-endian struct:
+
+    magic      u8    0xC1 (never the first byte of JSON or UTF-8 text)
+    schema id  u8    layout version (SCHEMA_ID)
+    timestamp  i64   microseconds since the epoch, UTC (MISSING_TIMESTAMP when absent)
+    latitude, longitude, temperature, humidity, windSpeed   f64 each (NaN when absent)
+
+Records stay lossless (doubles, microsecond timestamps), so a decoded reading is the same
+dict the JSON producer would have sent. Where a record has to be a line of text (the
+Kinesis Agent log, the DStream receiver) it is carried base64-encoded (68 characters).
+
+Decoders auto-detect the format per record: binary, base64 binary or JSON, so producers
+can switch without coordinating with the consumers.
+"""
+import base64
+import binascii
+import struct
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import json_codec
+
+MAGIC = 0xC1
+SCHEMA_ID = 1
+FORMATS = ("json", "binary")
+
+FIELDS = ("latitude", "longitude", "temperature", "humidity", "windSpeed")
+MISSING_TIMESTAMP = -(1 << 63)
+
+RECORD = struct.Struct("<BBq5d")
+RECORD_DTYPE = np.dtype([("magic", "u1"), ("schema", "u1"), ("timestamp", "<i8")]
+                        + [(field, "<f8") for field in FIELDS])
+RECORD_SIZE = RECORD.size
+assert RECORD_DTYPE.itemsize == RECORD_SIZE
+
+_EPOCH = datetime(1970, 1, 1)
+_MAGIC_BYTE = bytes([MAGIC])
+# Base64 of a record always starts with this character (the magic byte's top six bits)
+_TEXT_PREFIX = base64.b64encode(_MAGIC_BYTE)[:1]
+
+
+def timestamp_micros(timestamp):
+    """
+    Microseconds since the epoch of an ISO timestamp (naive timestamps are UTC, as written by the simulators).
+    """
+    if timestamp is None:
+        return MISSING_TIMESTAMP
+    parsed = datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = parsed - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+# Readings of one producer tick share their timestamp, so formatting is mostly a cache hit
+@lru_cache(maxsize=4096)
+def iso_timestamp(micros):
+    """
+    Naive UTC ISO timestamp of microseconds since the epoch, formatted like datetime.isoformat().
+    """
+    if micros == MISSING_TIMESTAMP:
+        return None
+    return (_EPOCH + timedelta(microseconds=micros)).isoformat()
+
+
+def _float(value):
+    return float("nan") if value is None else float(value)
+
+
+def encode(reading):
+    """
+    Encode one reading dict into a binary record.
+    """
+    return RECORD.pack(MAGIC, SCHEMA_ID, timestamp_micros(reading.get("timestamp")),
+                       *(_float(reading.get(field)) for field in FIELDS))
+
+
+def encode_text(reading):
+    """
+    Encode one reading as a base64 line (for line-oriented transports).
+    """
+    return base64.b64encode(encode(reading)).decode("ascii")
+
+
+def encode_batch(readings):
+    """
+    Encode a columnar batch (load_generator.generate_readings: a shared ISO timestamp and
+    NumPy arrays) into a list of binary records, packed in one NumPy pass.
+    """
+    count = len(readings["latitude"])
+    batch = np.empty(count, dtype=RECORD_DTYPE)
+    batch["magic"] = MAGIC
+    batch["schema"] = SCHEMA_ID
+    batch["timestamp"] = timestamp_micros(readings["timestamp"])
+    for field in FIELDS:
+        batch[field] = readings[field]
+    buffer = batch.tobytes()
+    return [buffer[i:i + RECORD_SIZE] for i in range(0, len(buffer), RECORD_SIZE)]
+
+
+def encode_batch_text(readings):
+    return [base64.b64encode(record).decode("ascii") for record in encode_batch(readings)]
+
+
+def binary_record(data):
+    """
+    The binary record in data (raw or base64 text), or None if data is not in the binary format.
+    """
+    if isinstance(data, str):
+        data = data.encode("ascii", "ignore")
+    if data[:1] == _MAGIC_BYTE:
+        return data
+    if data[:1] == _TEXT_PREFIX:
+        try:
+            record = base64.b64decode(data.strip(), validate=True)
+        except (binascii.Error, ValueError):
+            return None
+        if record[:1] == _MAGIC_BYTE:
+            return record
+    return None
+
+
+def decode(record):
+    """
+    Decode one binary record into a reading dict.
+    """
+    if len(record) != RECORD_SIZE or record[0] != MAGIC:
+        raise ValueError("Not a binary weather record")
+    if record[1] != SCHEMA_ID:
+        raise ValueError(f"Unknown wire schema id {record[1]}")
+    _, _, micros, latitude, longitude, temperature, humidity, wind_speed = RECORD.unpack(record)
+    reading = {"timestamp": iso_timestamp(micros), "latitude": latitude, "longitude": longitude,
+               "temperature": temperature, "humidity": humidity, "windSpeed": wind_speed}
+    if latitude != latitude or longitude != longitude or temperature != temperature or humidity != humidity \
+            or wind_speed != wind_speed:
+        # NaN marks a missing value
+        for field in FIELDS:
+            if reading[field] != reading[field]:
+                reading[field] = None
+    return reading
+
+
+def loads(data):
+    """
+    Decode a record in any supported format (binary, base64 binary or JSON).
+    """
+    record = binary_record(data)
+    if record is not None:
+        return decode(record)
+    return json_codec.loads(data)
+
+
+def decode_batch(records):
+    """
+    Decode a list of binary records into columns in one NumPy pass.
+
+    Returns:
+    dict: "timestamp" (list of ISO strings or None) and a float array (NaN when absent) per field.
+    """
+    batch = np.frombuffer(b"".join(records), dtype=RECORD_DTYPE)
+    if len(batch) != len(records):
+        raise ValueError("Not a batch of binary weather records")
+    return batch_columns(batch)
+
+
+def batch_columns(batch):
+    """
+    Decode a RECORD_DTYPE array of records into columns (see decode_batch). Timestamps are
+    formatted by iso_timestamp, like decode() does, once per distinct value.
+    """
+    if np.any(batch["magic"] != MAGIC):
+        raise ValueError("Not a batch of binary weather records")
+    if np.any(batch["schema"] != SCHEMA_ID):
+        raise ValueError(f"Unknown wire schema id in batch: {sorted(set(batch['schema'].tolist()) - {SCHEMA_ID})}")
+    distinct, inverse = np.unique(batch["timestamp"], return_inverse=True)
+    formatted = [iso_timestamp(micros) for micros in distinct.tolist()]
+    columns = {"timestamp": [formatted[i] for i in inverse.tolist()]}
+    for field in FIELDS:
+        columns[field] = batch[field].copy()
+    return columns
+
+
+TEXT_SIZE = len(base64.b64encode(bytes(RECORD_SIZE)))
+# Characters of the base64 alphabet by code
+_BASE64_ALPHABET = np.zeros(256, dtype=bool)
+_BASE64_ALPHABET[np.frombuffer(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/", dtype=np.uint8)] = True
+
+
+def decode_text_buffer(buffer):
+    """
+    Decode base64 records (TEXT_SIZE characters each) stored back to back in one call.
+
+    Every record ends in one "=" of padding, which is replaced by a digit so that the
+    concatenation of the valid records is itself valid base64 (each record then decodes to
+    RECORD_SIZE + 1 bytes).
+
+    Returns:
+    tuple: (bool array of the records that are valid base64, their raw records back to back).
+    """
+    text = np.frombuffer(buffer, dtype=np.uint8).reshape(-1, TEXT_SIZE)
+    valid = (text[:, -1] == ord("=")) & _BASE64_ALPHABET[text[:, :-1]].all(axis=1)
+    text = text[valid]
+    text[:, -1] = ord("A")
+    decoded = np.frombuffer(base64.b64decode(text.tobytes()), dtype=np.uint8)
+    return valid, decoded.reshape(len(text), RECORD_SIZE + 1)[:, :RECORD_SIZE].tobytes()
+
+
+def kinesis_decoder(data):
+    """
+    Decoder for the DStream Kinesis receiver: text records as they are, binary ones as base64.
+    """
+    if data is None:
+        return None
+    if data[:1] == _MAGIC_BYTE:
+        return base64.b64encode(data).decode("ascii")
+    return data.decode("utf-8")